@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+AI请求调度 - 所有币种的大模型请求在有界线程池中并发执行，每个请求有截止时间
+
+超过截止时间的请求直接放弃等待 (还在排队的取消，已发出的结果到达后丢弃)，
+慢响应不会拖住整轮交易。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class AIDeadlineExceeded(TimeoutError):
+    """AI请求未在截止时间内返回"""
+
+
+class AIDispatcher:
+    """AI请求调度器 - 限制同时进行的请求数，超时的请求不再等待"""
+
+    def __init__(self, max_concurrency=4, timeout=45):
+        self.max_concurrency = max_concurrency  # 同时进行的AI请求上限
+        self.timeout = timeout  # 每个请求的截止时间(秒)，包含排队时间
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='ai')
+        self._lock = threading.Lock()
+        self.completed = 0  # 按时返回的请求数
+        self.dropped = 0  # 超时被丢弃的请求数
+
+    def call(self, func, *args, deadline=None, label='', **kwargs):
+        """提交请求并等待结果 (deadline 默认为 self.timeout 秒)，超过截止时间抛出 AIDeadlineExceeded"""
+        timeout = self.timeout if deadline is None else deadline
+        started = time.time()
+        future = self._pool.submit(func, *args, **kwargs)
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeout:
+            # 排队中的请求直接取消；已发出的请求在后台结束，结果丢弃
+            future.cancel()
+            with self._lock:
+                self.dropped += 1
+            raise AIDeadlineExceeded(f"{label} AI请求超过 {timeout}s 未返回，已丢弃")
+        with self._lock:
+            self.completed += 1
+        elapsed = time.time() - started
+        if label:
+            print(f"[{label}] AI响应耗时 {elapsed:.1f}s")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'completed': self.completed, 'dropped': self.dropped,
+                    'max_concurrency': self.max_concurrency, 'timeout': self.timeout}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+AI调用预筛 - 用本地已算好的指标判断币种本轮是否需要重新请求大模型
+
+与上次AI分析时相比，趋势状态、持仓方向、价格或成交量有明显变化，或距上次分析超过最长间隔时才请求；
+行情平静时跳过，并记录跳过次数和各触发原因的次数。
+"""
+import threading
+import time
+from collections import Counter
+
+
+class AIGate:
+    """
+    AI调用预筛
+
+    state 为本轮的行情状态:
+        price          最新价格
+        trends         趋势状态 (如 15分钟/4小时趋势)
+        position_side  持仓方向
+        price_change   最新收盘K线涨跌幅(%)
+        volume_ratio   最新收盘K线成交量 / 前几根均量
+    """
+
+    def __init__(self, max_staleness=900, price_move_pct=0.5, bar_move_pct=0.3, volume_ratio=2.0):
+        self.max_staleness = max_staleness  # 最长多少秒必须重新分析一次
+        self.price_move_pct = price_move_pct  # 相对上次分析时的价格变动阈值(%)
+        self.bar_move_pct = bar_move_pct  # 单根K线涨跌幅阈值(%)
+        self.volume_ratio = volume_ratio  # 成交量放大倍数阈值
+        self._last = {}  # symbol -> (上次分析时的状态, 时间)
+        self._lock = threading.Lock()
+        self.analyzed = 0  # 放行的次数
+        self.skipped = 0  # 跳过的次数
+        self.triggers = Counter()  # 放行原因 -> 次数
+
+    def _trigger(self, symbol, state):
+        last = self._last.get(symbol)
+        if last is None:
+            return '首次分析'
+        last_state, analyzed_at = last
+        if time.time() - analyzed_at >= self.max_staleness:
+            return '超过最长间隔'
+        if tuple(state.get('trends', ())) != tuple(last_state.get('trends', ())):
+            return '趋势变化'
+        if state.get('position_side') != last_state.get('position_side'):
+            return '持仓变化'
+        last_price = last_state.get('price')
+        if last_price and abs(state['price'] / last_price - 1) * 100 >= self.price_move_pct:
+            return '价格变动'
+        if abs(state.get('price_change', 0)) >= self.bar_move_pct:
+            return 'K线大幅波动'
+        if state.get('volume_ratio', 1) >= self.volume_ratio:
+            return '成交量放大'
+        return None
+
+    def should_analyze(self, symbol, state):
+        """返回 (是否请求AI, 原因)"""
+        with self._lock:
+            reason = self._trigger(symbol, state)
+            if reason is None:
+                self.skipped += 1
+                return False, '行情无明显变化'
+            self.analyzed += 1
+            self.triggers[reason] += 1
+            return True, reason
+
+    def mark_analyzed(self, symbol, state):
+        """AI分析成功后记录当时的状态，之后的变化都与它比较"""
+        with self._lock:
+            self._last[symbol] = (dict(state), time.time())
+
+    def stats(self):
+        with self._lock:
+            total = self.analyzed + self.skipped
+            return {
+                'analyzed': self.analyzed,
+                'skipped': self.skipped,
+                'skip_rate': self.skipped / total if total else 0.0,
+                'triggers': dict(self.triggers),
+            }
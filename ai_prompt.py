@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+AI提示词构建与回复解析
+
+提示词按 "静态在前" 排列: 角色、风险控制说明、分析要求和JSON格式放在系统提示词中，
+同一周期下逐字节不变，各币种每轮变化的数据放在最后的用户消息里，
+这样服务商 (DeepSeek 等) 的前缀缓存可以命中整个静态部分。
+"""
+import json
+import threading
+from functools import lru_cache
+
+# 多层次风险控制机制说明 (所有币种相同)
+RISK_LAYERS_TEXT = """🛡️ 四层风险控制机制:
+   第一层: 3分钟K线失效条件 (主要止损 - 立即执行)
+   第二层: 15分钟趋势判断 (避免震出 - 智能过滤)
+   第三层: 4小时趋势确认 (趋势保护 - 宽松容忍)
+   第四层: 传统价格止损 (最后防线 - 安全网)
+
+💡 当前风险策略:
+   - 如果15分钟强烈反转且4小时不配合: 提前平仓避免大幅回撤
+   - 如果4小时趋势配合: 放宽止损容忍度，让利润奔跑
+   - 优先保护本金，其次追求收益"""
+
+# 策略核心原则 (所有币种相同)
+STRATEGY_PRINCIPLES_TEXT = """策略核心原则：
+1. 多时间周期趋势确认，提高信号质量
+2. 动态仓位管理，根据信心度和历史表现调整杠杆
+3. 四层风险控制，严格执行失效条件
+4. 基于夏普指数优化风险收益比
+5. 趋势保护机制，让利润奔跑的同时控制风险"""
+
+SINGLE_RESPONSE_FORMAT = """请用以下JSON格式回复：
+{
+    "signal": "BUY|SELL|HOLD",
+    "reason": "分析理由",
+    "stop_loss": 具体价格,
+    "take_profit": 具体价格,
+    "confidence": "HIGH|MEDIUM|LOW"
+}"""
+
+BATCH_RESPONSE_FORMAT = """用户消息中包含多个币种时，对每个币种分别分析，
+请用以下JSON数组格式回复，每个币种一项，symbol 与用户消息中的币种名称完全一致：
+[
+    {
+        "symbol": "币种名称",
+        "signal": "BUY|SELL|HOLD",
+        "reason": "分析理由",
+        "stop_loss": 具体价格,
+        "take_profit": 具体价格,
+        "confidence": "HIGH|MEDIUM|LOW"
+    }
+]"""
+
+
+@lru_cache(maxsize=None)
+def build_system_prompt(timeframe, batch=False):
+    """
+    静态系统提示词 - 只依赖K线周期，同一进程内逐字节不变
+
+    单币种和批量模式共用前面的全部内容，只有最后的回复格式不同。
+    """
+    return f"""你是一个专业的量化交易分析师，专注于{timeframe}周期趋势分析。请结合K线形态和技术指标做出判断。你的分析将帮助一位需要为母亲���病筹钱的交易员，请务必认真负责。
+
+【智能交易策略背景】
+用户消息中会给出每个币种基于历史交易数据的深度分析 (历史交易表现、风险调整收益、实时多周期趋势)、最近K线、技术指标、上次信号和当前行情。
+
+【多层次风险控制系统】
+{RISK_LAYERS_TEXT}
+
+{STRATEGY_PRINCIPLES_TEXT}
+
+【分析要求】
+请结合历史交易表现、K线形态和技术指标做出判断：
+1. 基于{timeframe}K线趋势和技术指标给出交易信号: BUY(买入) / SELL(卖出) / HOLD(观望)
+2. 简要分析理由（考虑趋势连续性、支撑阻力、成交量等因素）
+3. 基于技术分析建议合理的止损价位
+4. 基于技术分析建议合理的止盈价位
+5. 评估信号信心程度
+
+{BATCH_RESPONSE_FORMAT if batch else SINGLE_RESPONSE_FORMAT}"""
+
+
+def build_symbol_block(symbol, context):
+    """单个币种本轮的动态数据 (放在用户消息中，位于静态前缀之后)"""
+    return f"""==================== {symbol} ====================
+【历史交易表现】
+{context['performance_text']}
+
+【风险调整收益分析】
+{context['sharpe_analysis']}
+
+{context['trend_text']}
+
+{context['kline_text']}
+{context['indicator_text']}
+{context['signal_text']}
+
+{context['market_text']}
+"""
+
+
+def build_user_prompt(contexts):
+    """用户消息: {symbol: context} 中各币种的动态数据"""
+    if len(contexts) == 1:
+        header = "请分析以下币种并按系统提示中的JSON格式回复：\n\n"
+    else:
+        header = f"请对以下 {len(contexts)} 个币种分别分析，并按系统提示中的JSON数组格式回复：\n\n"
+    return header + "\n".join(build_symbol_block(symbol, context) for symbol, context in contexts.items())
+
+
+def _usage_value(usage, name):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def cached_prompt_tokens(usage):
+    """
+    从 API 返回的 usage 中读取命中前缀缓存的输入 token 数
+
+    DeepSeek: usage.prompt_cache_hit_tokens；OpenAI 格式: usage.prompt_tokens_details.cached_tokens
+    """
+    hit = _usage_value(usage, 'prompt_cache_hit_tokens')
+    if hit is not None:
+        return hit
+    details = _usage_value(usage, 'prompt_tokens_details')
+    return _usage_value(details, 'cached_tokens') or 0
+
+
+class PromptCacheStats:
+    """统计输入 token 和前缀缓存命中的 token"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, response):
+        """记录一次响应的 usage，返回 (输入token数, 缓存命中token数)"""
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = _usage_value(usage, 'prompt_tokens') or 0
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached
+        return prompt_tokens, cached
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'hit_rate': self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
+
+
+VALID_SIGNALS = ('BUY', 'SELL', 'HOLD')
+VALID_CONFIDENCE = ('HIGH', 'MEDIUM', 'LOW')
+
+
+def _price_field(value):
+    """止损/止盈价格转为数字，缺失或无法解析时为 0 (不设置)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def normalize_signal(item):
+    """
+    校验并补全单个信号，信号不合法时返回 None
+
+    execute_trade 直接读取 signal/confidence/reason：信心程度缺失或不合法时按 LOW 处理，
+    理由缺失时为空字符串，止损止盈统一为数字。
+    """
+    if not isinstance(item, dict) or str(item.get('signal', '')).upper() not in VALID_SIGNALS:
+        return None
+    item['signal'] = str(item['signal']).upper()
+    confidence = str(item.get('confidence') or '').upper()
+    item['confidence'] = confidence if confidence in VALID_CONFIDENCE else 'LOW'
+    item['reason'] = str(item.get('reason') or '')
+    item['stop_loss'] = _price_field(item.get('stop_loss'))
+    item['take_profit'] = _price_field(item.get('take_profit'))
+    return item
+
+
+def parse_signal(text):
+    """解析单个币种的 JSON 信号，无法解析或信号不合法时返回 None"""
+    start_idx = text.find('{')
+    end_idx = text.rfind('}') + 1
+    if start_idx == -1 or end_idx == 0:
+        return None
+    try:
+        return normalize_signal(json.loads(text[start_idx:end_idx]))
+    except ValueError:
+        return None
+
+
+def parse_batch_signals(text, symbols):
+    """
+    解析批量模式的 JSON 数组，返回 {symbol: signal_data}
+
+    只保留请求中的币种且信号合法的条目 (缺失字段按 normalize_signal 补全)，缺失的币种由调用方单独重新分析；
+    整体无法解析时返回空字典。
+    """
+    start_idx = text.find('[')
+    end_idx = text.rfind(']') + 1
+    if start_idx == -1 or end_idx == 0:
+        return {}
+    try:
+        items = json.loads(text[start_idx:end_idx])
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    wanted = {symbol.upper(): symbol for symbol in symbols}
+    signals = {}
+    for item in items:
+        if normalize_signal(item) is None:
+            continue
+        symbol = wanted.get(str(item.get('symbol', '')).upper())
+        if symbol and symbol not in signals:
+            item['symbol'] = symbol
+            signals[symbol] = item
+    return signals
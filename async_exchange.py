@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+异步交易所客户端 - 基于 ccxt.async_support，在后台事件循环线程中运行
+
+所有请求共用一个 aiohttp 会话 (连接保持复用)。同步代码通过 run()/gather() 提交协程，
+一个事件循环可以同时挂起几十个交易所请求，慢请求不会阻塞其他请求。
+"""
+import asyncio
+import threading
+
+import aiohttp
+
+from market_data import RateLimitedExchange
+
+# 同步交易所对象中需要带到异步客户端的 options
+COPIED_OPTIONS = ('defaultType', 'defaultSubType', 'fetchPositions')
+
+
+class AsyncExchangeClient:
+    """
+    异步交易所客户端
+
+    在事件循环中: await client.fetch_ohlcv(...) (未定义的属性转发给 ccxt 异步交易所对象)
+    在同步代码中: client.run(coro) 或 client.gather([coro, ...]) 等待结果
+    传入 limiter 时请求类方法与同步请求共用同一个 RateLimiter 预算。
+    """
+
+    def __init__(self, exchange_id, config, max_connections=50, keepalive_timeout=60, factory=None, limiter=None):
+        self.exchange_id = exchange_id
+        self.limiter = limiter  # 与同步请求共享的 RateLimiter (为空时不限速)
+        self.max_connections = max_connections  # 连接池上限
+        self.keepalive_timeout = keepalive_timeout  # 空闲连接保持时间(秒)
+        self._config = dict(config)
+        self._factory = factory  # 创建异步交易所对象的函数 (默认 ccxt.async_support)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-exchange', daemon=True)
+        self._thread.start()
+        self.session = None
+        self.exchange = None
+        self.exchange = self.run(self._create())
+
+    @classmethod
+    def from_exchange(cls, exchange, **kwargs):
+        """按同步 ccxt 交易所对象的配置 (API密钥、options、代理) 创建异步客户端"""
+        options = getattr(exchange, 'options', None) or {}
+        config = {
+            'apiKey': exchange.apiKey,
+            'secret': exchange.secret,
+            'password': getattr(exchange, 'password', None),
+            'options': {name: options[name] for name in COPIED_OPTIONS if name in options},
+            'enableRateLimit': True,
+        }
+        proxy = (getattr(exchange, 'proxies', None) or {}).get('https')
+        if proxy:
+            config['aiohttp_proxy'] = proxy
+        return cls(exchange.id, config, **kwargs)
+
+    async def _create(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout,
+                                         enable_cleanup_closed=True)
+        self.session = aiohttp.ClientSession(connector=connector, trust_env=True)
+        config = dict(self._config, session=self.session)
+        if self._factory is not None:
+            return self._factory(config)
+        import ccxt.async_support as ccxt_async
+        return getattr(ccxt_async, self.exchange_id)(config)
+
+    def __getattr__(self, name):
+        if name in ('exchange', 'limiter') or self.exchange is None:
+            raise AttributeError(name)
+        attr = getattr(self.exchange, name)
+        if self.limiter is None or not callable(attr) or not name.startswith(RateLimitedExchange.REQUEST_PREFIXES):
+            return attr
+
+        # 请求类方法先从共享令牌桶取令牌，与同步请求共用同一个请求预算
+        async def limited(*args, **kwargs):
+            await self.limiter.acquire_async()
+            return await attr(*args, **kwargs)
+        return limited
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """在后台事件循环中执行协程并等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def gather(self, coros, timeout=None):
+        """并发执行多个协程，按顺序返回结果 (失败的位置为异常对象)"""
+        async def gather_all():
+            return await asyncio.gather(*coros, return_exceptions=True)
+        return self.run(gather_all(), timeout)
+
+    def close(self):
+        """关闭交易所对象和共享会话，停止事件循环"""
+        async def close_all():
+            if self.exchange is not None and hasattr(self.exchange, 'close'):
+                await self.exchange.close()
+            if self.session is not None and not self.session.closed:
+                await self.session.close()
+        try:
+            self.run(close_all(), timeout=10)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
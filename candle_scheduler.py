@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+K线收盘对齐调度器 - 按交易所时间在每根K线收盘后触发任务
+
+- 定期重新校准交易所时钟偏差 (ExchangeClock)
+- 每个任务绑定一个K线周期，在收盘 + delay 秒后执行
+- 多个币种按 stagger 秒错开执行，避免同一时刻集中请求
+- 错过的收盘时刻 (进程暂停等) 只补执行最近的一次，更早的直接跳过
+- 任务在线程池中执行，慢任务不会推迟其他币种的执行时间；不区分币种的任务上一次还在执行时跳过本次
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class _Job:
+    def __init__(self, name, timeframe_ms, func, symbols, delay_ms, stagger_ms, next_close):
+        self.name = name
+        self.timeframe_ms = timeframe_ms
+        self.func = func
+        self.symbols = symbols  # None 表示不区分币种，每次收盘调用 func() 一次
+        self.delay_ms = delay_ms
+        self.stagger_ms = stagger_ms
+        self.next_close = next_close  # 下一个待处理的收盘时间 (交易所时间)
+        self.pending = []  # 本次收盘还未执行的 (执行时间, symbol)
+        self.run_count = 0
+        self.skipped = 0  # 被跳过的收盘次数
+        self.future = None  # 最近一次提交的执行 (不区分币种的任务用来避免重叠执行)
+
+
+class CandleScheduler:
+    """K线收盘对齐调度器 - 调用方循环调用 run_pending()，到期的任务提交到线程池执行"""
+
+    def __init__(self, clock, resync_interval=600, max_workers=4):
+        self.clock = clock
+        self.resync_interval = resync_interval  # 重新校准交易所时钟的间隔(秒)
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='candle-job')
+        self._futures = set()
+
+    def every_close(self, timeframe_ms, func, symbols=None, delay=3, stagger=1, name=None):
+        """
+        注册任务: 每根K线收盘 delay 秒后执行
+
+        symbols 不为空时第 i 个币种在 delay + i * stagger 秒执行，
+        同一时刻到期的币种合并为一次 func(symbols) 调用
+        """
+        job = _Job(name or getattr(func, '__name__', 'job'), timeframe_ms, func,
+                   list(symbols) if symbols else None, int(delay * 1000), int(stagger * 1000),
+                   self.clock.next_close(timeframe_ms))
+        with self._lock:
+            self.jobs.append(job)
+        return job
+
+    def _maybe_resync(self):
+        synced_at = self.clock.synced_at
+        if synced_at is not None and time.time() - synced_at < self.resync_interval:
+            return
+        try:
+            self.clock.sync()
+        except Exception as e:
+            # 校准失败时沿用上次的偏差，下个间隔再试
+            self.clock.synced_at = time.time()
+            print(f"校准交易所时钟失败: {e}")
+
+    def _schedule(self, job, close_ms):
+        """为一个收盘时刻生成待执行列表"""
+        start = close_ms + job.delay_ms
+        if job.symbols is None:
+            job.pending = [(start, None)]
+        else:
+            job.pending = [(start + i * job.stagger_ms, symbol) for i, symbol in enumerate(job.symbols)]
+
+    def _due(self, job, now_ms):
+        """取出到期的执行项，必要时推进到最近的收盘时刻"""
+        if not job.pending:
+            if now_ms < job.next_close + job.delay_ms:
+                return []
+            # 错过多根K线时只处理最近收盘的一根
+            latest_close = now_ms - now_ms % job.timeframe_ms
+            if now_ms < latest_close + job.delay_ms:
+                latest_close -= job.timeframe_ms
+            missed = (latest_close - job.next_close) // job.timeframe_ms
+            if missed > 0:
+                job.skipped += missed
+                print(f"⏭️ {job.name}: 跳过 {missed} 个错过的 {job.timeframe_ms // 60000}m 收盘时刻")
+            self._schedule(job, max(latest_close, job.next_close))
+            job.next_close = max(latest_close, job.next_close) + job.timeframe_ms
+
+        due = [item for item in job.pending if item[0] <= now_ms]
+        job.pending = [item for item in job.pending if item[0] > now_ms]
+        return due
+
+    def run_pending(self):
+        """提交所有到期的任务 (不等待执行完成)，返回本次提交的任务数"""
+        self._maybe_resync()
+        now_ms = self.clock.now_ms()
+        with self._lock:
+            batches = []
+            for job in self.jobs:
+                due = self._due(job, now_ms)
+                if due:
+                    batches.append((job, [symbol for _, symbol in due]))
+
+        submitted = 0
+        for job, symbols in batches:
+            if job.symbols is None and job.future is not None and not job.future.done():
+                job.skipped += 1
+                print(f"⏭️ {job.name}: 上一次仍在执行，跳过本次收盘")
+                continue
+            job.run_count += 1
+            future = self._executor.submit(self._run_job, job, symbols)
+            job.future = future
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._discard_future)
+            submitted += 1
+        return submitted
+
+    def _run_job(self, job, symbols):
+        try:
+            if job.symbols is None:
+                job.func()
+            else:
+                job.func(symbols)
+        except Exception as e:
+            print(f"❌ 定时任务 {job.name} 执行失败: {e}")
+
+    def _discard_future(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def join(self, timeout=None):
+        """等待已提交的任务执行完成"""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout)
+
+    def shutdown(self, wait_running=True):
+        """停止线程池"""
+        self._executor.shutdown(wait=wait_running)
+
+    def seconds_until_next(self):
+        """距离下一个执行项的秒数 (用于主循环的等待时间)"""
+        now_ms = self.clock.now_ms()
+        with self._lock:
+            upcoming = []
+            for job in self.jobs:
+                if job.pending:
+                    upcoming.append(min(item[0] for item in job.pending))
+                else:
+                    upcoming.append(job.next_close + job.delay_ms)
+        if not upcoming:
+            return None
+        return max(0.0, (min(upcoming) - now_ms) / 1000)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+K线列式存储 - 每个 (symbol, timeframe) 一个目录，每列一个只追加的二进制文件
+
+目录结构: <root>/<symbol>/<timeframe>/{timestamp,open,high,low,close,volume}.bin
+读取时用 numpy.memmap 映射文件，只取需要的尾部或时间区间，不会把整段历史读进内存。
+同一个存储目录只能有一个写入进程，其他进程可以同时读取。
+"""
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_STORE_DIR = os.getenv('CANDLE_STORE_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'candles'))
+
+COLUMNS = (
+    ('timestamp', np.dtype('<i8')),
+    ('open', np.dtype('<f8')),
+    ('high', np.dtype('<f8')),
+    ('low', np.dtype('<f8')),
+    ('close', np.dtype('<f8')),
+    ('volume', np.dtype('<f8')),
+)
+
+
+def _safe_name(symbol):
+    """交易对转换为目录名: BTC/USDT:USDT -> BTC-USDT-USDT"""
+    return symbol.replace('/', '-').replace(':', '-')
+
+
+class CandleStore:
+    """磁盘K线存储 - 只追加已收盘K线 (时间戳严格递增)，按尾部或时间区间读取"""
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self._last_ts = {}  # (symbol, timeframe) -> 已写入的最新时间戳 (写入方使用)
+        self._lock = threading.Lock()
+
+    def _path(self, symbol, timeframe, column):
+        return os.path.join(self.root, _safe_name(symbol), timeframe, f"{column}.bin")
+
+    def _rows(self, symbol, timeframe):
+        """完整写入的行数 (各列长度的最小值)"""
+        rows = None
+        for name, dtype in COLUMNS:
+            path = self._path(symbol, timeframe, name)
+            size = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+            rows = size if rows is None else min(rows, size)
+        return rows
+
+    def _column(self, symbol, timeframe, name, dtype, rows):
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(symbol, timeframe, name), dtype=dtype, mode='r', shape=(rows,))
+
+    def _open_for_append(self, key):
+        """首次写入前截断写了一半的尾部 (上次写入中断时各列长度可能不一致)"""
+        if key in self._last_ts:
+            return
+        symbol, timeframe = key
+        os.makedirs(os.path.dirname(self._path(symbol, timeframe, 'timestamp')), exist_ok=True)
+        rows = self._rows(symbol, timeframe)
+        for name, dtype in COLUMNS:
+            path = self._path(symbol, timeframe, name)
+            if os.path.exists(path) and os.path.getsize(path) != rows * dtype.itemsize:
+                os.truncate(path, rows * dtype.itemsize)
+        timestamps = self._column(symbol, timeframe, 'timestamp', COLUMNS[0][1], rows)
+        self._last_ts[key] = int(timestamps[-1]) if rows else None
+
+    def append(self, symbol, timeframe, candles):
+        """追加已收盘K线 (只写入比已有数据更新的K线)，返回写入的根数"""
+        key = (symbol, timeframe)
+        with self._lock:
+            self._open_for_append(key)
+            last_ts = self._last_ts[key]
+            rows = []
+            for candle in candles:
+                if last_ts is None or candle[0] > last_ts:
+                    rows.append(candle[:6])
+                    last_ts = candle[0]
+            if not rows:
+                return 0
+
+            data = np.array(rows, dtype=np.float64)
+            # 时间戳列最后写入，读取方按最短列计算行数，不会读到半行
+            for i, (name, dtype) in reversed(list(enumerate(COLUMNS))):
+                column = np.array([int(r[0]) for r in rows], dtype=dtype) if i == 0 else data[:, i].astype(dtype)
+                with open(self._path(symbol, timeframe, name), 'ab') as f:
+                    f.write(column.tobytes())
+            self._last_ts[key] = last_ts
+            return len(rows)
+
+    def count(self, symbol, timeframe):
+        """已存储的K线数"""
+        return self._rows(symbol, timeframe)
+
+    def last_timestamp(self, symbol, timeframe):
+        """最新一根K线的时间戳 (没有数据返回None)"""
+        rows = self._rows(symbol, timeframe)
+        if rows == 0:
+            return None
+        return int(self._column(symbol, timeframe, 'timestamp', COLUMNS[0][1], rows)[-1])
+
+    def columns(self, symbol, timeframe, since=None, until=None, limit=None):
+        """
+        按时间区间读取为 numpy 列 {'timestamp': ..., 'close': ...}
+
+        since/until: 毫秒时间戳，区间为 [since, until)；limit: 只取区间内最后 limit 根
+        """
+        rows = self._rows(symbol, timeframe)
+        timestamps = self._column(symbol, timeframe, 'timestamp', COLUMNS[0][1], rows)
+        start = 0 if since is None else int(np.searchsorted(timestamps, since, side='left'))
+        end = rows if until is None else int(np.searchsorted(timestamps, until, side='left'))
+        if limit is not None:
+            start = max(start, end - limit)
+        return {name: np.array(self._column(symbol, timeframe, name, dtype, rows)[start:end])
+                for name, dtype in COLUMNS}
+
+    def load(self, symbol, timeframe, since=None, until=None, limit=None):
+        """按时间区间读取K线 (与 fetch_ohlcv 相同格式)"""
+        cols = self.columns(symbol, timeframe, since, until, limit)
+        values = np.column_stack([cols[name].astype(np.float64) for name, _ in COLUMNS]).tolist()
+        for candle, ts in zip(values, cols['timestamp'].tolist()):
+            candle[0] = ts
+        return values
+
+    def tail(self, symbol, timeframe, limit):
+        """最近 limit 根K线"""
+        return self.load(symbol, timeframe, limit=limit)
@@ -2,13 +2,15 @@
 import os
 import sys
 import time
-import schedule
+import math
+import threading
 from openai import OpenAI
 import ccxt
 import pandas as pd
 from datetime import datetime
 import json
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # 设置控制台输出编码为UTF-8
@@ -112,9 +114,93 @@ TRADE_CONFIG = {
         'XRP/USDT': 2.30,    # 2.30以下失效
         'DOGE/USDT': 0.180,  # 0.180以下失效
         'BNB/USDT': 1060     # 1060以下失效
-    }
+    },
+    # 并发执行: 各币种的 获取数据 -> AI分析 -> 执行交易 流程在有界线程池中并行 (设为1恢复串行)
+    'max_workers': 6,
+    'rate_limit_per_sec': 10,  # 所有线程共享的交易所请求预算 (次/秒)
+    'indicator_warmup': 100,  # 指标引擎首次预热使用的已收盘K线数量
+    'batch_indicators': True,  # 每轮先对所有币种做一次向量化指标计算 (仅用于交易循环的多币种预计算，单币种分析使用增量引擎)
+    'market_stream': True,  # WebSocket行情推送: K线收盘即触发分析 (断线时退回定时轮询)
+    'candle_store': True,  # 已收盘K线写入磁盘 (data/candles)，重启后指标直接从磁盘预热
+    'close_delay': 3,  # K线收盘后等待的秒数再分析 (等交易所生成最终K线)
+    'symbol_stagger': 1,  # 定时轮询时各币种拉取K线错开的秒数 (避免收盘时刻集中请求)
+    'clock_resync_interval': 600,  # 重新校准交易所时钟的间隔(秒)
+    'async_exchange': True,  # 每轮开始时用异步客户端并发预取所有币种的K线和持仓
+    'ai_max_concurrency': 6,  # 同时进行的AI请求上限 (各币种的AI请求并发发出)
+    'ai_timeout': 45,  # 单个AI请求的截止时间(秒，含排队)，超时的响应丢弃，本轮跳过该币种
+    'ai_batch_prompt': False,  # 批量模式: 所有币种合并为一次AI请求 (共用策略背景，解析失败的币种退回单独请求)
+    'ai_batch_timeout': 90,  # 批量AI请求的截止时间(秒)，回复包含所有币种，比单个请求长
+    'signal_cache': True,  # 行情状态指纹 (价格档位、多周期趋势、持仓方向、15分钟/4小时K线) 不变时复用上次AI信号
+    'signal_cache_ttl': 600,  # 缓存信号的有效期(秒)
+    'signal_cache_price_step': 0.2,  # 价格分档间隔(%)，同一档内视为价格未变
+    # AI调用预筛: 趋势、持仓、价格或成交量有明显变化时才请求AI，平静行情跳过 (有持仓时风控照常执行)
+    'ai_gate': True,
+    'ai_gate_max_staleness': 900,  # 最长多少秒必须重新请求一次AI
+    'ai_gate_price_move': 0.5,  # 相对上次AI分析时的价格变动阈值(%)
+    'ai_gate_bar_move': 0.3,  # 最新收盘K线涨跌幅阈值(%)
+    'ai_gate_volume_ratio': 2.0,  # 最新收盘K线成交量相对前几根均量的放大倍数阈值
 }
 
+from market_data import (
+    CandleCache, BarAggregator, ExchangeClock, PositionSnapshot, SymbolRegistry, LeverageState,
+    RateLimiter, RateLimitedExchange
+)
+from indicators import IndicatorEngine, batch_indicators
+from market_stream import MarketStream, OKXStreamProtocol, BinanceStreamProtocol
+from market_snapshot import SnapshotWriter
+from candle_store import CandleStore
+from candle_scheduler import CandleScheduler
+from async_exchange import AsyncExchangeClient
+from ai_dispatch import AIDispatcher, AIDeadlineExceeded
+from ai_prompt import (
+    build_system_prompt, build_user_prompt, parse_signal, parse_batch_signals, PromptCacheStats
+)
+from signal_cache import SignalCache
+from ai_gate import AIGate
+
+# 交易所时钟: 按交易所服务器时间判断K线收盘 (setup_exchange 中校准)
+# 直接使用原始连接请求服务器时间，限流排队和代理转发的耗时不计入往返时间
+exchange_clock = ExchangeClock(exchange)
+
+# 所有线程共享同一个交易所请求预算: 同步请求和异步客户端 (start_async_exchange) 共用同一个令牌桶
+rate_limiter = RateLimiter(TRADE_CONFIG['rate_limit_per_sec'])
+exchange = RateLimitedExchange(exchange, rate_limiter)
+
+# 行情代理进程在运行时，K线和Ticker从代理读取 (与其他策略进程共享)
+# 首次请求行情时才连接: web_ui 先导入本模块再启动代理，导入时代理可能还未运行
+from market_broker import connect_broker, BrokeredExchange
+exchange = connect_broker(exchange, lazy=True)
+
+# K线增量缓存 (所有分析函数共享)，启用磁盘存储时首次读取从磁盘预热，只向交易所补齐缺少的K线
+# 请求失败或推送断线留下的缺口在后台分页补齐，指标计算不会用到不连续的K线
+candle_cache = CandleCache(exchange, store=CandleStore() if TRADE_CONFIG['candle_store'] else None,
+                           background_backfill=True, clock=exchange_clock)
+
+# 15m/4h K线由基础周期K线在本地合成 (每个周期只在首次使用时从交易所加载历史)
+bar_aggregator = BarAggregator(candle_cache, TRADE_CONFIG['timeframe'])
+
+# 增量指标引擎 (15m/4h 指标随K线收盘 O(1) 更新)
+indicator_engine = IndicatorEngine()
+
+# AI请求调度: trading_bot、web_ui 自动交易和手动分析的AI请求都经过这里，并发数和截止时间统一控制
+ai_dispatcher = AIDispatcher(TRADE_CONFIG['ai_max_concurrency'], TRADE_CONFIG['ai_timeout'])
+
+# AI信号缓存: 行情状态指纹相同时跳过大模型请求
+signal_cache = SignalCache(TRADE_CONFIG['signal_cache_ttl'], TRADE_CONFIG['signal_cache_price_step'])
+
+# 输入token和服务商前缀缓存命中统计
+prompt_cache_stats = PromptCacheStats()
+
+# AI调用预筛: 行情平静的币种本轮不请求AI
+ai_gate = AIGate(TRADE_CONFIG['ai_gate_max_staleness'], TRADE_CONFIG['ai_gate_price_move'],
+                 TRADE_CONFIG['ai_gate_bar_move'], TRADE_CONFIG['ai_gate_volume_ratio'])
+
+# 交易对注册表 (首次使用时从 load_markets() 构建)
+symbol_registry = SymbolRegistry(exchange)
+
+# 杠杆状态表 (杠杆未变化时跳过 set_leverage 请求)
+leverage_state = LeverageState(exchange, normalize=symbol_registry.canonical)
+
 # 全局变量 - 每个币种独立管理
 price_history = {}
 signal_history = {}
@@ -123,6 +209,10 @@ kline_closes = {}  # 存储3分钟K线收盘价历史
 trade_performance = {}  # 交易性能追踪
 portfolio_returns = {}  # 组合收益率历史（用于计算夏普指数）
 trend_analysis = {}  # 多周期趋势分析数据
+market_stream = None  # WebSocket行情推送 (main 中启动)
+trading_cycle_lock = threading.Lock()  # 定时轮询和K线收盘推送触发的交易轮次不重叠执行
+async_exchange = None  # 异步交易所客户端 (main 中创建)
+snapshot_writer = None  # 共享内存行情快照 (main 中启动，web_ui 和其他策略进程读取)
 
 # Web UI 通信支持
 import requests
@@ -153,6 +243,13 @@ def send_log_to_web_ui(log_type, symbol, action, message, success=True, details=
         # 静默处理，不影响策略运行
 
 
+def get_trade_symbol(symbol):
+    """转换为下单/行情使用的交易对格式 (OKX合约需要使用 BTC/USDT:USDT 格式)"""
+    if EXCHANGE_TYPE == 'okx':
+        return symbol_registry.trade_symbol(symbol)
+    return symbol
+
+
 def check_invalidation_condition(symbol, current_price):
     """检查DeepSeek策略的失效条件"""
     if symbol not in TRADE_CONFIG['invalidation_levels']:
@@ -170,12 +267,12 @@ def check_invalidation_condition(symbol, current_price):
 def check_kline_close(symbol):
     """检查3分钟K线收盘价是否满足失效条件"""
     try:
-        # 获取最近3根3分钟K线数据
-        ohlcv = exchange.fetch_ohlcv(symbol, '3m', limit=3)
+        # 获取最近3根已收盘的3分钟K线 (未收盘K线的最新价不是收盘价)
+        ohlcv = candle_cache.get_closed_candles(get_trade_symbol(symbol), '3m', 3)
         if not ohlcv or len(ohlcv) < 3:
             return False, "无法获取K线数据"
 
-        # 最新K线的收盘价
+        # 最新已收盘K线的收盘价
         latest_close = ohlcv[-1][4]  # [timestamp, open, high, low, close, volume]
 
         # 检查最新收盘价是否触发失效条件
@@ -195,218 +292,220 @@ def check_kline_close(symbol):
 def analyze_15m_trend(symbol):
     """分析15分钟K线趋势，避免被短期波动震出"""
     try:
-        # 获取最近20根15分钟K线数据 (5小时数据)
-        ohlcv = exchange.fetch_ohlcv(symbol, '15m', limit=20)
+        # 获取已收盘的15分钟K线，指标由增量引擎维护 (首次使用时预热)
+        trade_symbol = get_trade_symbol(symbol)
+        ohlcv = bar_aggregator.get_closed_candles(trade_symbol, '15m', TRADE_CONFIG['indicator_warmup'])
         if not ohlcv or len(ohlcv) < 10:
             return "neutral", "数据不足", {}
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-
-        # 计算技术指标
-        df['sma_5'] = df['close'].rolling(window=5).mean()
-        df['sma_10'] = df['close'].rolling(window=10).mean()
-        df['ema_20'] = df['close'].ewm(span=20).mean()
-
-        # 计算RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        df['rsi'] = 100 - (100 / (1 + rs))
-
-        # 获取最新数据
-        latest = df.iloc[-1]
-        prev = df.iloc[-2]
-
-        # 趋势判断逻辑
-        trend_signals = []
-
-        # 均线趋势
-        if latest['sma_5'] > latest['sma_10'] > latest['ema_20']:
-            trend_signals.append("bullish_ma")
-        elif latest['sma_5'] < latest['sma_10'] < latest['ema_20']:
-            trend_signals.append("bearish_ma")
-
-        # RSI超买超卖
-        if latest['rsi'] > 70:
-            trend_signals.append("overbought")
-        elif latest['rsi'] < 30:
-            trend_signals.append("oversold")
-
-        # 价格动量
-        price_change = (latest['close'] - prev['close']) / prev['close'] * 100
-        if price_change > 2:
-            trend_signals.append("strong_momentum_up")
-        elif price_change < -2:
-            trend_signals.append("strong_momentum_down")
-
-        # 成交量确认
-        volume_sma = df['volume'].rolling(window=10).mean()
-        if latest['volume'] > volume_sma.iloc[-1] * 1.5:
-            trend_signals.append("high_volume")
-
-        # 综合趋势判断
-        bullish_signals = sum(1 for s in trend_signals if s in ["bullish_ma", "oversold", "strong_momentum_up", "high_volume"])
-        bearish_signals = sum(1 for s in trend_signals if s in ["bearish_ma", "overbought", "strong_momentum_down"])
-
-        if bullish_signals >= 2:
-            trend_direction = "bullish"
-            trend_strength = "strong" if bullish_signals >= 3 else "moderate"
-        elif bearish_signals >= 2:
-            trend_direction = "bearish"
-            trend_strength = "strong" if bearish_signals >= 3 else "moderate"
-        else:
-            trend_direction = "neutral"
-            trend_strength = "weak"
-
-        # 构建分析结果
-        analysis_details = {
-            'trend_direction': trend_direction,
-            'trend_strength': trend_strength,
-            'current_price': latest['close'],
-            'sma_5': latest['sma_5'],
-            'sma_10': latest['sma_10'],
-            'rsi': latest['rsi'],
-            'price_change_15m': price_change,
-            'volume_ratio': latest['volume'] / volume_sma.iloc[-1] if not pd.isna(volume_sma.iloc[-1]) else 1,
-            'signals': trend_signals
-        }
-
-        # 生成分析理由
-        if trend_direction == "bullish":
-            reason = f"15分钟趋势看涨: 均线多头排列，RSI={latest['rsi']:.1f}，价格涨幅{price_change:+.2f}%"
-        elif trend_direction == "bearish":
-            reason = f"15分钟趋势看跌: 均线空头排列，RSI={latest['rsi']:.1f}，价格跌幅{price_change:+.2f}%"
-        else:
-            reason = f"15分钟趋势中性: RSI={latest['rsi']:.1f}，价格变化{price_change:+.2f}%"
-
-        # 缓存分析结果
-        if symbol not in trend_analysis:
-            trend_analysis[symbol] = {}
-        trend_analysis[symbol]['15m'] = analysis_details
-        trend_analysis[symbol]['15m_timestamp'] = datetime.now().isoformat()
-
-        return trend_direction, reason, analysis_details
+        # 读取最新指标值 (只处理新收盘的K线)
+        latest = indicator_engine.update(trade_symbol, '15m', ohlcv)
+        return classify_15m_trend(symbol, latest)
 
     except Exception as e:
         print(f"15分钟趋势分析失败: {e}")
         return "neutral", f"分析失败: {e}", {}
 
 
+def classify_15m_trend(symbol, latest):
+    """根据15分钟指标最新值判断趋势 (单币种增量计算和批量计算共用)"""
+    prev = latest['prev']
+
+    # 趋势判断逻辑
+    trend_signals = []
+
+    # 均线趋势
+    if latest['sma_5'] > latest['sma_10'] > latest['ema_20']:
+        trend_signals.append("bullish_ma")
+    elif latest['sma_5'] < latest['sma_10'] < latest['ema_20']:
+        trend_signals.append("bearish_ma")
+
+    # RSI超买超卖
+    if latest['rsi'] > 70:
+        trend_signals.append("overbought")
+    elif latest['rsi'] < 30:
+        trend_signals.append("oversold")
+
+    # 价格动量
+    price_change = (latest['close'] - prev['close']) / prev['close'] * 100
+    if price_change > 2:
+        trend_signals.append("strong_momentum_up")
+    elif price_change < -2:
+        trend_signals.append("strong_momentum_down")
+
+    # 成交量确认
+    volume_sma = latest['volume_sma_10']
+    if latest['volume'] > volume_sma * 1.5:
+        trend_signals.append("high_volume")
+
+    # 综合趋势判断
+    bullish_signals = sum(1 for s in trend_signals if s in ["bullish_ma", "oversold", "strong_momentum_up", "high_volume"])
+    bearish_signals = sum(1 for s in trend_signals if s in ["bearish_ma", "overbought", "strong_momentum_down"])
+
+    if bullish_signals >= 2:
+        trend_direction = "bullish"
+        trend_strength = "strong" if bullish_signals >= 3 else "moderate"
+    elif bearish_signals >= 2:
+        trend_direction = "bearish"
+        trend_strength = "strong" if bearish_signals >= 3 else "moderate"
+    else:
+        trend_direction = "neutral"
+        trend_strength = "weak"
+
+    # 构建分析结果
+    analysis_details = {
+        'trend_direction': trend_direction,
+        'trend_strength': trend_strength,
+        'current_price': latest['close'],
+        'sma_5': latest['sma_5'],
+        'sma_10': latest['sma_10'],
+        'rsi': latest['rsi'],
+        'price_change_15m': price_change,
+        'volume_ratio': latest['volume'] / volume_sma if not math.isnan(volume_sma) else 1,
+        'signals': trend_signals
+    }
+
+    # 生成分析理由
+    if trend_direction == "bullish":
+        reason = f"15分钟趋势看涨: 均线多头排列，RSI={latest['rsi']:.1f}，价格涨幅{price_change:+.2f}%"
+    elif trend_direction == "bearish":
+        reason = f"15分钟趋势看跌: 均线空头排列，RSI={latest['rsi']:.1f}，价格跌幅{price_change:+.2f}%"
+    else:
+        reason = f"15分钟趋势中性: RSI={latest['rsi']:.1f}，价格变化{price_change:+.2f}%"
+
+    # 缓存分析结果
+    if symbol not in trend_analysis:
+        trend_analysis[symbol] = {}
+    trend_analysis[symbol]['15m'] = analysis_details
+    trend_analysis[symbol]['15m_timestamp'] = datetime.now().isoformat()
+
+    return trend_direction, reason, analysis_details
+
+
 def analyze_4h_trend(symbol):
     """分析4小时收盘价趋势确认"""
     try:
-        # 获取最近30根4小时K线数据 (5天数据)
-        ohlcv = exchange.fetch_ohlcv(symbol, '4h', limit=30)
+        # 获取已收盘的4小时K线，指标由增量引擎维护 (首次使用时预热)
+        trade_symbol = get_trade_symbol(symbol)
+        ohlcv = bar_aggregator.get_closed_candles(trade_symbol, '4h', TRADE_CONFIG['indicator_warmup'])
         if not ohlcv or len(ohlcv) < 10:
             return "neutral", "数据不足", {}
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-
-        # 计算关键技术指标
-        df['sma_10'] = df['close'].rolling(window=10).mean()  # 40小时均线
-        df['sma_20'] = df['close'].rolling(window=20).mean()  # 80小时均线
-        df['ema_50'] = df['close'].ewm(span=50).mean()
-
-        # 计算MACD
-        exp1 = df['close'].ewm(span=12).mean()
-        exp2 = df['close'].ewm(span=26).mean()
-        df['macd'] = exp1 - exp2
-        df['signal'] = df['macd'].ewm(span=9).mean()
-        df['histogram'] = df['macd'] - df['signal']
-
-        # 布林带
-        df['bb_middle'] = df['close'].rolling(window=20).mean()
-        bb_std = df['close'].rolling(window=20).std()
-        df['bb_upper'] = df['bb_middle'] + (bb_std * 2)
-        df['bb_lower'] = df['bb_middle'] - (bb_std * 2)
-
-        # 最新数据
-        latest = df.iloc[-1]
-        prev = df.iloc[-2]
-
-        # 4小时趋势判断
-        trend_signals = []
-
-        # 长期趋势方向
-        if latest['sma_10'] > latest['sma_20'] > latest['ema_50']:
-            trend_signals.append("major_bullish_trend")
-        elif latest['sma_10'] < latest['sma_20'] < latest['ema_50']:
-            trend_signals.append("major_bearish_trend")
-
-        # MACD信号
-        if latest['macd'] > latest['signal'] and prev['macd'] <= prev['signal']:
-            trend_signals.append("macd_bullish_cross")
-        elif latest['macd'] < latest['signal'] and prev['macd'] >= prev['signal']:
-            trend_signals.append("macd_bearish_cross")
-
-        # 布林带位置
-        if latest['close'] > latest['bb_upper']:
-            trend_signals.append("above_upper_band")
-        elif latest['close'] < latest['bb_lower']:
-            trend_signals.append("below_lower_band")
-
-        # 价格与均线关系
-        price_vs_sma10 = (latest['close'] - latest['sma_10']) / latest['sma_10'] * 100
-        if abs(price_vs_sma10) > 3:
-            trend_signals.append("significant_price_deviation")
-
-        # 综合判断
-        bullish_signals = sum(1 for s in trend_signals if s in ["major_bullish_trend", "macd_bullish_cross"])
-        bearish_signals = sum(1 for s in trend_signals if s in ["major_bearish_trend", "macd_bearish_cross"])
-
-        if bullish_signals >= 1:
-            trend_direction = "bullish"
-            trend_strength = "strong" if bullish_signals >= 2 else "moderate"
-        elif bearish_signals >= 1:
-            trend_direction = "bearish"
-            trend_strength = "strong" if bearish_signals >= 2 else "moderate"
-        else:
-            trend_direction = "neutral"
-            trend_strength = "weak"
-
-        # 分析详情
-        analysis_details = {
-            'trend_direction': trend_direction,
-            'trend_strength': trend_strength,
-            'current_price': latest['close'],
-            'sma_10': latest['sma_10'],
-            'sma_20': latest['sma_20'],
-            'macd': latest['macd'],
-            'signal': latest['signal'],
-            'price_vs_sma10': price_vs_sma10,
-            'bb_position': (latest['close'] - latest['bb_lower']) / (latest['bb_upper'] - latest['bb_lower']) * 100,
-            'signals': trend_signals
-        }
-
-        # 生成分析理由
-        if trend_direction == "bullish":
-            reason = f"4小时趋势确认看涨: 长期均线多头，MACD多头，价格偏离SMA10 {price_vs_sma10:+.2f}%"
-        elif trend_direction == "bearish":
-            reason = f"4小时趋势确认看跌: 长期均线空头，MACD空头，价格偏离SMA10 {price_vs_sma10:+.2f}%"
-        else:
-            reason = f"4小时趋势确认中性: 价格偏离SMA10 {price_vs_sma10:+.2f}%，MACD横盘"
-
-        # 缓存分析结果
-        if symbol not in trend_analysis:
-            trend_analysis[symbol] = {}
-        trend_analysis[symbol]['4h'] = analysis_details
-        trend_analysis[symbol]['4h_timestamp'] = datetime.now().isoformat()
-
-        return trend_direction, reason, analysis_details
+        # 读取最新指标值: SMA10/20、EMA50、MACD、布林带
+        latest = indicator_engine.update(trade_symbol, '4h', ohlcv)
+        return classify_4h_trend(symbol, latest)
 
     except Exception as e:
         print(f"4小时趋势分���失败: {e}")
         return "neutral", f"分析失败: {e}", {}
 
 
+def classify_4h_trend(symbol, latest):
+    """根据4小时指标最新值判断趋势 (单币种增量计算和批量计算共用)"""
+    prev = latest['prev']
+
+    # 4小时趋势判断
+    trend_signals = []
+
+    # 长期趋势方向
+    if latest['sma_10'] > latest['sma_20'] > latest['ema_50']:
+        trend_signals.append("major_bullish_trend")
+    elif latest['sma_10'] < latest['sma_20'] < latest['ema_50']:
+        trend_signals.append("major_bearish_trend")
+
+    # MACD信号
+    if latest['macd'] > latest['signal'] and prev['macd'] <= prev['signal']:
+        trend_signals.append("macd_bullish_cross")
+    elif latest['macd'] < latest['signal'] and prev['macd'] >= prev['signal']:
+        trend_signals.append("macd_bearish_cross")
+
+    # 布林带位置
+    if latest['close'] > latest['bb_upper']:
+        trend_signals.append("above_upper_band")
+    elif latest['close'] < latest['bb_lower']:
+        trend_signals.append("below_lower_band")
+
+    # 价格与均线关系
+    price_vs_sma10 = (latest['close'] - latest['sma_10']) / latest['sma_10'] * 100
+    if abs(price_vs_sma10) > 3:
+        trend_signals.append("significant_price_deviation")
+
+    # 综合判断
+    bullish_signals = sum(1 for s in trend_signals if s in ["major_bullish_trend", "macd_bullish_cross"])
+    bearish_signals = sum(1 for s in trend_signals if s in ["major_bearish_trend", "macd_bearish_cross"])
+
+    if bullish_signals >= 1:
+        trend_direction = "bullish"
+        trend_strength = "strong" if bullish_signals >= 2 else "moderate"
+    elif bearish_signals >= 1:
+        trend_direction = "bearish"
+        trend_strength = "strong" if bearish_signals >= 2 else "moderate"
+    else:
+        trend_direction = "neutral"
+        trend_strength = "weak"
+
+    # 分析详情
+    analysis_details = {
+        'trend_direction': trend_direction,
+        'trend_strength': trend_strength,
+        'current_price': latest['close'],
+        'sma_10': latest['sma_10'],
+        'sma_20': latest['sma_20'],
+        'macd': latest['macd'],
+        'signal': latest['signal'],
+        'price_vs_sma10': price_vs_sma10,
+        'bb_position': (latest['close'] - latest['bb_lower']) / (latest['bb_upper'] - latest['bb_lower']) * 100
+        if latest['bb_upper'] != latest['bb_lower'] else 50,
+        'signals': trend_signals
+    }
+
+    # 生成分析理由
+    if trend_direction == "bullish":
+        reason = f"4小时趋势确认看涨: 长期均线多头，MACD多头，价格偏离SMA10 {price_vs_sma10:+.2f}%"
+    elif trend_direction == "bearish":
+        reason = f"4小时趋势确认看跌: 长期均线空头，MACD空头，价格偏离SMA10 {price_vs_sma10:+.2f}%"
+    else:
+        reason = f"4小时趋势确认中性: 价格偏离SMA10 {price_vs_sma10:+.2f}%，MACD横盘"
+
+    # 缓存分析结果
+    if symbol not in trend_analysis:
+        trend_analysis[symbol] = {}
+    trend_analysis[symbol]['4h'] = analysis_details
+    trend_analysis[symbol]['4h_timestamp'] = datetime.now().isoformat()
+
+    return trend_direction, reason, analysis_details
+
+
 def get_multi_timeframe_analysis(symbol):
-    """获取多时间周期综合分析"""
-    # 15分钟趋势分析
-    trend_15m, reason_15m, details_15m = analyze_15m_trend(symbol)
+    """获取多时间周期综合分析 (按最新收盘的15分钟/4小时K线缓存，每根K线只计算一次)"""
+    # 以最新收盘K线的时间戳作为缓存键，K线未收盘前所有调用方共享同一结果
+    trade_symbol = get_trade_symbol(symbol)
+    try:
+        candle_key = (
+            bar_aggregator.last_closed_timestamp(trade_symbol, '15m'),
+            bar_aggregator.last_closed_timestamp(trade_symbol, '4h'),
+        )
+    except Exception as e:
+        print(f"{symbol} 获取K线收盘时间失败: {e}")
+        candle_key = None
+
+    # 命中同一根收盘K线的缓存 (可能来自本轮的批量预计算)，否则用增量引擎计算单币种
+    cached = trend_analysis.get(symbol, {}).get('multi_timeframe')
+    if candle_key and None not in candle_key and cached and cached['candle_key'] == candle_key:
+        return cached['result']
+
+    # 15分钟趋势分析 + 4小时趋势确认
+    return combine_timeframes(symbol, candle_key, analyze_15m_trend(symbol), analyze_4h_trend(symbol))
+
+
+def _has_nan(details):
+    return any(isinstance(value, float) and math.isnan(value) for value in details.values())
 
-    # 4小时趋势确认
-    trend_4h, reason_4h, details_4h = analyze_4h_trend(symbol)
+
+def combine_timeframes(symbol, candle_key, analysis_15m, analysis_4h, source='engine'):
+    """综合15分钟和4小时趋势，按收盘K线缓存结果 (记录指标来源)"""
+    trend_15m, reason_15m, details_15m = analysis_15m
+    trend_4h, reason_4h, details_4h = analysis_4h
 
     # 综合判断 - 优化逻辑
     if trend_15m == "bullish" and trend_4h == "bullish":
@@ -426,7 +525,7 @@ def get_multi_timeframe_analysis(symbol):
         overall_trend = "neutral"
         confidence = "low"
 
-    return {
+    result = {
         'overall_trend': overall_trend,
         'confidence': confidence,
         '15m': {
@@ -441,24 +540,93 @@ def get_multi_timeframe_analysis(symbol):
         }
     }
 
+    # 两个周期都分析成功且指标完整 (无NaN) 时才缓存，否则下次重新计算
+    if candle_key and None not in candle_key and details_15m and details_4h \
+            and not _has_nan(details_15m) and not _has_nan(details_4h):
+        trend_analysis.setdefault(symbol, {})['multi_timeframe'] = {
+            'candle_key': candle_key,
+            'source': source,
+            'result': result,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    return result
+
+
+def analyze_trends_batch(symbols=None):
+    """
+    批量多周期分析 - 所有币种的15分钟/4小时指标各用一次向量化计算完成
+
+    结果写入 get_multi_timeframe_analysis 的收盘K线缓存，之后各币种流程直接命中缓存。
+    数据不足或计算失败的币种不返回结果，由单币种流程自行计算。
+    """
+    symbols = list(symbols or TRADE_CONFIG['symbols'])
+    candles = {'15m': {}, '4h': {}}
+    for symbol in symbols:
+        trade_symbol = get_trade_symbol(symbol)
+        try:
+            for timeframe in candles:
+                ohlcv = bar_aggregator.get_closed_candles(trade_symbol, timeframe, TRADE_CONFIG['indicator_warmup'])
+                if ohlcv and len(ohlcv) >= 10:
+                    candles[timeframe][symbol] = ohlcv
+        except Exception as e:
+            print(f"{symbol} 批量分析获取K线失败: {e}")
+
+    try:
+        latest_15m = batch_indicators(candles['15m'])
+        latest_4h = batch_indicators(candles['4h'])
+    except Exception as e:
+        print(f"批量指标计算失败: {e}")
+        return {}
+
+    results = {}
+    for symbol in symbols:
+        if symbol not in latest_15m or symbol not in latest_4h:
+            continue
+        try:
+            candle_key = (candles['15m'][symbol][-1][0], candles['4h'][symbol][-1][0])
+            results[symbol] = combine_timeframes(
+                symbol, candle_key,
+                classify_15m_trend(symbol, latest_15m[symbol]),
+                classify_4h_trend(symbol, latest_4h[symbol]),
+                source='batch'
+            )
+        except Exception as e:
+            print(f"{symbol} 批量趋势判断失败: {e}")
+    return results
+
 
 def setup_exchange():
     """设置交易所参数"""
     try:
+        # 启动时加载市场信息，之后在后台定期刷新
+        symbol_registry.start_auto_refresh()
+
+        # 校准交易所时钟 (K线收盘时间以交易所时间为准)
+        try:
+            offset = exchange_clock.sync()
+            print(f"交易所时钟偏差: {offset:+.0f}ms (往返 {exchange_clock.rtt_ms:.0f}ms)")
+        except Exception as e:
+            print(f"获取交易所时间失败，使用本地时钟: {e}")
+
         # 为每个交易对设置杠杆
         for symbol in TRADE_CONFIG['symbols']:
             try:
                 # OKX合约需要使用 BTC/USDT:USDT 格式
-                trade_symbol = symbol
-                if EXCHANGE_TYPE == 'okx' and ':' not in symbol:
-                    trade_symbol = f"{symbol}:USDT"
+                trade_symbol = get_trade_symbol(symbol)
+
+                # 读取交易所当前杠杆作为本地状态
+                try:
+                    leverage_state.seed(trade_symbol, hedged=EXCHANGE_TYPE == 'okx')
+                except Exception as e:
+                    print(f"{symbol} 读取当前杠杆失败: {e}")
 
                 if EXCHANGE_TYPE == 'okx':
                     # OKX需要为多空两个方向分别设置杠杆
-                    exchange.set_leverage(TRADE_CONFIG['leverage'], trade_symbol, params={'mgnMode': 'isolated', 'posSide': 'long'})
-                    exchange.set_leverage(TRADE_CONFIG['leverage'], trade_symbol, params={'mgnMode': 'isolated', 'posSide': 'short'})
+                    leverage_state.ensure(trade_symbol, TRADE_CONFIG['leverage'], pos_side='long')
+                    leverage_state.ensure(trade_symbol, TRADE_CONFIG['leverage'], pos_side='short')
                 else:
-                    exchange.set_leverage(TRADE_CONFIG['leverage'], trade_symbol)
+                    leverage_state.ensure(trade_symbol, TRADE_CONFIG['leverage'])
                 print(f"{symbol} 设置杠杆: {TRADE_CONFIG['leverage']}x")
             except Exception as e:
                 print(f"{symbol} 设置杠杆失败: {e} (可能已设置)")
@@ -474,35 +642,120 @@ def setup_exchange():
         return False
 
 
-def get_ohlcv(symbol):
-    """获取指定币种的K线数据"""
+def start_market_stream():
+    """启动WebSocket行情推送，推送的K线写入 candle_cache (启动失败时继续使用REST轮询)"""
+    global market_stream
     try:
-        # OKX合约需要使用 BTC/USDT:USDT 格式
-        trade_symbol = symbol
-        if EXCHANGE_TYPE == 'okx' and ':' not in symbol:
-            trade_symbol = f"{symbol}:USDT"
+        if EXCHANGE_TYPE == 'okx':
+            protocol = OKXStreamProtocol()
+            instruments = {symbol_registry.inst_id(s): get_trade_symbol(s) for s in TRADE_CONFIG['symbols']}
+        else:
+            protocol = BinanceStreamProtocol()
+            instruments = {symbol_registry.canonical(s).replace('/', ''): get_trade_symbol(s)
+                           for s in TRADE_CONFIG['symbols']}
+        market_stream = MarketStream(candle_cache, instruments, TRADE_CONFIG['timeframe'], protocol,
+                                     on_candle_closed=publish_closed_candles,
+                                     on_ticker=lambda symbol, ticker: publish_snapshot(symbol, last=ticker['last']),
+                                     proxy=proxies.get('https')).start()
+        print(f"✅ 行情推送已启动: {', '.join(instruments)}")
+    except Exception as e:
+        print(f"行情推送启动失败，使用定时轮询: {e}")
+        market_stream = None
+    return market_stream
+
 
-        # 获取最近10根K线
-        ohlcv = exchange.fetch_ohlcv(trade_symbol, TRADE_CONFIG['timeframe'], limit=10)
+def start_snapshot_writer():
+    """
+    创建共享内存行情快照 (每台机器只应有一个写入进程)
 
-        # 转换为DataFrame
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    不单独轮询: 最新价随行情推送的Ticker写入，已收盘K线在推送收盘或 get_ohlcv 时写入，
+    持仓在 get_current_position 时写入；推送断线期间快照随每轮交易更新，读取方超过有效期后自行请求。
+    """
+    global snapshot_writer
+    try:
+        snapshot_writer = SnapshotWriter(TRADE_CONFIG['symbols'])
+        print(f"✅ 共享行情快照: {snapshot_writer.path}")
+    except Exception as e:
+        print(f"共享行情快照创建失败: {e}")
+        snapshot_writer = None
+    return snapshot_writer
 
-        current_data = df.iloc[-1]
-        previous_data = df.iloc[-2] if len(df) > 1 else current_data
 
-        return {
-            'symbol': symbol,  # 返回原始symbol格式
-            'price': current_data['close'],
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'high': current_data['high'],
-            'low': current_data['low'],
-            'volume': current_data['volume'],
-            'timeframe': TRADE_CONFIG['timeframe'],
-            'price_change': ((current_data['close'] - previous_data['close']) / previous_data['close']) * 100,
-            'kline_data': df[['timestamp', 'open', 'high', 'low', 'close', 'volume']].tail(5).to_dict('records')
-        }
+def publish_closed_candles(symbol, timeframe=None, candle=None):
+    """K线收盘推送后，把缓存中的已收盘K线写入快照 (只读缓存，不请求交易所)"""
+    if snapshot_writer is None:
+        return
+    closed = candle_cache.cached_closed(symbol, timeframe or TRADE_CONFIG['timeframe'])
+    if closed:
+        publish_snapshot(symbol, candles=closed[-snapshot_writer.candles:])
+
+
+def publish_snapshot(symbol, **fields):
+    """写入共享内存快照 (未启用时忽略)"""
+    if snapshot_writer is None:
+        return
+    try:
+        snapshot_writer.update(symbol, **fields)
+    except Exception as e:
+        print(f"{symbol} 写入共享行情快照失败: {e}")
+
+
+def get_live_price(trade_symbol, forming=None):
+    """最新成交价 - 优先使用行情推送，其次为当前未收盘K线的最新价 (都没有时返回None)"""
+    if market_stream and market_stream.healthy():
+        price = market_stream.latest_price(trade_symbol, max_age=10)
+        if price is not None:
+            return price
+    if forming is not None:
+        return forming[4]
+    return None
+
+
+def build_price_data(symbol, closed, price=None):
+    """
+    由已收盘K线和最新成交价组装行情数据 (get_ohlcv 和 web_ui 读取共享快照时共用)
+
+    K线字段均来自最新一根已收盘K线，price 为最新成交价 (为空时使用最新收盘价)。
+    """
+    df = pd.DataFrame(closed, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+
+    current_data = df.iloc[-1]  # 最新一根已收盘K线
+    previous_data = df.iloc[-2] if len(df) > 1 else current_data
+    previous_volume = df['volume'].iloc[:-1].mean() if len(df) > 1 else 0
+
+    return {
+        'symbol': symbol,  # 返回原始symbol格式
+        'price': price if price is not None else current_data['close'],
+        'close': current_data['close'],
+        'bar_timestamp': current_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'high': current_data['high'],
+        'low': current_data['low'],
+        'volume': current_data['volume'],
+        'volume_ratio': current_data['volume'] / previous_volume if previous_volume > 0 else 1,
+        'timeframe': TRADE_CONFIG['timeframe'],
+        'price_change': ((current_data['close'] - previous_data['close']) / previous_data['close']) * 100,
+        'kline_data': df[['timestamp', 'open', 'high', 'low', 'close', 'volume']].tail(5).to_dict('records')
+    }
+
+
+def get_ohlcv(symbol):
+    """获取指定币种的K线数据 - K线字段均来自已收盘K线，price 为最新成交价"""
+    try:
+        # OKX合约需要使用 BTC/USDT:USDT 格式
+        trade_symbol = get_trade_symbol(symbol)
+
+        # 最近10根已收盘K线 + 当前未收盘K线 (增量缓存)
+        closed, forming = candle_cache.get_bars(trade_symbol, TRADE_CONFIG['timeframe'], 10)
+        if not closed:
+            print(f"{symbol} 没有已收盘K线")
+            return None
+        price = get_live_price(trade_symbol, forming) or closed[-1][4]
+        # 快照只保存已收盘K线，读取方用同一个 build_price_data 组装
+        publish_snapshot(symbol, last=price, candles=closed)
+
+        return build_price_data(symbol, closed, price)
     except Exception as e:
         print(f"{symbol} 获取K线数据失败: {e}")
         import traceback
@@ -510,36 +763,45 @@ def get_ohlcv(symbol):
         return None
 
 
+def fetch_all_positions():
+    """拉取账户全部持仓 (处理OKX API的歧义问题)"""
+    if EXCHANGE_TYPE != 'okx':
+        # Binance保持原逻辑
+        return exchange.fetch_positions()
+
+    try:
+        # 首先尝试使用默认方式获取持仓
+        return exchange.fetch_positions()
+    except Exception as api_error:
+        # 如果遇到歧义错误，尝试使用带类型参数的方式
+        if "disambiguate" not in str(api_error):
+            raise
+        print(f"[DEBUG] OKX API歧义错误，尝试替代方法...")
+        try:
+            # 使用更简单的查询方式
+            return exchange.fetch_positions(None, None, None, None)
+        except:
+            # 如果还是失败，尝试使用私有API
+            print(f"[DEBUG] 使用OKX私有API获取持仓...")
+            response = exchange.private_get_account_positions({'instType': 'SWAP'})
+            return exchange.parse_positions(response, None, None)
+
+
+# 持仓快照: 每次请求拉取账户全部持仓，所有币种共享，下单后失效
+position_snapshot = PositionSnapshot(fetch_all_positions, ttl=30, normalize=symbol_registry.canonical)
+
+
 def get_current_position(symbol):
     """获取指定币种的当前持仓 - 返回所有方向的持仓列表"""
     try:
-        # 获取所有持仓(使用try-catch处理OKX API的歧义问题)
-        if EXCHANGE_TYPE == 'okx':
-            try:
-                # 首先尝试使用默认方式获取持仓
-                all_positions = exchange.fetch_positions()
-            except Exception as api_error:
-                # 如果遇到歧义错误，尝试使用带类型参数的方式
-                if "disambiguate" in str(api_error):
-                    print(f"[DEBUG] OKX API歧义错误，尝试替代方法...")
-                    try:
-                        # 使用更简单的查询方式
-                        all_positions = exchange.fetch_positions(None, None, None, None)
-                    except:
-                        # 如果还是失败，尝试使用私有API
-                        print(f"[DEBUG] 使用OKX私有API获取持仓...")
-                        response = exchange.private_get_account_positions({'instType': 'SWAP'})
-                        all_positions = exchange.parse_positions(response, None, None)
-                else:
-                    raise api_error
-        else:
-            # Binance保持原逻辑
-            all_positions = exchange.fetch_positions()
+        # 从持仓快照中按标准化symbol直接取出该币种的持仓
+        matched_positions = position_snapshot.get(symbol)
 
         result_positions = []
 
         # BNB专用调试：打印所有返回的持仓symbol
         if 'BNB' in symbol:
+            all_positions = position_snapshot.all()
             print(f"[BNB DEBUG] 所有交易所返回的持仓:")
             for i, pos in enumerate(all_positions):
                 pos_symbol = pos.get('symbol', 'Unknown')
@@ -561,56 +823,9 @@ def get_current_position(symbol):
 
             print(f"[BNB DEBUG] 目标symbol: {symbol}")
 
-        # 提取目标symbol的基础部分用于匹配
-        # 例如: BNB/USDT -> BNB
-        target_base = symbol.replace('/USDT', '').replace('/USDC', '').replace('-', '').replace(':', '').strip()
-
-        for pos in all_positions:
-            # 匹配符号 - 添加健壮性检查
+        for pos in matched_positions:
             pos_symbol = pos.get('symbol')
 
-            # 跳过空值
-            if not pos_symbol:
-                print(f"[DEBUG] 跳过空symbol的持仓")
-                continue
-
-            # OKX格式: BNB/USDT:USDT 或 BTC/USDT:USDT 或 BNB-USDT-SWAP
-            # Binance格式: BNBUSDT 或 BTCUSDT
-            # 我们的symbol格式: BNB/USDT 或 BTC/USDT
-
-            # 提取持仓的基础货币部分
-            # 1. 先去掉:USDT后缀
-            base_symbol = pos_symbol.split(':')[0]  # BNB/USDT:USDT -> BNB/USDT
-            # 2. 提取基础货币名称
-            pos_base = base_symbol.replace('/USDT', '').replace('/USDC', '').replace('-SWAP', '').replace('-', '').strip()
-
-            print(f"[DEBUG] 匹配检查: pos_symbol={pos_symbol}, base_symbol={base_symbol}, pos_base={pos_base}, target_base={target_base}")
-
-            # 使用更灵活的匹配逻辑
-            is_match = (
-                base_symbol == symbol or  # 精确匹配: BNB/USDT == BNB/USDT
-                pos_base == target_base or  # 基础货币匹配: BNB == BNB
-                pos_symbol == symbol or  # 完整匹配: BNB/USDT:USDT == BNB/USDT (不太可能但保留)
-                (symbol in pos_symbol)  # 包含匹配: BNB/USDT in BNB/USDT:USDT
-            )
-
-            # BNB专用调试：匹配检查
-            if 'BNB' in symbol:
-                match_reason = []
-                if base_symbol == symbol:
-                    match_reason.append("base_symbol")
-                if pos_base == target_base:
-                    match_reason.append("pos_base")
-                if pos_symbol == symbol:
-                    match_reason.append("pos_symbol")
-                if symbol in pos_symbol:
-                    match_reason.append("symbol_in_pos_symbol")
-
-                print(f"[BNB DEBUG] {symbol} 匹配检查: {is_match}, 原因: {', '.join(match_reason)}")
-
-            if not is_match:
-                continue
-
             print(f"[DEBUG] ✓ {symbol} 匹配到持仓: {pos_symbol}")
 
             # 获取持仓数量 - 支持多种字段格式
@@ -683,6 +898,8 @@ def get_current_position(symbol):
                 imr = safe_float(info.get('imr', 0))  # 初始保证金
                 notional_usd = safe_float(info.get('notionalUsd', 0))  # USDT计价的名义价值
                 leverage = safe_float(info.get('lever', 1), 1)
+                # 以交易所返回的实际杠杆校正本地杠杆状态 (其他进程可能修改过)
+                leverage_state.observe(pos_symbol, info)
 
                 # 调试日志
                 print(f"[DEBUG] {symbol} 保证金数据:")
@@ -719,6 +936,10 @@ def get_current_position(symbol):
                 result_positions.append(position_data)
                 print(f"[DEBUG] {symbol} 添加持仓: {side} {abs(position_amt)} @ ${safe_float(pos.get('entryPrice', 0))}")
 
+        # 写入共享内存快照，供 web_ui 和其他策略进程读取
+        mark_price = next((p['markPrice'] for p in matched_positions if p.get('markPrice')), None)
+        publish_snapshot(symbol, mark=mark_price, positions={p['side']: p for p in result_positions})
+
         # 如果有多个持仓,返回列表;如果只有一个,返回单个对象;如果没有,返回None
         if 'BNB' in symbol:
             print(f"[BNB DEBUG] 最终结果: 找到 {len(result_positions)} 个持仓")
@@ -741,30 +962,8 @@ def get_current_position(symbol):
             return result_positions  # 多个持仓
 
     except Exception as e:
-        error_msg = str(e)
         print(f"{symbol} 获取持仓失败: {e}")
 
-        # 对OKX API歧义错误进行特殊处理
-        if EXCHANGE_TYPE == 'okx' and "disambiguate" in error_msg:
-            print(f"[OKX] API歧义错误，尝试直接使用私有API...")
-            try:
-                # 直接使用OKX私有API获取持仓
-                response = exchange.private_get_account_positions({'instType': 'SWAP'})
-                all_positions = exchange.parse_positions(response, None, None)
-                print(f"[OKX] 私有API获取到 {len(all_positions)} 个持仓")
-
-                # 重新执行匹配逻辑（简化版）
-                target_base = symbol.replace('/USDT', '').replace('/USDC', '').replace('-', '').replace(':', '').strip()
-
-                for pos in all_positions:
-                    pos_symbol = pos.get('symbol', '')
-                    if pos_symbol and target_base.upper() in pos_symbol.upper():
-                        if float(pos.get('contracts', 0)) != 0:
-                            return pos  # 找到有效持仓
-                return None  # 没有找到持仓
-            except Exception as fallback_error:
-                print(f"[OKX] 私有API也失败: {fallback_error}")
-
         if 'BNB' in symbol:
             print(f"[BNB DEBUG] ❌ 异常导致返回None!")
         import traceback
@@ -772,6 +971,62 @@ def get_current_position(symbol):
         return None
 
 
+def start_async_exchange():
+    """创建异步交易所客户端 (失败时继续使用同步请求)"""
+    global async_exchange
+    try:
+        async_exchange = AsyncExchangeClient.from_exchange(exchange, limiter=rate_limiter)
+        print(f"✅ 异步交易所客户端已启动: {async_exchange.exchange_id}")
+    except Exception as e:
+        print(f"异步交易所客户端启动失败，使用同步请求: {e}")
+        async_exchange = None
+    return async_exchange
+
+
+async def fetch_all_positions_async():
+    """fetch_all_positions 的异步版本"""
+    try:
+        return await async_exchange.fetch_positions()
+    except Exception as api_error:
+        if EXCHANGE_TYPE != 'okx' or "disambiguate" not in str(api_error):
+            raise
+        response = await async_exchange.private_get_account_positions({'instType': 'SWAP'})
+        return async_exchange.parse_positions(response, None, None)
+
+
+def needs_candle_prefetch(symbol):
+    """
+    本轮是否需要预取K线: 行情推送正常时缓存由推送维护，行情代理已连接时K线由代理共享，
+    缓存已是最新时 get_ohlcv 也不会请求，这些情况都不再发REST请求
+    """
+    if market_stream and market_stream.healthy():
+        return False
+    if isinstance(exchange, BrokeredExchange) and exchange.connected:
+        return False
+    return not candle_cache.is_current(get_trade_symbol(symbol), TRADE_CONFIG['timeframe'], 10)
+
+
+def prefetch_cycle_data(symbols=None):
+    """每轮开始时并发预取账户持仓和缓存不是最新的币种K线，各币种流程直接命中缓存"""
+    if async_exchange is None:
+        return
+    symbols = [symbol for symbol in (symbols or TRADE_CONFIG['symbols']) if needs_candle_prefetch(symbol)]
+
+    async def fetch_positions():
+        position_snapshot.set(await fetch_all_positions_async())
+
+    async def fetch_candles(symbol):
+        trade_symbol = get_trade_symbol(symbol)
+        ohlcv = await async_exchange.fetch_ohlcv(trade_symbol, TRADE_CONFIG['timeframe'], limit=11)
+        candle_cache.merge(trade_symbol, TRADE_CONFIG['timeframe'], ohlcv)
+
+    started = time.time()
+    results = async_exchange.gather([fetch_positions()] + [fetch_candles(s) for s in symbols], timeout=30)
+    failed = [name for name, result in zip(['持仓'] + symbols, results) if isinstance(result, Exception)]
+    print(f"⚡ 并发预取 {len(results)} 个请求，耗时 {time.time() - started:.2f}s"
+          + (f"，失败: {', '.join(failed)}" if failed else ""))
+
+
 def calculate_sharpe_ratio(returns, risk_free_rate=0.02, periods_per_year=17520):
     """
     计算夏普指数
@@ -975,8 +1230,60 @@ def update_trade_performance(symbol, signal_data, action_result):
                                                     perf['current_consecutive_losses'])
 
 
-def analyze_with_ai(price_data):
-    """使用AI分析市场并生成交易信号，加入历史性能分析"""
+def get_position_side(current_pos):
+    """持仓方向: 无持仓为 None，多个持仓为排序后的方向元组"""
+    if not current_pos:
+        return None
+    if isinstance(current_pos, list):
+        return tuple(sorted(pos['side'] for pos in current_pos))
+    return current_pos['side']
+
+
+def get_gate_state(price_data):
+    """AI调用预筛使用的行情状态 (多周期趋势按收盘K线缓存，不额外计算)"""
+    symbol = price_data['symbol']
+    mt_analysis = get_multi_timeframe_analysis(symbol)
+    return {
+        'price': price_data['price'],
+        'trends': (mt_analysis['15m']['trend'], mt_analysis['4h']['trend']),
+        'position_side': get_position_side(get_current_position(symbol)),
+        'price_change': price_data['price_change'],
+        'volume_ratio': price_data.get('volume_ratio', 1),
+    }
+
+
+def gate_symbol(price_data):
+    """
+    AI调用预筛 - 返回 (是否请求AI, 预筛状态, 跳过时使用的信号)
+
+    跳过时有持仓则给出 HOLD 信号 (沿用上次AI信号的止损止盈，标记 gated=True)，
+    执行交易时的多层风控照常检查；无持仓则本轮不做任何操作。
+    """
+    symbol = price_data['symbol']
+    if not TRADE_CONFIG['ai_gate']:
+        return True, None, None
+    state = get_gate_state(price_data)
+    run, reason = ai_gate.should_analyze(symbol, state)
+    if run:
+        print(f"[{symbol}] AI预筛放行: {reason}")
+        return True, state, None
+
+    print(f"[{symbol}] AI预筛: {reason}，本轮不请求AI")
+    if not state['position_side']:
+        return False, state, None
+    last_signal = signal_history[symbol][-1] if signal_history.get(symbol) else {}
+    return False, state, {
+        'signal': 'HOLD',
+        'reason': f"{reason}，沿用上次AI分析 ({last_signal.get('signal', 'N/A')})",
+        'stop_loss': last_signal.get('stop_loss', 0),
+        'take_profit': last_signal.get('take_profit', 0),
+        'confidence': last_signal.get('confidence', 'LOW'),
+        'gated': True,  # 未请求AI，日志记为预筛跳过
+    }
+
+
+def prepare_symbol_context(price_data):
+    """整理单个币种的提示词素材: K线、技术指标、上次信号、持仓、历史表现、多周期趋势"""
     symbol = price_data['symbol']
 
     # 初始化币种历史数据
@@ -1009,9 +1316,11 @@ def analyze_with_ai(price_data):
         change = ((kline['close'] - kline['open']) / kline['open']) * 100
         kline_text += f"K线{i + 1}: {trend} 开盘:{kline['open']:.2f} 收盘:{kline['close']:.2f} 涨跌:{change:+.2f}%\n"
 
-    # 构建技术指标文本
-    if len(price_history[symbol]) >= 5:
-        closes = [data['price'] for data in price_history[symbol][-5:]]
+    # 构建技术指标文本 (重启后价格历史不足时使用K线收盘价)
+    closes = [data['price'] for data in price_history[symbol][-5:]]
+    if len(closes) < 5:
+        closes = [kline['close'] for kline in price_data['kline_data']]
+    if len(closes) >= 5:
         sma_5 = sum(closes) / len(closes)
         price_vs_sma = ((price_data['price'] - sma_5) / sma_5) * 100
 
@@ -1045,129 +1354,185 @@ def analyze_with_ai(price_data):
     # 获取多时间周期趋势分析
     mt_analysis = get_multi_timeframe_analysis(symbol)
 
-    # 构建多层次风险控制信息
-    risk_control_info = f"""
-【多层次风险控制系统】
-📊 实时趋势监控:
+    trend_text = f"""📊 实时趋势监控:
    15分钟趋势: {mt_analysis['15m']['trend']} ({mt_analysis['15m']['reason']})
    4小时趋势: {mt_analysis['4h']['trend']} ({mt_analysis['4h']['reason']})
-   综合信心度: {mt_analysis['confidence']}
-
-🛡️ 四层风险控制机制:
-   第一层: 3分钟K线失效条件 (主要止损 - 立即执行)
-   第二层: 15分钟趋势判断 (避免震出 - 智能过滤)
-   第三层: 4小时趋势确认 (趋势保护 - 宽松容忍)
-   第四层: 传统价格止损 (最后防线 - 安全网)
-
-💡 当前风险策略:
-   - 如果15分钟强烈反转且4小时不配合: 提前平仓避免大幅回撤
-   - 如果4小时趋势配合: 放宽止损容忍度，让利润奔跑
-   - 优先保护本金，其次追求收益
-"""
-
-    # 情感化背景改为更专业的策略背景
-    strategic_context = f"""
-    【智能交易策略背景】
-    基于历史交易数据的深度分析：
-    - {symbol}历史交易表现：{performance['total_trades']}次交易，胜率{(performance['winning_trades']/max(1,performance['total_trades']))*100:.1f}%
-    - 当前连续亏损：{performance['current_consecutive_losses']}次
-    {performance_insights}
-
-    【风险调整收益分析】
-    {sharpe_analysis}
-
-    {risk_control_info}
-
-    策略核心原则：
-    1. 多时间周期趋势确认，提高信号质量
-    2. 动态仓位管理，根据信心度和历史表现调整杠杆
-    3. 四层风险控制，严格执行失效条件
-    4. 基于夏普指数优化风险收益比
-    5. 趋势保护机制，让利润奔跑的同时控制风险
+   综合信心度: {mt_analysis['confidence']}"""
+
+    market_text = f"""【当前行情】
+- 当前价格: ${price_data['price']:,.2f}
+- 时间: {price_data['timestamp']}
+- 最新收盘K线最高: ${price_data['high']:,.2f}
+- 最新收盘K线最低: ${price_data['low']:,.2f}
+- 最新收盘K线成交量: {price_data['volume']:.2f} BTC
+- 价格变化 (最近两根收盘K线): {price_data['price_change']:+.2f}%
+- 当前持仓: {position_text}"""
+
+    performance_text = f"""- {symbol}历史交易表现：{performance['total_trades']}次交易，胜率{(performance['winning_trades']/max(1,performance['total_trades']))*100:.1f}%
+- 当前连续亏损：{performance['current_consecutive_losses']}次
+{performance_insights}"""
+
+    # 行情状态指纹: 价格档位 + 多周期趋势 + 持仓方向 + 最新收盘的15分钟/4小时K线
+    position_side = get_position_side(current_pos)
+    candle_id = trend_analysis.get(symbol, {}).get('multi_timeframe', {}).get('candle_key') or price_data.get('bar_timestamp')
+    fingerprint = signal_cache.fingerprint(
+        price_data['price'],
+        trends=(mt_analysis['15m']['trend'], mt_analysis['4h']['trend'], mt_analysis.get('overall_trend')),
+        position_side=position_side,
+        candle_id=candle_id
+    )
+
+    return {
+        'fingerprint': fingerprint,
+        'kline_text': kline_text,
+        'indicator_text': indicator_text,
+        'signal_text': signal_text,
+        'trend_text': trend_text,
+        'market_text': market_text,
+        'performance_text': performance_text,
+        'sharpe_analysis': sharpe_analysis,
+    }
+
+
+def record_signal(price_data, signal_data):
+    """保存信号到历史记录"""
+    symbol = price_data['symbol']
+    signal_data['timestamp'] = price_data['timestamp']
+    signal_data['symbol'] = symbol
+    signal_history[symbol].append(signal_data)
+    if len(signal_history[symbol]) > 30:
+        signal_history[symbol].pop(0)
+    return signal_data
+
+
+def request_ai(user_prompt, batch=False, label=''):
     """
+    发送AI请求并返回回复文本
 
-    prompt = f"""
-    {strategic_context}
-
-    你是一个专业的量化交易分析师，专注于{TRADE_CONFIG['timeframe']}周期趋势分析。请结合历史交易表现、K线形态和技术指标做出判断：
-
-    {kline_text}
-
-    {indicator_text}
-
-    {signal_text}
-
-    【当前行情】
-    - 当前价格: ${price_data['price']:,.2f}
-    - 时间: {price_data['timestamp']}
-    - 本K线最高: ${price_data['high']:,.2f}
-    - 本K线最低: ${price_data['low']:,.2f}
-    - 本K线成交量: {price_data['volume']:.2f} BTC
-    - 价格变化: {price_data['price_change']:+.2f}%
-    - 当前持仓: {position_text}
-
-    【分析要求】
-    1. 基于{TRADE_CONFIG['timeframe']}K线趋势和技术指标给出交易信号: BUY(买入) / SELL(卖出) / HOLD(观望)
-    2. 简要分析理由（考虑趋势连续性、支撑阻力、成交量等因素）
-    3. 基于技术分析建议合理的止损价位
-    4. 基于技术分析建议合理的止盈价位
-    5. 评估信号信心程度
-
-    请用以下JSON格式回复：
-    {{
-        "signal": "BUY|SELL|HOLD",
-        "reason": "分析理由",
-        "stop_loss": 具体价格,
-        "take_profit": 具体价格,
-        "confidence": "HIGH|MEDIUM|LOW"
-    }}
+    系统提示词是逐字节不变的静态前缀 (角色、风控说明、分析要求、JSON格式)，用户消息只含本轮数据，
+    服务商的前缀缓存可以命中整个系统提示词；每次请求记录输入token和缓存命中的token。
     """
+    timeout = TRADE_CONFIG['ai_batch_timeout'] if batch else TRADE_CONFIG['ai_timeout']
+    # 统一使用 OpenAI 格式调用 (中转API兼容)，经调度器并发执行，超过截止时间的响应丢弃
+    response = ai_dispatcher.call(
+        ai_client.chat.completions.create,
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": build_system_prompt(TRADE_CONFIG['timeframe'], batch)},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.7,
+        stream=False,
+        timeout=timeout,
+        deadline=timeout,
+        label=label
+    )
+    prompt_tokens, cached_tokens = prompt_cache_stats.record(response)
+    if prompt_tokens:
+        print(f"[{label}] 输入token: {prompt_tokens}，前缀缓存命中: {cached_tokens} "
+              f"({cached_tokens / prompt_tokens * 100:.0f}%)")
+    return response.choices[0].message.content
+
+
+def get_cached_signal(price_data, context):
+    """行情状态指纹与上次分析时相同时返回缓存的信号 (已记入信号历史)"""
+    if not TRADE_CONFIG['signal_cache']:
+        return None
+    signal_data = signal_cache.get(price_data['symbol'], context['fingerprint'])
+    if signal_data is None:
+        return None
+    print(f"[{price_data['symbol']}] 行情状态未变化，复用缓存的AI信号: {signal_data.get('signal')}")
+    return record_signal(price_data, signal_data)
+
+
+def analyze_with_ai(price_data, context=None):
+    """使用AI分析市场并生成交易信号，加入历史性能分析 (context 为已整理好的提示词素材)"""
+    symbol = price_data['symbol']
+    if context is None:
+        context = prepare_symbol_context(price_data)
+    cached = get_cached_signal(price_data, context)
+    if cached:
+        return cached
 
     try:
-        # 统一使用 OpenAI 格式调用 (中转API兼容)
-        response = ai_client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system",
-                 "content": f"你是一个专业的量化交易分析师，专注于{TRADE_CONFIG['timeframe']}周期趋势分析。请结合K线形态和技术指标做出判断。你的分析将帮助一位需要为母亲���病筹钱的交易员，请务必认真负责。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            stream=False
-        )
-        result = response.choices[0].message.content
-        start_idx = result.find('{')
-        end_idx = result.rfind('}') + 1
-        if start_idx != -1 and end_idx != 0:
-            json_str = result[start_idx:end_idx]
-            signal_data = json.loads(json_str)
-        else:
+        # 静态系统提示词在前 (命中服务商前缀缓存)，本轮数据放在用户消息
+        result = request_ai(build_user_prompt({symbol: context}), label=symbol)
+        signal_data = parse_signal(result)
+        if signal_data is None:
             print(f"无法解析JSON: {result}")
             return None
 
-        # 保存信号到历史记录
-        signal_data['timestamp'] = price_data['timestamp']
-        signal_data['symbol'] = price_data['symbol']
-        signal_history[symbol].append(signal_data)
-        if len(signal_history[symbol]) > 30:
-            signal_history[symbol].pop(0)
-
-        return signal_data
+        signal_cache.put(symbol, context['fingerprint'], signal_data)
+        return record_signal(price_data, signal_data)
 
+    except AIDeadlineExceeded as e:
+        print(f"⏱️ {e}，本轮跳过")
+        return None
     except Exception as e:
         print(f"{symbol} AI分析失败: {e}")
         return None
 
 
+def analyze_batch_with_ai(price_data_list):
+    """
+    批量模式: 所有币种合并为一个提示词，一次AI请求返回各币种信号的JSON数组
+
+    策略背景、风险控制说明和系统提示词只发送一次；回复无法解析或缺少某些币种时，
+    这些币种退回单独分析。返回 {symbol: signal_data}
+    """
+    contexts = {data['symbol']: prepare_symbol_context(data) for data in price_data_list}
+    by_symbol = {data['symbol']: data for data in price_data_list}
+
+    # 行情状态未变化的币种直接复用缓存信号，不放入批量请求
+    cached = {}
+    for symbol, data in by_symbol.items():
+        signal_data = get_cached_signal(data, contexts[symbol])
+        if signal_data:
+            cached[symbol] = signal_data
+    symbols = [symbol for symbol in by_symbol if symbol not in cached]
+    if not symbols:
+        return cached
+    if len(symbols) == 1:
+        signal_data = analyze_with_ai(by_symbol[symbols[0]], contexts[symbols[0]])
+        if signal_data:
+            cached[symbols[0]] = signal_data
+        return cached
+
+    signals = {}
+    try:
+        result = request_ai(build_user_prompt({symbol: contexts[symbol] for symbol in symbols}),
+                            batch=True, label=f"批量{len(symbols)}币种")
+        signals = parse_batch_signals(result, symbols)
+        if not signals:
+            print(f"无法解析批量JSON: {result}")
+    except AIDeadlineExceeded as e:
+        print(f"⏱️ {e}，本轮跳过")
+        return cached
+    except Exception as e:
+        print(f"批量AI分析失败: {e}")
+
+    for symbol, signal_data in signals.items():
+        signal_cache.put(symbol, contexts[symbol]['fingerprint'], signal_data)
+        record_signal(by_symbol[symbol], signal_data)
+
+    # 回复中缺失的币种单独重新分析
+    missing = [symbol for symbol in symbols if symbol not in signals]
+    if missing:
+        print(f"批量回复缺少 {', '.join(missing)}，改为单独分析")
+        fallback = run_symbol_pipelines(lambda symbol: analyze_with_ai(by_symbol[symbol], contexts[symbol]), missing)
+        signals.update({symbol: data for symbol, data in fallback.items() if data})
+
+    signals.update(cached)
+    return signals
+
+
 def execute_trade(signal_data, price_data):
     """执行交易 - 参考AlphaArena持仓逻辑"""
     symbol = price_data['symbol']
     events = []
 
     # OKX合约需要使用 BTC/USDT:USDT 格式
-    trade_symbol = symbol
-    if EXCHANGE_TYPE == 'okx' and ':' not in symbol:
-        trade_symbol = f"{symbol}:USDT"
+    trade_symbol = get_trade_symbol(symbol)
 
     current_position = get_current_position(symbol)
 
@@ -1178,9 +1543,12 @@ def execute_trade(signal_data, price_data):
     print(f"信心程度: {signal_data['confidence']}")
     print(f"理由: {signal_data['reason']}")
 
-    # 发送分析日志到Web UI
-    send_log_to_web_ui('analysis', symbol, 'ai_analysis',
-                      f"AI分析完成: {signal_data['signal']} (信心: {signal_data['confidence']})",
+    # 发送分析日志到Web UI (预筛跳过的 HOLD 信号记为跳过，不是AI分析结果)
+    if signal_data.get('gated'):
+        log_action, log_message = 'ai_gate', f"AI预筛跳过: {signal_data['reason']}"
+    else:
+        log_action, log_message = 'ai_analysis', f"AI分析完成: {signal_data['signal']} (信心: {signal_data['confidence']})"
+    send_log_to_web_ui('analysis', symbol, log_action, log_message,
                       success=True,
                       details={
                           'signal': signal_data['signal'],
@@ -1322,12 +1690,8 @@ def execute_trade(signal_data, price_data):
                             # 平多仓(long)：卖出(sell)，平空仓(short)：买入(buy)
                             side = 'sell' if pos['side'] == 'long' else 'buy'
 
-                            # 转换交易对格式：BNB/USDT -> BNB-USDT-SWAP，SOL特殊处理
-                            base_symbol = symbol.replace('/USDT', '')
-                            if base_symbol == 'SOL':
-                                okx_inst_id = 'SOL-USDT-SWAP'
-                            else:
-                                okx_inst_id = f'{base_symbol}-USDT-SWAP'
+                            # 转换交易对格式：BNB/USDT -> BNB-USDT-SWAP
+                            okx_inst_id = symbol_registry.inst_id(symbol)
 
                             print(f"平仓交易对转换: {symbol} -> {okx_inst_id}")
                             # 使用OKX原生API平仓
@@ -1396,6 +1760,9 @@ def execute_trade(signal_data, price_data):
                         # 发送平仓失败日志到Web UI
                         send_log_to_web_ui('trade', symbol, 'close', f"平仓失败: {e}",
                                           success=False, details=error_event['details'])
+
+                    # 持仓已变化，使持仓快照失效
+                    position_snapshot.invalidate()
             else:
                 print(f"✅ 持有{pos['side']}仓 (价格比例: {price_ratio:.2%}, 盈亏: {pos['unrealized_pnl']:.2f} USDT)")
                 events.append({
@@ -1451,23 +1818,23 @@ def execute_trade(signal_data, price_data):
 
             print(f"📊 策略调整: 信心{confidence} {base_leverage}x -> 历史表现调整后 {adjusted_leverage}x")
 
-            # 设置杠杆
+            # 设置杠杆 (与当前杠杆一致时跳过请求)
             try:
+                pos_side = None
                 if EXCHANGE_TYPE == 'okx':
                     pos_side = 'long' if signal_data['signal'] == 'BUY' else 'short'
-                    exchange.set_leverage(adjusted_leverage, trade_symbol, params={'mgnMode': 'isolated', 'posSide': pos_side})
+                if leverage_state.ensure(trade_symbol, adjusted_leverage, pos_side=pos_side):
+                    print(f"✅ 杠杆设置成功: {adjusted_leverage}x")
                 else:
-                    exchange.set_leverage(adjusted_leverage, trade_symbol)
-                print(f"✅ 杠杆设置成功: {adjusted_leverage}x")
+                    print(f"✅ 杠杆已是 {adjusted_leverage}x，无需设置")
             except Exception as e:
                 print(f"⚠️ 设置杠杆警告: {e} (可能已设置)")
 
             # 计算合约张数
             if EXCHANGE_TYPE == 'okx':
-                # 加载市场信息获取合约面值
-                exchange.load_markets()
-                market = exchange.market(trade_symbol)
-                contract_size = market.get('contractSize', 1)  # 每张合约的币数
+                # 读取预先缓存的合约面值和精度 (不在下单路径上请求市场信息)
+                sizing = symbol_registry.order_sizing(trade_symbol)
+                contract_size = sizing['contract_size']  # 每张合约的币数
 
                 # 使用杠杆计算购买力
                 buying_power = TRADE_CONFIG['amount_usd'] * adjusted_leverage  # 保证金 × 杠杆 = 购买力
@@ -1475,15 +1842,15 @@ def execute_trade(signal_data, price_data):
                 amount_contracts = coins_needed / contract_size  # 币数 / 合约面值 = 张数
 
                 # 根据合约精度调整下单数量
-                amount_precision = market.get('precision', {}).get('amount', 1)
-                min_amount = market.get('limits', {}).get('amount', {}).get('min', 1)
+                amount_precision = sizing['amount_precision']
+                min_amount = sizing['min_amount']
 
-                if amount_precision == 1:
+                if sizing['amount_decimals'] == 0:
                     # 整数精度（如BTC）
                     amount_contracts = max(min_amount, int(amount_contracts))
                 else:
                     # 小数精度（如SOL为0.01）
-                    amount_contracts = max(min_amount, round(amount_contracts, int(-amount_precision)))
+                    amount_contracts = max(min_amount, round(amount_contracts, sizing['amount_decimals']))
 
                 print(f"精度调整: 原始{coins_needed/contract_size:.6f} -> 精度{amount_precision} -> 最终{amount_contracts}")
 
@@ -1505,12 +1872,7 @@ def execute_trade(signal_data, price_data):
                 print(f"🟢 开多仓: {amount_contracts:.6f} 张 {symbol} (杠杆: {adjusted_leverage}x)")
                 if EXCHANGE_TYPE == 'okx':
                     # OKX双向持仓模式：使用原生API
-                    base_symbol = symbol.replace('/USDT', '')
-                    # SOL合约使用特殊的格式，其他使用标准格式
-                    if base_symbol == 'SOL':
-                        okx_inst_id = 'SOL-USDT-SWAP'
-                    else:
-                        okx_inst_id = f'{base_symbol}-USDT-SWAP'
+                    okx_inst_id = symbol_registry.inst_id(symbol)
 
                     print(f"交易对转换: {symbol} -> {okx_inst_id}")
                     result = exchange.private_post_trade_order({
@@ -1547,12 +1909,7 @@ def execute_trade(signal_data, price_data):
                 print(f"🔴 开空仓: {amount_contracts:.6f} 张 {symbol} (杠杆: {adjusted_leverage}x)")
                 if EXCHANGE_TYPE == 'okx':
                     # OKX双向持仓模式：使用原生API
-                    base_symbol = symbol.replace('/USDT', '')
-                    # SOL合约使用特殊的格式，其他使用标准格式
-                    if base_symbol == 'SOL':
-                        okx_inst_id = 'SOL-USDT-SWAP'
-                    else:
-                        okx_inst_id = f'{base_symbol}-USDT-SWAP'
+                    okx_inst_id = symbol_registry.inst_id(symbol)
 
                     print(f"交易对转换: {symbol} -> {okx_inst_id}")
                     result = exchange.private_post_trade_order({
@@ -1602,8 +1959,7 @@ def execute_trade(signal_data, price_data):
                 print(f"  交易对: {symbol}")
                 print(f"  转换后: {trade_symbol}")
                 if EXCHANGE_TYPE == 'okx':
-                    base_symbol = symbol.replace('/USDT', '')
-                    okx_inst_id = 'SOL-USDT-SWAP' if base_symbol == 'SOL' else f'{base_symbol}-USDT-SWAP'
+                    okx_inst_id = symbol_registry.inst_id(symbol)
                     print(f"  OKX合约ID: {okx_inst_id}")
                     print(f"  杠杆: {adjusted_leverage}x")
                     print(f"  合约张数: {amount_contracts}")
@@ -1631,6 +1987,9 @@ def execute_trade(signal_data, price_data):
                               success=False,
                               details=error_event['details'])
 
+        # 持仓已变化，使持仓快照失效
+        position_snapshot.invalidate()
+
     else:
         events.append({
             'type': 'analysis',
@@ -1642,33 +2001,148 @@ def execute_trade(signal_data, price_data):
 
     return events
 
-def trading_bot():
-    """主交易机器人函数 - 多币种版本"""
+def analyze_symbol(price_data, force=False):
+    """
+    单个币种: 本地预筛 -> AI分析 (trading_bot、web_ui 自动交易和手动分析共用)
+
+    预筛跳过时返回 gate_symbol 给出的 HOLD 信号 (无持仓时为 None)；
+    force=True 时 (手动分析) 不经过预筛直接分析，分析后同样更新预筛的基准状态。
+    """
+    symbol = price_data['symbol']
+    if force:
+        run, gate_state, signal_data = True, get_gate_state(price_data) if TRADE_CONFIG['ai_gate'] else None, None
+    else:
+        run, gate_state, signal_data = gate_symbol(price_data)
+    if run:
+        signal_data = analyze_with_ai(price_data)
+        if signal_data and gate_state:
+            ai_gate.mark_analyzed(symbol, gate_state)
+    return signal_data
+
+
+def analyze_symbols_batch(price_data):
+    """
+    批量模式: 本地预筛后，行情明显变化的币种合并为一次AI请求
+
+    price_data 为 {symbol: 行情数据}，返回 {symbol: signal_data} (预筛跳过且无持仓的币种不在结果中)
+    """
+    signals, gate_states, pending = {}, {}, []
+    for symbol, data in price_data.items():
+        run, gate_states[symbol], signal_data = gate_symbol(data)
+        if run:
+            pending.append(data)
+        elif signal_data:
+            signals[symbol] = signal_data
+
+    if pending:
+        fresh = analyze_batch_with_ai(pending)
+        for symbol in fresh:
+            if gate_states[symbol]:
+                ai_gate.mark_analyzed(symbol, gate_states[symbol])
+        signals.update(fresh)
+    return signals
+
+
+def process_symbol(symbol):
+    """单个币种的完整处理流程: 获取K线 -> AI分析 -> 执行交易"""
+    print(f"\n{'*'*60}")
+    print(f"分析 {symbol}")
+    print(f"{'*'*60}")
+
+    # 1. 获取K线数据
+    price_data = get_ohlcv(symbol)
+    if not price_data:
+        return None
+
+    print(f"[{symbol}] 当前价格: ${price_data['price']:,.2f}")
+    print(f"[{symbol}] 价格变化: {price_data['price_change']:+.2f}%")
+
+    # 2. 本地预筛，行情有明显变化时才使用AI分析
+    signal_data = analyze_symbol(price_data)
+    if not signal_data:
+        return None
+
+    # 3. 执行交易
+    return execute_trade(signal_data, price_data)
+
+
+def _run_isolated(worker, symbol):
+    """执行单个币种的流程，异常只影响该币种"""
+    try:
+        return worker(symbol)
+    except Exception as e:
+        print(f"❌ {symbol} 处理失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def run_symbol_pipelines(worker, symbols=None):
+    """在有界线程池中并发执行各币种的处理流程，返回 {symbol: 结果}"""
+    symbols = list(symbols or TRADE_CONFIG['symbols'])
+    max_workers = min(TRADE_CONFIG.get('max_workers', 1), len(symbols))
+
+    if max_workers <= 1:
+        return {symbol: _run_isolated(worker, symbol) for symbol in symbols}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='symbol') as pool:
+        futures = {symbol: pool.submit(_run_isolated, worker, symbol) for symbol in symbols}
+        return {symbol: future.result() for symbol, future in futures.items()}
+
+
+def run_batch_pipeline(symbols=None):
+    """批量模式: 并发获取各币种K线 -> 一次AI请求分析所有币种 -> 并发执行交易"""
+    price_data = {symbol: data for symbol, data in run_symbol_pipelines(get_ohlcv, symbols).items() if data}
+    signals = analyze_symbols_batch(price_data)
+    if not signals:
+        return {}
+    return run_symbol_pipelines(lambda symbol: execute_trade(signals[symbol], price_data[symbol]), list(signals))
+
+
+def trading_bot(symbols=None):
+    """主交易机器人函数 - 多币种版本 (symbols 为空时处理全部币种)，同一时刻只运行一轮"""
+    with trading_cycle_lock:
+        run_trading_cycle(symbols)
+
+
+def run_trading_cycle(symbols=None):
+    """一轮交易: 刷新持仓 -> 预取 -> 指标 -> AI分析 -> 执行交易 -> 汇总"""
     print("\n" + "=" * 80)
     print(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 80)
 
-    # 遍历所有交易对
-    for symbol in TRADE_CONFIG['symbols']:
-        print(f"\n{'*'*60}")
-        print(f"分析 {symbol}")
-        print(f"{'*'*60}")
+    # 每轮开始时刷新持仓快照，本轮所有币种共享
+    position_snapshot.invalidate()
 
-        # 1. 获取K线数据
-        price_data = get_ohlcv(symbol)
-        if not price_data:
-            continue
+    # 所有币种的K线和持仓并发预取 (失败的部分由各币种流程同步补齐)
+    try:
+        prefetch_cycle_data(symbols)
+    except Exception as e:
+        print(f"并发预取失败: {e}")
 
-        print(f"当前价格: ${price_data['price']:,.2f}")
-        print(f"价格变化: {price_data['price_change']:+.2f}%")
+    # 所有币种的多周期指标先批量计算一次，各币种流程直接读取缓存
+    if TRADE_CONFIG['batch_indicators']:
+        analyze_trends_batch(symbols)
 
-        # 2. 使用AI分析
-        signal_data = analyze_with_ai(price_data)
-        if not signal_data:
-            continue
+    # 各交易对并发执行 获取数据 -> AI分析 -> 执行交易 (批量模式下AI分析合并为一次请求)
+    skipped_before = ai_gate.stats()['skipped']
+    if TRADE_CONFIG['ai_batch_prompt']:
+        run_batch_pipeline(symbols)
+    else:
+        run_symbol_pipelines(process_symbol, symbols)
 
-        # 3. 执行交易
-        execute_trade(signal_data, price_data)
+    # AI调用预筛统计
+    if TRADE_CONFIG['ai_gate']:
+        gate_stats = ai_gate.stats()
+        print(f"\n🔎 AI预筛: 本轮跳过 {gate_stats['skipped'] - skipped_before} 次AI请求，"
+              f"累计跳过 {gate_stats['skipped']}/{gate_stats['skipped'] + gate_stats['analyzed']} "
+              f"({gate_stats['skip_rate'] * 100:.1f}%)，放行原因: {gate_stats['triggers']}")
+
+    # 服务商前缀缓存统计
+    cache_stats = prompt_cache_stats.stats()
+    if cache_stats['prompt_tokens']:
+        print(f"🧠 AI输入token累计: {cache_stats['prompt_tokens']} ({cache_stats['requests']} 次请求)，"
+              f"前缀缓存命中 {cache_stats['cached_tokens']} ({cache_stats['hit_rate'] * 100:.1f}%)")
 
     # 显示总体持仓情况
     print(f"\n{'='*80}")
@@ -1751,6 +2225,20 @@ def trading_bot():
     print(f"{'='*80}\n")
 
 
+def scheduled_prefetch(symbols):
+    """定时轮询: 各币种错开拉取K线写入缓存 (推送正常、代理已连接或缓存已是最新时不请求)"""
+    for symbol in symbols:
+        if needs_candle_prefetch(symbol):
+            candle_cache.get_bars(get_trade_symbol(symbol), TRADE_CONFIG['timeframe'], 10)
+
+
+def scheduled_trading_bot():
+    """定时轮询 - 每根K线所有币种统一分析一次；行情推送正常时由K线收盘事件触发分析，这里跳过"""
+    if market_stream and market_stream.healthy():
+        return
+    trading_bot()
+
+
 def main():
     """主函数"""
     print("🤖 多币种自动交易机器人启动成功！")
@@ -1771,31 +2259,42 @@ def main():
         print("交易所初始化失败，程序退出")
         return
 
-    # 根据时间周期设置执行频率
-    if TRADE_CONFIG['timeframe'] == '1h':
-        # 每小时执行一次，在整点后的1分钟执行
-        schedule.every().hour.at(":01").do(trading_bot)
-        print("执行频率: 每小时一次")
-    elif TRADE_CONFIG['timeframe'] == '15m':
-        # 每15分钟执行一次
-        schedule.every(15).minutes.do(trading_bot)
-        print("执行频率: 每15分钟一次")
-    elif TRADE_CONFIG['timeframe'] == '3m':
-        # 每3分钟执行一次
-        schedule.every(3).minutes.do(trading_bot)
-        print("执行频率: 每3分钟一次")
-    else:
-        # 默认1小时
-        schedule.every().hour.at(":01").do(trading_bot)
-        print("执行频率: 每小时一次")
+    # 定时轮询与K线收盘对齐 (按交易所时间): 收盘 close_delay 秒后各币种错开拉取K线，
+    # 全部拉取完后统一分析一轮 (持仓刷新、AI请求和汇总每根K线只做一次，批量模式可合并为一次AI请求)
+    stagger = TRADE_CONFIG['symbol_stagger']
+    timeframe_ms = candle_cache.timeframe_ms(TRADE_CONFIG['timeframe'])
+    cycle_delay = TRADE_CONFIG['close_delay'] + stagger * len(TRADE_CONFIG['symbols'])
+    scheduler = CandleScheduler(exchange_clock, resync_interval=TRADE_CONFIG['clock_resync_interval'])
+    scheduler.every_close(timeframe_ms, scheduled_prefetch, symbols=TRADE_CONFIG['symbols'],
+                          delay=TRADE_CONFIG['close_delay'], stagger=stagger)
+    scheduler.every_close(timeframe_ms, scheduled_trading_bot, delay=cycle_delay)
+    print(f"执行频率: 每根{TRADE_CONFIG['timeframe']}K线收盘后{TRADE_CONFIG['close_delay']}秒起各币种间隔{stagger}秒拉取K线，"
+          f"收盘后{cycle_delay}秒统一分析")
+
+    # 共享内存行情快照: web_ui 和其他策略进程直接读取本进程的行情和持仓
+    start_snapshot_writer()
+
+    # 异步交易所客户端: 每轮的行情和持仓请求并发发出
+    if TRADE_CONFIG['async_exchange']:
+        start_async_exchange()
+
+    # 行情推送: K线收盘后立即分析对应币种
+    if TRADE_CONFIG['market_stream']:
+        start_market_stream()
 
     # 立即执行一次
     trading_bot()
 
     # 循环执行
     while True:
-        schedule.run_pending()
-        time.sleep(1)
+        wait = min(1, scheduler.seconds_until_next())
+        if market_stream:
+            closed_symbols = market_stream.wait_for_closed(timeout=wait)
+            if closed_symbols:
+                trading_bot([symbol_registry.canonical(s) for s in closed_symbols])
+        else:
+            time.sleep(wait)
+        scheduler.run_pending()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+历史K线批量下载 - 按 since 分页拉取多个币种/周期的历史K线，写入磁盘K线存储 (CandleStore)
+
+各 (symbol, timeframe) 在线程池中并发下载，请求频率由交易所对象的限流器控制；
+每下载一页就记录进度，中断后再次运行从上次的位置继续。
+
+用法: python3 history_downloader.py --days 90 --timeframes 3m,15m,4h
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from candle_store import CandleStore
+
+DEFAULT_HISTORY_DIR = os.getenv('HISTORY_STORE_DIR',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history'))
+
+
+class HistoryDownloader:
+    """历史K线下载器 - 每个 (symbol, timeframe) 一个任务，进度保存在 checkpoint 文件中"""
+
+    def __init__(self, exchange, store, checkpoint_path=None, max_workers=4, page_limit=100,
+                 retries=3, retry_delay=2):
+        self.exchange = exchange
+        self.store = store
+        self.checkpoint_path = checkpoint_path or os.path.join(store.root, 'checkpoint.json')
+        self.max_workers = max_workers
+        self.page_limit = page_limit  # 每次请求的K线数 (OKX 历史K线接口最多100)
+        self.retries = retries  # 单页请求失败后的重试次数
+        self.retry_delay = retry_delay
+        self._checkpoint = self._load_checkpoint()
+        self._lock = threading.Lock()
+        self.request_count = 0
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_checkpoint(self, key, cursor):
+        """记录下一页的起始时间 (先写临时文件再替换，中断时不会留下损坏的进度文件)"""
+        with self._lock:
+            self._checkpoint[key] = cursor
+            os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+            tmp_path = f"{self.checkpoint_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._checkpoint, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.checkpoint_path)
+
+    def download(self, symbols, timeframes, since, until=None):
+        """
+        并发下载 [since, until) 区间的已收盘K线 (毫秒时间戳，until 默认为当前时间)
+
+        返回 {(symbol, timeframe): 新写入的K线数}，下载失败的任务值为异常对象
+        """
+        until = until or self.exchange.milliseconds()
+        tasks = [(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='history') as pool:
+            futures = {task: pool.submit(self._download_one, task[0], task[1], since, until) for task in tasks}
+            results = {}
+            for task, future in futures.items():
+                try:
+                    results[task] = future.result()
+                except Exception as e:
+                    print(f"❌ {task[0]} {task[1]} 历史K线下载失败: {e}")
+                    results[task] = e
+            return results
+
+    def _download_one(self, symbol, timeframe, since, until):
+        key = f"{symbol}|{timeframe}"
+        tf_ms = self.exchange.parse_timeframe(timeframe) * 1000
+        cursor = max(since, self._checkpoint.get(key, since))
+        last_ts = self.store.last_timestamp(symbol, timeframe)
+        if last_ts is not None:
+            cursor = max(cursor, last_ts + tf_ms)
+
+        written = 0
+        while cursor < until:
+            page = self._fetch_page(symbol, timeframe, cursor)
+            # 只保存区间内已收盘的K线
+            now_ms = self.exchange.milliseconds()
+            candles = [c for c in page if c[0] >= cursor and c[0] < until and c[0] + tf_ms <= now_ms]
+            if not candles:
+                break  # 没有更多已收盘K线
+            written += self.store.append(symbol, timeframe, candles)
+            cursor = candles[-1][0] + tf_ms
+            self._save_checkpoint(key, cursor)
+
+        print(f"✅ {symbol} {timeframe} 历史K线: 新增 {written} 根，共 {self.store.count(symbol, timeframe)} 根")
+        return written
+
+    def _fetch_page(self, symbol, timeframe, since):
+        for attempt in range(self.retries + 1):
+            try:
+                page = self.exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=self.page_limit)
+                with self._lock:
+                    self.request_count += 1
+                return page or []
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                print(f"{symbol} {timeframe} 请求失败，{self.retry_delay}秒后重试: {e}")
+                time.sleep(self.retry_delay * (attempt + 1))
+
+
+def main():
+    """命令行入口 - 默认下载 deepseek.py 中配置的全部币种"""
+    parser = argparse.ArgumentParser(description='批量下载历史K线')
+    parser.add_argument('--days', type=float, default=30, help='下载最近多少天 (默认30)')
+    parser.add_argument('--timeframes', default='3m,15m,4h', help='K线周期，逗号分隔')
+    parser.add_argument('--symbols', default=None, help='交易对，逗号分隔 (默认使用 TRADE_CONFIG 中的币种)')
+    parser.add_argument('--workers', type=int, default=4, help='并发任务数')
+    parser.add_argument('--dir', default=DEFAULT_HISTORY_DIR, help='存储目录')
+    args = parser.parse_args()
+
+    # 复用主策略的交易所配置、请求限流和交易对格式，数据与实盘K线缓存一致
+    from deepseek import exchange, TRADE_CONFIG, get_trade_symbol
+    symbols = args.symbols.split(',') if args.symbols else TRADE_CONFIG['symbols']
+    symbols = [get_trade_symbol(s) for s in symbols]
+    timeframes = args.timeframes.split(',')
+    since = exchange.milliseconds() - int(args.days * 86400 * 1000)
+
+    downloader = HistoryDownloader(exchange, CandleStore(args.dir), max_workers=args.workers)
+    print(f"📥 下载 {len(symbols)} 个币种 × {len(timeframes)} 个周期，最近 {args.days} 天 -> {args.dir}")
+    results = downloader.download(symbols, timeframes, since)
+    failed = [task for task, result in results.items() if isinstance(result, Exception)]
+    print(f"完成: 请求 {downloader.request_count} 次，失败 {len(failed)} 个任务 (再次运行可继续下载)")
+
+
+if __name__ == "__main__":
+    main()
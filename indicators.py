@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+增量技术指标引擎 - 每个 (symbol, timeframe) 保存运行状态，新K线收盘时 O(1) 更新
+多币种批量计算 - 按 (币种 × K线) 二维数组一次向量化计算
+"""
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+NAN = float('nan')
+
+
+class RollingMean:
+    """滚动均值 - 维护窗口内的累加和"""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+
+    def update(self, value):
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+        return self.value
+
+    @property
+    def value(self):
+        if len(self.values) < self.window:
+            return NAN
+        return self.total / self.window
+
+
+class RollingStats:
+    """滚动均值和样本标准差 - Welford 算法 (支持移出窗口的旧值)"""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.values.append(value)
+        count = len(self.values)
+        delta = value - self.mean
+        self.mean += delta / count
+        self.m2 += delta * (value - self.mean)
+
+        if count > self.window:
+            old = self.values.popleft()
+            count -= 1
+            delta_old = old - self.mean
+            self.mean -= delta_old / count
+            self.m2 -= delta_old * (old - self.mean)
+            self.m2 = max(self.m2, 0.0)
+
+    @property
+    def ready(self):
+        return len(self.values) >= self.window
+
+    @property
+    def std(self):
+        if not self.ready:
+            return NAN
+        return math.sqrt(self.m2 / (self.window - 1))
+
+
+class EMA:
+    """指数移动平均 - 递推形式，结果与 pandas ewm(span=N) (adjust=True) 一致"""
+
+    def __init__(self, span):
+        self.decay = 1 - 2 / (span + 1)
+        self.numerator = 0.0
+        self.denominator = 0.0
+
+    def update(self, value):
+        self.numerator = value + self.decay * self.numerator
+        self.denominator = 1 + self.decay * self.denominator
+        return self.value
+
+    @property
+    def value(self):
+        if self.denominator == 0:
+            return NAN
+        return self.numerator / self.denominator
+
+
+class WilderRSI:
+    """RSI - Wilder 平滑 (前 period 个变化取简单平均，之后递推)"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.prev_close = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+
+    def update(self, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return self.value
+
+        change = close - self.prev_close
+        self.prev_close = close
+        gain = max(change, 0.0)
+        loss = max(-change, 0.0)
+
+        self.count += 1
+        if self.count <= self.period:
+            self.avg_gain += gain / self.period
+            self.avg_loss += loss / self.period
+        else:
+            self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        return self.value
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return NAN
+        if self.avg_loss == 0:
+            return 100.0 if self.avg_gain > 0 else 50.0
+        rs = self.avg_gain / self.avg_loss
+        return 100 - (100 / (1 + rs))
+
+
+class IndicatorState:
+    """单个 (symbol, timeframe) 的全部指标运行状态"""
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.sma = {window: RollingMean(window) for window in (5, 10, 20)}
+        self.ema = {span: EMA(span) for span in (20, 50)}
+        self.macd_fast = EMA(12)
+        self.macd_slow = EMA(26)
+        self.macd_signal = EMA(9)
+        self.rsi = WilderRSI(14)
+        self.bollinger = RollingStats(20)
+        self.volume_sma = RollingMean(10)
+        self.latest = None
+
+    def update(self, candle):
+        """加入一根已收盘K线 [timestamp, open, high, low, close, volume]"""
+        timestamp, _, high, low, close, volume = candle[:6]
+        close = float(close)
+        volume = float(volume)
+
+        for indicator in self.sma.values():
+            indicator.update(close)
+        for indicator in self.ema.values():
+            indicator.update(close)
+        macd = self.macd_fast.update(close) - self.macd_slow.update(close)
+        signal = self.macd_signal.update(macd)
+        self.rsi.update(close)
+        self.bollinger.update(close)
+        self.volume_sma.update(volume)
+
+        bb_std = self.bollinger.std
+        bb_middle = self.sma[20].value
+
+        previous = self.latest
+        if previous is not None:
+            previous = dict(previous)
+            previous.pop('prev', None)
+
+        self.latest = {
+            'timestamp': timestamp,
+            'close': close,
+            'high': float(high),
+            'low': float(low),
+            'volume': volume,
+            'sma_5': self.sma[5].value,
+            'sma_10': self.sma[10].value,
+            'sma_20': self.sma[20].value,
+            'ema_20': self.ema[20].value,
+            'ema_50': self.ema[50].value,
+            'rsi': self.rsi.value,
+            'macd': macd,
+            'signal': signal,
+            'histogram': macd - signal,
+            'bb_middle': bb_middle,
+            'bb_upper': bb_middle + bb_std * 2,
+            'bb_lower': bb_middle - bb_std * 2,
+            'volume_sma_10': self.volume_sma.value,
+            'prev': previous,
+        }
+        self.last_timestamp = timestamp
+        return self.latest
+
+
+class IndicatorEngine:
+    """增量指标引擎 - 按 (symbol, timeframe) 保存状态，只处理新收盘的K线"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def update(self, symbol, timeframe, closed_candles):
+        """用已收盘K线更新指标并返回最新值 (含上一根K线的 'prev')"""
+        key = (symbol, timeframe)
+        with self._lock:
+            state = self._states.get(key)
+
+            # 首次使用或K线断档时，用传入的K线重新预热
+            if state is None or not closed_candles or state.last_timestamp is None or \
+                    closed_candles[0][0] > state.last_timestamp:
+                state = IndicatorState()
+                self._states[key] = state
+
+            for candle in closed_candles:
+                if state.last_timestamp is not None and candle[0] <= state.last_timestamp:
+                    continue
+                state.update(candle)
+
+            return state.latest
+
+    def latest(self, symbol, timeframe):
+        """读取最新指标值 (未计算过返回None)"""
+        with self._lock:
+            state = self._states.get((symbol, timeframe))
+            return state.latest if state else None
+
+    def reset(self, symbol=None, timeframe=None):
+        """清除指标状态"""
+        with self._lock:
+            for key in list(self._states):
+                if symbol is not None and key[0] != symbol:
+                    continue
+                if timeframe is not None and key[1] != timeframe:
+                    continue
+                del self._states[key]
+
+
+def _ema_series(values, span):
+    """逐列递推 EMA (与 pandas ewm(span=N) 一致)，对所有行同时计算"""
+    decay = 1 - 2 / (span + 1)
+    result = np.empty_like(values)
+    numerator = np.zeros(values.shape[0])
+    denominator = 0.0
+    for t in range(values.shape[1]):
+        numerator = values[:, t] + decay * numerator
+        denominator = 1 + decay * denominator
+        result[:, t] = numerator / denominator
+    return result
+
+
+def _rolling_tail(values, window, func):
+    """只计算最后两列的滚动统计量 (窗口不足时为NaN)"""
+    tail = np.full((values.shape[0], 2), NAN)
+    bars = values.shape[1]
+    for offset, end in enumerate((bars - 1, bars)):
+        if end >= window:
+            tail[:, offset] = func(values[:, end - window:end])
+    return tail
+
+
+def _wilder_rsi_tail(closes, period=14):
+    """Wilder RSI 最后两列"""
+    changes = np.diff(closes, axis=1)
+    gains = np.maximum(changes, 0.0)
+    losses = np.maximum(-changes, 0.0)
+    tail = np.full((closes.shape[0], 2), NAN)
+    if changes.shape[1] < period:
+        return tail
+
+    avg_gain = gains[:, :period].mean(axis=1)
+    avg_loss = losses[:, :period].mean(axis=1)
+    history = [(avg_gain, avg_loss)]
+    for t in range(period, changes.shape[1]):
+        avg_gain = (avg_gain * (period - 1) + gains[:, t]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[:, t]) / period
+        history.append((avg_gain, avg_loss))
+
+    for offset, (gain, loss) in zip((1, 0), history[::-1][:2]):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = 100 - 100 / (1 + gain / loss)
+        tail[:, offset] = np.where(loss == 0, np.where(gain > 0, 100.0, 50.0), rsi)
+    return tail
+
+
+def batch_indicators(candles_by_symbol):
+    """
+    批量计算多个币种的指标 - 收盘价按 (币种 × K线) 堆叠成二维数组，一次向量化计算
+
+    K线数量相同的币种放在同一个二维数组中计算，每个币种都按自己的全部K线计算，
+    结果与 IndicatorEngine 用同样的K线从头计算一致。
+    返回 {symbol: 最新指标值}，字段与 IndicatorEngine.update() 相同 (含 'prev')。
+    """
+    groups = {}
+    for symbol, candles in candles_by_symbol.items():
+        if candles:
+            groups.setdefault(len(candles), []).append(symbol)
+
+    results = {}
+    for symbols in groups.values():
+        results.update(_batch_same_length({symbol: candles_by_symbol[symbol] for symbol in symbols}))
+    return results
+
+
+def _batch_same_length(candles_by_symbol):
+    """K线数量相同的一组币种的向量化计算"""
+    symbols = list(candles_by_symbol)
+    data = np.array([[candle[:6] for candle in candles_by_symbol[symbol]] for symbol in symbols], dtype=float)
+    bars = data.shape[1]
+    closes = data[:, :, 4]
+    volumes = data[:, :, 5]
+
+    mean = lambda window: window.mean(axis=1)
+    sma = {window: _rolling_tail(closes, window, mean) for window in (5, 10, 20)}
+    ema = {span: _ema_series(closes, span)[:, -2:] for span in (20, 50)}
+    macd_series = _ema_series(closes, 12) - _ema_series(closes, 26)
+    macd = macd_series[:, -2:]
+    signal = _ema_series(macd_series, 9)[:, -2:]
+    rsi = _wilder_rsi_tail(closes)
+    bb_std = _rolling_tail(closes, 20, lambda window: window.std(axis=1, ddof=1))
+    volume_sma = _rolling_tail(volumes, 10, mean)
+
+    def snapshot(row, offset):
+        column = bars - 2 + offset
+        if column < 0:
+            return None
+        bb_middle = float(sma[20][row, offset])
+        return {
+            'timestamp': int(data[row, column, 0]),
+            'close': float(closes[row, column]),
+            'high': float(data[row, column, 2]),
+            'low': float(data[row, column, 3]),
+            'volume': float(volumes[row, column]),
+            'sma_5': float(sma[5][row, offset]),
+            'sma_10': float(sma[10][row, offset]),
+            'sma_20': float(sma[20][row, offset]),
+            'ema_20': float(ema[20][row, offset]),
+            'ema_50': float(ema[50][row, offset]),
+            'rsi': float(rsi[row, offset]),
+            'macd': float(macd[row, offset]),
+            'signal': float(signal[row, offset]),
+            'histogram': float(macd[row, offset] - signal[row, offset]),
+            'bb_middle': bb_middle,
+            'bb_upper': bb_middle + float(bb_std[row, offset]) * 2,
+            'bb_lower': bb_middle - float(bb_std[row, offset]) * 2,
+            'volume_sma_10': float(volume_sma[row, offset]),
+        }
+
+    results = {}
+    for row, symbol in enumerate(symbols):
+        latest = snapshot(row, 1)
+        latest['prev'] = snapshot(row, 0)
+        results[symbol] = latest
+    return results
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+行情数据代理进程 - 独占交易所连接，通过本地 Unix socket 向各策略进程提供K线、Ticker和持仓
+
+启动: python3 market_broker.py
+策略进程通过 connect_broker(exchange) 接入，代理未运行时自动直连交易所；
+connect_broker(exchange, lazy=True) 在首次请求时才连接，之后启动的代理也能接入。
+"""
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+from market_data import CandleCache, TickerCache, RateLimiter, RateLimitedExchange
+
+DEFAULT_SOCKET_PATH = os.getenv('MARKET_BROKER_SOCKET',
+                                os.path.join(tempfile.gettempdir(), 'dsai_market_broker.sock'))
+
+# 默认只代理行情数据；持仓是否走代理由调用方决定 (下单后需要立即看到最新持仓的策略不要代理持仓)
+MARKET_METHODS = ('fetch_ohlcv', 'fetch_ticker', 'fetch_tickers')
+
+
+class BrokerUnavailable(Exception):
+    """代理进程未运行或连接中断"""
+
+
+class MarketBroker:
+    """代理进程内的共享数据源 - 所有客户端共用同一份缓存"""
+
+    def __init__(self, exchange, ticker_ttl=2, positions_ttl=3):
+        self.exchange = exchange
+        self.candles = CandleCache(exchange)
+        self.tickers = TickerCache(exchange, ttl=ticker_ttl)
+        self.positions_ttl = positions_ttl
+        self._positions = {}  # 参数 -> (获取时间, 持仓)
+        self._positions_lock = threading.Lock()
+        self.request_count = 0
+
+    def handle(self, method, args, kwargs):
+        """处理一次客户端请求"""
+        self.request_count += 1
+        if method == 'ping':
+            return 'pong'
+        if method == 'fetch_ohlcv':
+            return self.fetch_ohlcv(*args, **kwargs)
+        if method == 'fetch_ticker':
+            return self.tickers.get(*args, **kwargs)
+        if method == 'fetch_tickers':
+            symbols = args[0] if args else kwargs.get('symbols')
+            return self.tickers.get_many(symbols)
+        if method == 'fetch_positions':
+            return self.fetch_positions(args, kwargs)
+        raise ValueError(f"不支持的方法: {method}")
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params=None):
+        # 指定 since 的历史查询直接转发，最近K线走共享缓存
+        if since is not None or params:
+            return self.exchange.fetch_ohlcv(symbol, timeframe, since, limit, params or {})
+        return self.candles.get_candles(symbol, timeframe, limit or 100)
+
+    def fetch_positions(self, args, kwargs):
+        key = json.dumps([args, kwargs], sort_keys=True)
+        with self._positions_lock:
+            cached = self._positions.get(key)
+            if cached and time.time() - cached[0] < self.positions_ttl:
+                return cached[1]
+            positions = self.exchange.fetch_positions(*args, **kwargs)
+            self._positions[key] = (time.time(), positions)
+            return positions
+
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """每个客户端连接一个线程，按行读取 JSON 请求"""
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = broker.handle(request['method'], request.get('args', []), request.get('kwargs', {}))
+                response = {'result': result}
+            except Exception as e:
+                response = {'error': f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, broker, path=DEFAULT_SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.broker = broker
+        self.path = path
+        super().__init__(path, _BrokerRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BrokerClient:
+    """
+    代理客户端 - 每个线程使用自己的连接 (服务端每个连接一个线程)，各币种线程的请求并发进行；
+    断线后该线程下次调用时重连
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=15):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = set()  # 所有线程的 (socket, file)，close() 时统一关闭
+        self._lock = threading.Lock()
+
+    def call(self, method, *args, **kwargs):
+        request = (json.dumps({'method': method, 'args': args, 'kwargs': kwargs}) + '\n').encode('utf-8')
+        conn = getattr(self._local, 'conn', None)
+        try:
+            if conn is None:
+                conn = self._connect()
+            sock, file = conn
+            sock.sendall(request)
+            line = file.readline()
+            if not line:
+                raise ConnectionError('代理连接已关闭')
+        except (OSError, ConnectionError) as e:
+            self._close(conn)
+            raise BrokerUnavailable(str(e)) from e
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"行情代理请求失败: {response['error']}")
+        return response['result']
+
+    def available(self):
+        """代理进程是否在运行"""
+        try:
+            return self.call('ping') == 'pong'
+        except Exception:
+            return False
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            self._close(conn)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        conn = (sock, sock.makefile('rb'))
+        self._local.conn = conn
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _close(self, conn):
+        if conn is None:
+            return
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        with self._lock:
+            self._connections.discard(conn)
+        sock, file = conn
+        try:
+            file.close()
+            sock.close()
+        except OSError:
+            pass
+
+
+class BrokeredExchange:
+    """交易所代理 - 指定的行情方法走代理进程 (代理不可用时直连交易所)，其余属性原样转发"""
+
+    def __init__(self, exchange, client, methods=MARKET_METHODS, retry_interval=30):
+        self._exchange = exchange
+        self._client = client
+        self._methods = set(methods)
+        self.retry_interval = retry_interval  # 代理不可用时，多少秒后再尝试连接
+        self._retry_at = 0
+        self.connected = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if name not in self._methods or not callable(attr):
+            return attr
+
+        def brokered(*args, **kwargs):
+            if time.time() >= self._retry_at:
+                try:
+                    result = self._client.call(name, *args, **kwargs)
+                    if not self.connected:
+                        self.connected = True
+                        print(f"✅ 已连接行情代理: {self._client.path}")
+                    return result
+                except BrokerUnavailable:
+                    # 代理未启动或已退出: 直连交易所，间隔一段时间后再尝试
+                    self.connected = False
+                    self._retry_at = time.time() + self.retry_interval
+            return attr(*args, **kwargs)
+        return brokered
+
+
+def connect_broker(exchange, path=DEFAULT_SOCKET_PATH, methods=MARKET_METHODS, lazy=False):
+    """
+    代理进程在运行时返回走代理的交易所对象，否则原样返回 exchange
+
+    lazy=True 时不在调用时检查代理，总是返回代理对象，首次请求行情时再连接
+    (适用于导入时代理还未启动的进程，如 web_ui 先导入策略模块再启动代理)。
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return exchange
+    if lazy:
+        return BrokeredExchange(exchange, BrokerClient(path), methods)
+    if not os.path.exists(path):
+        return exchange
+    client = BrokerClient(path)
+    if not client.available():
+        return exchange
+    brokered = BrokeredExchange(exchange, client, methods)
+    brokered.connected = True
+    print(f"✅ 已连接行情代理: {path}")
+    return brokered
+
+
+def broker_running(path=DEFAULT_SOCKET_PATH):
+    """检查代理进程是否在运行"""
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return False
+    client = BrokerClient(path, timeout=2)
+    try:
+        return client.available()
+    finally:
+        client.close()
+
+
+def create_exchange():
+    """按环境变量创建交易所连接 (与 deepseek.py 的配置一致)"""
+    import ccxt
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    proxies = {}
+    if os.getenv('HTTP_PROXY'):
+        proxies = {
+            'http': os.getenv('HTTP_PROXY'),
+            'https': os.getenv('HTTPS_PROXY', os.getenv('HTTP_PROXY')),
+        }
+
+    if os.getenv('EXCHANGE_TYPE', 'okx').lower() == 'okx':
+        return ccxt.okx({
+            'options': {
+                'defaultType': 'swap',
+                'defaultSubType': 'swap',
+                'fetchPositions': ['swap'],
+            },
+            'apiKey': os.getenv('OKX_API_KEY'),
+            'secret': os.getenv('OKX_SECRET'),
+            'password': os.getenv('OKX_PASSWORD'),
+            'proxies': proxies,
+            'enableRateLimit': True,
+        })
+    return ccxt.binance({
+        'options': {'defaultType': 'future'},
+        'apiKey': os.getenv('BINANCE_API_KEY'),
+        'secret': os.getenv('BINANCE_SECRET'),
+        'proxies': proxies,
+        'enableRateLimit': True,
+    })
+
+
+def main():
+    """启动代理进程"""
+    if not hasattr(socket, 'AF_UNIX'):
+        print("当前系统不支持 Unix socket，各策略将直连交易所")
+        return
+
+    # 所有策略的行情请求共用同一个请求预算
+    exchange = RateLimitedExchange(create_exchange(), RateLimiter(int(os.getenv('MARKET_BROKER_RATE', '10'))))
+    server = BrokerServer(MarketBroker(exchange))
+    print(f"📡 行情代理已启动: {server.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,937 @@
+# -*- coding: utf-8 -*-
+"""
+行情数据层 - 供各策略脚本共享的交易所数据缓存
+"""
+import asyncio
+import math
+import queue
+import threading
+import time
+
+
+def find_gaps(candles, timeframe_ms):
+    """找出K线序列中缺失的时间区间 [(缺口起点, 缺口后第一根K线的时间戳), ...]"""
+    gaps = []
+    for prev, cur in zip(candles, candles[1:]):
+        if cur[0] - prev[0] > timeframe_ms:
+            gaps.append((prev[0] + timeframe_ms, cur[0]))
+    return gaps
+
+
+class ExchangeClock:
+    """交易所时钟 - 记录本地时钟与交易所服务器时间的偏差，按交易所时间判断K线收盘"""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.offset_ms = 0  # 交易所时间 - 本地时间
+        self.rtt_ms = None  # 最近一次校准的请求往返时间
+        self.synced_at = None  # 最近一次校准的本地时间
+
+    def sync(self):
+        """请求交易所服务器时间，用往返时间的中点估算时钟偏差"""
+        sent = time.time() * 1000
+        server_ms = self.exchange.fetch_time()
+        received = time.time() * 1000
+        self.rtt_ms = received - sent
+        self.offset_ms = server_ms - (sent + received) / 2
+        self.synced_at = time.time()
+        return self.offset_ms
+
+    def now_ms(self):
+        """当前交易所时间 (毫秒)"""
+        return int(time.time() * 1000 + self.offset_ms)
+
+    def milliseconds(self):
+        return self.now_ms()
+
+    def next_close(self, timeframe_ms, offset_ms=0):
+        """下一根K线的收盘时间 (交易所时间，毫秒)"""
+        now_ms = self.now_ms()
+        return now_ms - (now_ms - offset_ms) % timeframe_ms + timeframe_ms
+
+
+class CandleCache:
+    """K线增量缓存 - 按 (symbol, timeframe) 保存已收盘K线，只用 since= 拉取新K线"""
+
+    def __init__(self, exchange, max_candles=500, refresh_interval=10, store=None, page_limit=100,
+                 background_backfill=False, clock=None):
+        self.exchange = exchange
+        self.clock = clock  # 交易所时钟 (ExchangeClock)，判断K线是否收盘；为空时使用本地时间
+        self.max_candles = max_candles  # 每个 (symbol, timeframe) 最多保留的已收盘K线数
+        self.refresh_interval = refresh_interval  # 两次请求之间的最小间隔(秒)，期间直接返回缓存
+        self.store = store  # 磁盘K线存储 (CandleStore)，首次访问时从磁盘预热，新收盘K线写回磁盘
+        self.page_limit = page_limit  # since 增量请求单次能返回的K线数，断档超过时先拉最新窗口再分页补齐缺口
+        self.background_backfill = background_backfill  # 发现缺口后在后台线程补齐 (读取时仍会补齐未完成的缺口)
+        self._loaded = set()  # 已从磁盘预热过的 (symbol, timeframe)
+        self._gaps = {}  # (symbol, timeframe) -> 待补齐的缺口 [(start, end), ...]
+        self._holes = {}  # (symbol, timeframe) -> 交易所本身没有数据的缺口起点 (不再请求)
+        self._healing = set()  # 后台正在补齐的 (symbol, timeframe)
+        self._backfill_queue = queue.Queue()
+        self._backfill_thread = None
+        self.backfill_count = 0  # 补齐缺口发出的请求次数
+        self._closed = {}  # (symbol, timeframe) -> [[timestamp, open, high, low, close, volume], ...]
+        self._forming = {}  # (symbol, timeframe) -> 当前未收盘K线
+        self._last_fetch = {}  # (symbol, timeframe) -> 上次请求时间
+        # 每个 (symbol, timeframe) 一把锁，请求交易所时只阻塞同一K线序列，不同币种的请求并发进行
+        self._key_locks = {}
+        self._lock = threading.Lock()  # 只保护锁表、计数和后台线程
+        self.fetch_count = 0  # 实际发出的 fetch_ohlcv 次数
+
+    def timeframe_ms(self, timeframe):
+        """K线周期对应的毫秒数"""
+        return self.exchange.parse_timeframe(timeframe) * 1000
+
+    def now_ms(self):
+        """当前交易所时间 (毫秒)"""
+        return (self.clock or self.exchange).milliseconds()
+
+    def _key_lock(self, key):
+        """该K线序列的锁 (Condition，读取方可以在其上等待后台补齐完成)"""
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Condition(threading.RLock())
+            return lock
+
+    def _continuous(self, key):
+        """缓存中的已收盘K线，仍有待补齐的缺口时只取最后一个缺口之后的连续部分"""
+        closed = self._closed.get(key, [])
+        gaps = self._gaps.get(key)
+        if gaps:
+            closed = [c for c in closed if c[0] >= gaps[-1][1]]
+        return closed
+
+    def get_bars(self, symbol, timeframe, limit):
+        """获取最近 limit 根已收盘K线和当前未收盘K线 (没有时为None)，两者分开返回"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            self._refresh(key, limit + 1, force=not self._closed_up_to_date(key, limit))
+            self._heal(key)
+            closed = [list(c) for c in self._continuous(key)[-limit:]]
+            forming = self._forming.get(key)
+            # 缓存的未收盘K线按时钟已经收盘时不再作为当前K线返回
+            if forming is not None and forming[0] + self.timeframe_ms(timeframe) <= self.now_ms():
+                forming = None
+            return closed, list(forming) if forming is not None else None
+
+    def is_current(self, symbol, timeframe, limit):
+        """缓存已包含最新收盘的 limit 根K线且刚刷新过 (此时 get_bars 不会请求交易所)"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            return (self._closed_up_to_date(key, limit)
+                    and time.time() - self._last_fetch.get(key, 0) < self.refresh_interval)
+
+    def get_candles(self, symbol, timeframe, limit):
+        """获取最近 limit 根K线 (与 fetch_ohlcv 相同格式，最后一根为未收盘K线)"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            self._refresh(key, limit)
+            self._heal(key)
+            candles = list(self._continuous(key))
+            if key in self._forming:
+                candles.append(self._forming[key])
+            return [list(c) for c in candles[-limit:]]
+
+    def get_closed_candles(self, symbol, timeframe, limit):
+        """只获取已收盘K线 (在下一根K线收盘前直接返回缓存，不发请求)"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            if not self._closed_up_to_date(key, limit):
+                self._refresh(key, limit + 1, force=True)
+            self._heal(key)
+            return [list(c) for c in self._continuous(key)[-limit:]]
+
+    def last_closed_timestamp(self, symbol, timeframe):
+        """最新一根已收盘K线的时间戳"""
+        candles = self.get_closed_candles(symbol, timeframe, 1)
+        return candles[-1][0] if candles else None
+
+    def cached_closed(self, symbol, timeframe):
+        """读取缓存中的已收盘K线 (不发请求；后台正在补齐时等待完成，仍有缺口时只返回最后一段连续K线)"""
+        key = (symbol, timeframe)
+        lock = self._key_lock(key)
+        with lock:
+            self._warm_start(key)
+            while key in self._healing:
+                lock.wait()
+            return [list(c) for c in self._continuous(key)]
+
+    def extend_closed(self, symbol, timeframe, candles):
+        """追加本地生成的已收盘K线 (只接受比缓存更新的K线)"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            closed = self._closed.get(key, [])
+            last_ts = closed[-1][0] if closed else None
+            for candle in candles:
+                if last_ts is None or candle[0] > last_ts:
+                    closed.append(list(candle))
+                    last_ts = candle[0]
+            self._closed[key] = closed[-self.max_candles:]
+            self._check_gaps(key)
+            self._persist(key, self._closed[key])
+            forming = self._forming.get(key)
+            if forming is not None and last_ts is not None and forming[0] <= last_ts:
+                self._forming.pop(key, None)
+
+    def merge(self, symbol, timeframe, ohlcv):
+        """合并调用方自行拉取的K线 (如异步请求的 fetch_ohlcv 结果)，视为一次刷新"""
+        key = (symbol, timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            self._last_fetch[key] = time.time()
+            self._merge(key, self._closed.get(key, []), ohlcv or [], self.timeframe_ms(timeframe), self.now_ms())
+
+    def push_candle(self, symbol, timeframe, candle, closed):
+        """写入推送的K线 (WebSocket)，推送期间 get_candles 不再轮询交易所"""
+        key = (symbol, timeframe)
+        tf_ms = self.timeframe_ms(timeframe)
+        with self._key_lock(key):
+            self._warm_start(key)
+            cached = self._closed.get(key, [])
+            if closed:
+                if not cached or candle[0] > cached[-1][0]:
+                    cached.append(list(candle))
+                    self._closed[key] = cached[-self.max_candles:]
+                    # 与缓存不连续 (如断线期间漏掉K线) 时记录缺口，由后台或下次读取分页补齐
+                    if len(cached) > 1 and candle[0] > cached[-2][0] + tf_ms:
+                        self._check_gaps(key)
+                    self._persist(key, [candle])
+                forming = self._forming.get(key)
+                if forming is not None and forming[0] <= candle[0]:
+                    self._forming.pop(key, None)
+            elif not cached or candle[0] > cached[-1][0]:
+                self._forming[key] = list(candle)
+            self._last_fetch[key] = time.time()
+
+    def _warm_start(self, key):
+        """首次访问时从磁盘加载最近的已收盘K线 (只取末尾连续的部分)"""
+        if self.store is None or key in self._loaded:
+            return
+        self._loaded.add(key)
+        try:
+            candles = self.store.tail(key[0], key[1], self.max_candles)
+        except Exception as e:
+            print(f"{key[0]} {key[1]} 读取磁盘K线失败: {e}")
+            return
+        if not candles:
+            return
+        tf_ms = self.timeframe_ms(key[1])
+        start = len(candles) - 1
+        while start > 0 and candles[start][0] - candles[start - 1][0] == tf_ms:
+            start -= 1
+        self._closed[key] = candles[start:]
+
+    def _persist(self, key, candles):
+        """新收盘K线写回磁盘 (磁盘已有的部分自动跳过，有缺口时只写到缺口之前)"""
+        if self.store is None or not candles:
+            return
+        gaps = self._gaps.get(key)
+        if gaps:
+            candles = [c for c in candles if c[0] < gaps[0][0]]
+            if not candles:
+                return
+        try:
+            self.store.append(key[0], key[1], candles)
+        except Exception as e:
+            print(f"{key[0]} {key[1]} 写入磁盘K线失败: {e}")
+
+    def _check_gaps(self, key):
+        """检测缓存中的缺口 (交易所本身没有数据的区间除外)，有缺口时安排补齐"""
+        holes = self._holes.get(key, ())
+        gaps = [gap for gap in find_gaps(self._closed.get(key, []), self.timeframe_ms(key[1]))
+                if gap[0] not in holes]
+        if not gaps:
+            self._gaps.pop(key, None)
+            return
+        self._gaps[key] = gaps
+        if self.background_backfill:
+            with self._lock:
+                if self._backfill_thread is None:
+                    self._backfill_thread = threading.Thread(target=self._backfill_worker, name='candle-backfill',
+                                                             daemon=True)
+                    self._backfill_thread.start()
+            self._backfill_queue.put(key)
+
+    def _backfill_worker(self):
+        """后台补齐缺口"""
+        while True:
+            key = self._backfill_queue.get()
+            try:
+                self._background_heal(key)
+            except Exception as e:
+                print(f"{key[0]} {key[1]} 补齐K线缺口失败 (下次读取时重试): {e}")
+
+    def _background_heal(self, key):
+        """
+        后台补齐: 分页请求时不持有锁 (推送照常写入，其他币种不受影响)，只在合并时持有该K线序列的锁
+
+        补齐期间读取该K线序列的调用方等待补齐完成，不会拿到带缺口的K线。
+        """
+        with self._key_lock(key):
+            gaps = self._gaps.get(key)
+            if not gaps or key in self._healing:
+                return
+            self._healing.add(key)
+        try:
+            fetched = self._fetch_gaps(key, gaps)
+            with self._key_lock(key):
+                self._apply_backfill(key, gaps, fetched)
+        finally:
+            lock = self._key_lock(key)
+            with lock:
+                self._healing.discard(key)
+                lock.notify_all()
+
+    def _heal(self, key):
+        """读取时补齐缺口 (调用方持有该K线序列的锁)；后台正在补齐时等待其完成，不重复请求"""
+        lock = self._key_lock(key)
+        while key in self._healing:
+            lock.wait()
+        gaps = self._gaps.get(key)
+        if gaps:
+            self._apply_backfill(key, gaps, self._fetch_gaps(key, gaps))
+
+    def _fetch_gaps(self, key, gaps):
+        """按 since 分页拉取缺口内的K线，返回 {timestamp: candle}"""
+        symbol, timeframe = key
+        tf_ms = self.timeframe_ms(timeframe)
+        fetched = {}
+        for start, end in gaps:
+            cursor = start
+            while cursor < end:
+                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, since=cursor, limit=self.page_limit) or []
+                with self._lock:
+                    self.backfill_count += 1
+                page = [c for c in ohlcv if cursor <= c[0] < end]
+                for candle in page:
+                    fetched[candle[0]] = list(candle)
+                # 返回的K线已越过缺口终点 (或没有更多数据) 时结束
+                if not page or ohlcv[-1][0] >= end:
+                    break
+                cursor = page[-1][0] + tf_ms
+        return fetched
+
+    def _apply_backfill(self, key, gaps, fetched):
+        """合并补齐的K线 (调用方持有该K线序列的锁)，请求过仍缺失的区间记录为交易所空洞"""
+        symbol, timeframe = key
+        tf_ms = self.timeframe_ms(timeframe)
+        closed = self._closed.get(key, [])
+        if fetched:
+            for candle in closed:
+                fetched[candle[0]] = candle
+            closed = [fetched[ts] for ts in sorted(fetched)][-self.max_candles:]
+            self._closed[key] = closed
+
+        holes = [gap for gap in find_gaps(closed, tf_ms) if any(start <= gap[0] < end for start, end in gaps)]
+        if holes:
+            print(f"{symbol} {timeframe} 交易所缺少 {len(holes)} 段K线数据，保留缺口")
+            self._holes.setdefault(key, set()).update(gap[0] for gap in holes)
+        # 补齐期间新出现的缺口 (如推送断线) 重新安排
+        self._check_gaps(key)
+        self._persist(key, closed)
+
+    def _closed_up_to_date(self, key, limit):
+        """缓存中的已收盘K线是否已包含按时钟应当收盘的最新K线"""
+        closed = self._closed.get(key, [])
+        if len(closed) < limit:
+            return False
+        tf_ms = self.timeframe_ms(key[1])
+        return closed[-1][0] + 2 * tf_ms > self.now_ms()
+
+    def invalidate(self, symbol=None, timeframe=None):
+        """清除缓存 (不指定参数则全部清除)"""
+        for key in list(self._closed.keys() | self._forming.keys()):
+            if symbol is not None and key[0] != symbol:
+                continue
+            if timeframe is not None and key[1] != timeframe:
+                continue
+            with self._key_lock(key):
+                self._closed.pop(key, None)
+                self._forming.pop(key, None)
+                self._last_fetch.pop(key, None)
+
+    def _refresh(self, key, limit, force=False):
+        """按需从交易所补齐新K线 (force: 有K线刚收盘时忽略刷新间隔)"""
+        symbol, timeframe = key
+        closed = self._closed.get(key, [])
+        now = time.time()
+
+        # 缓存足够且刚刷新过，直接使用
+        if not force and len(closed) + 1 >= limit and now - self._last_fetch.get(key, 0) < self.refresh_interval:
+            return
+
+        tf_ms = self.timeframe_ms(timeframe)
+        now_ms = self.now_ms()
+
+        if len(closed) + 1 < limit or not closed:
+            # 首次加载或缓存不足: 拉取完整窗口
+            ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, limit=min(limit, self.max_candles))
+            closed = []
+        else:
+            missing = (now_ms - closed[-1][0]) // tf_ms
+            if missing >= self.max_candles:
+                # 断档超过缓存容量，旧K线已用不上: 重新拉取完整窗口
+                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, limit=min(limit, self.max_candles))
+                closed = []
+            elif missing >= max(limit, self.page_limit):
+                # 断档超过一页: 先拉取最新窗口，中间的缺口分页补齐
+                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, limit=min(limit, self.max_candles))
+            else:
+                ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, since=closed[-1][0] + tf_ms)
+        with self._lock:
+            self.fetch_count += 1
+        self._last_fetch[key] = now
+
+        self._merge(key, closed, ohlcv or [], tf_ms, now_ms)
+
+    def _merge(self, key, closed, ohlcv, tf_ms, now_ms):
+        """合并新K线: 已收盘的追加到缓存，未收盘的单独保存"""
+        last_ts = closed[-1][0] if closed else None
+        forming = None
+        for candle in ohlcv:
+            ts = candle[0]
+            if last_ts is not None and ts <= last_ts:
+                continue
+            if ts + tf_ms <= now_ms:
+                closed.append(list(candle))
+                last_ts = ts
+            else:
+                forming = list(candle)
+
+        if len(closed) > self.max_candles:
+            closed = closed[-self.max_candles:]
+        self._closed[key] = closed
+        self._check_gaps(key)
+        self._persist(key, closed)
+
+        if forming is not None:
+            self._forming[key] = forming
+        else:
+            self._forming.pop(key, None)
+
+
+def aggregate_candles(candles, timeframe_ms, offset_ms=0):
+    """把低周期K线按时间桶合并为高周期K线 (桶起点按 offset_ms 对齐)"""
+    bars = []
+    for ts, open_, high, low, close, volume in (c[:6] for c in candles):
+        bucket = ts - (ts - offset_ms) % timeframe_ms
+        if bars and bars[-1][0] == bucket:
+            bar = bars[-1]
+            bar[2] = max(bar[2], high)
+            bar[3] = min(bar[3], low)
+            bar[4] = close
+            bar[5] += volume
+        else:
+            bars.append([bucket, open_, high, low, close, volume])
+    return bars
+
+
+class BarAggregator:
+    """
+    高周期K线合成器 - 用缓存的基础周期K线 (如3m) 在本地合成15m/4h K线
+
+    每个高周期首次使用时从交易所加载一次历史K线作为预热，
+    之后只拉取基础周期，新收盘的高周期K线由基础K线合成后写回缓存。
+    """
+
+    def __init__(self, cache, base_timeframe, offset_ms=0):
+        self.cache = cache
+        self.base_timeframe = base_timeframe
+        self.offset_ms = offset_ms  # 时间桶对齐偏移 (交易所按UTC整点对齐时为0)
+        self._key_locks = {}  # (symbol, timeframe) -> 锁，不同币种的合成互不阻塞
+        self._lock = threading.Lock()
+        self.derived_count = 0  # 本地合成的K线数
+
+    def get_closed_candles(self, symbol, timeframe, limit):
+        """获取已收盘K线，高周期K线优先由基础周期合成"""
+        if timeframe != self.base_timeframe:
+            with self._lock:
+                lock = self._key_locks.setdefault((symbol, timeframe), threading.Lock())
+            with lock:
+                self._derive(symbol, timeframe, limit)
+        return self.cache.get_closed_candles(symbol, timeframe, limit)
+
+    def last_closed_timestamp(self, symbol, timeframe):
+        """最新一根已收盘K线的时间戳"""
+        candles = self.get_closed_candles(symbol, timeframe, 1)
+        return candles[-1][0] if candles else None
+
+    def get_candles(self, symbol, timeframe, limit):
+        """获取最近 limit 根K线，最后一根为由基础K线合成的未收盘K线"""
+        if timeframe == self.base_timeframe:
+            return self.cache.get_candles(symbol, timeframe, limit)
+
+        closed = self.get_closed_candles(symbol, timeframe, limit)
+        tf_ms = self.cache.timeframe_ms(timeframe)
+        start = closed[-1][0] + tf_ms if closed else None
+        base_needed = tf_ms // self.cache.timeframe_ms(self.base_timeframe) + 1
+        base = self.cache.get_candles(symbol, self.base_timeframe, base_needed)
+        forming = aggregate_candles([c for c in base if start is None or c[0] >= start], tf_ms, self.offset_ms)
+        return (closed + forming[-1:])[-limit:]
+
+    def _derive(self, symbol, timeframe, limit):
+        """用基础周期K线补齐高周期已收盘K线，基础K线覆盖不到时交给缓存从交易所加载"""
+        closed = self.cache.cached_closed(symbol, timeframe)
+        if len(closed) < limit:
+            return
+
+        tf_ms = self.cache.timeframe_ms(timeframe)
+        base_ms = self.cache.timeframe_ms(self.base_timeframe)
+        start = closed[-1][0] + tf_ms
+        now_ms = self.cache.now_ms()
+        if start + tf_ms > now_ms:
+            return  # 下一根高周期K线尚未收盘
+
+        needed = min((now_ms - start) // base_ms + 1, self.cache.max_candles)
+        base = [c for c in self.cache.get_closed_candles(symbol, self.base_timeframe, needed) if c[0] >= start]
+
+        # 只合成从 start 起连续、且桶内基础K线齐全的时间桶；遇到缺K线的桶就停下，
+        # 等缺口补齐后再合成 (高周期K线一旦写入缓存和磁盘就不会再修正)
+        per_bucket = tf_ms // base_ms
+        counts = {}
+        for candle in base:
+            bucket = candle[0] - (candle[0] - self.offset_ms) % tf_ms
+            counts[bucket] = counts.get(bucket, 0) + 1
+        bars = []
+        for bar in aggregate_candles(base, tf_ms, self.offset_ms):
+            if bar[0] != start + len(bars) * tf_ms or counts[bar[0]] < per_bucket:
+                break
+            bars.append(bar)
+        if bars:
+            self.cache.extend_closed(symbol, timeframe, bars)
+            with self._lock:
+                self.derived_count += len(bars)
+
+
+def normalize_symbol(symbol):
+    """标准化交易对格式: BTC/USDT:USDT、BTC-USDT-SWAP、BTCUSDT -> BTC/USDT"""
+    if not symbol:
+        return ''
+    normalized = symbol.upper().split(':')[0].strip()
+    if normalized.endswith('-SWAP'):
+        normalized = normalized[:-len('-SWAP')]
+    if '/' in normalized:
+        return normalized
+    if '-' in normalized:
+        base, quote = normalized.split('-', 1)
+        return f"{base}/{quote}"
+    # Binance原始格式: BTCUSDT
+    for quote in ('USDT', 'USDC', 'BUSD', 'USD'):
+        if normalized.endswith(quote) and len(normalized) > len(quote):
+            return f"{normalized[:-len(quote)]}/{quote}"
+    return normalized
+
+
+class PositionSnapshot:
+    """账户持仓快照 - 一次拉取全部持仓，按标准化symbol索引，TTL内所有调用方共享"""
+
+    def __init__(self, fetch_positions, ttl=30, normalize=normalize_symbol):
+        self.fetch_positions = fetch_positions  # 拉取账户全部持仓的函数
+        self.ttl = ttl  # 快照有效期(秒)
+        self.normalize = normalize
+        self._positions = []
+        self._index = {}  # 标准化symbol -> [持仓, ...]
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self.fetch_count = 0  # 实际发出的持仓请求次数
+        self.invalidated_at = 0  # 最近一次失效时间 (本进程下单/平仓的时间)
+
+    def get(self, symbol):
+        """获取指定交易对的原始持仓列表"""
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._index.get(self.normalize(symbol), []))
+
+    def all(self):
+        """获取快照中的全部原始持仓"""
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._positions)
+
+    def invalidate(self):
+        """使快照失效 (下单/平仓后调用)，下次读取时重新拉取"""
+        with self._lock:
+            self._fetched_at = None
+            self.invalidated_at = time.time()
+
+    def set(self, positions):
+        """写入调用方自行拉取的全部持仓 (如异步请求的结果)"""
+        with self._lock:
+            self._store(positions or [])
+
+    def _ensure_fresh(self):
+        if self._fetched_at is not None and time.time() - self._fetched_at < self.ttl:
+            return
+
+        positions = self.fetch_positions() or []
+        self.fetch_count += 1
+        self._store(positions)
+
+    def _store(self, positions):
+        index = {}
+        for pos in positions:
+            key = self.normalize(pos.get('symbol'))
+            if not key:
+                continue
+            index.setdefault(key, []).append(pos)
+
+        self._positions = positions
+        self._index = index
+        self._fetched_at = time.time()
+
+
+class TickerCache:
+    """Ticker缓存 - TTL内重复读取直接返回缓存，多个币种合并为一次 fetch_tickers 请求"""
+
+    def __init__(self, exchange, ttl=2):
+        self.exchange = exchange
+        self.ttl = ttl  # 缓存有效期(秒)
+        self._tickers = {}  # symbol -> (获取时间, ticker)
+        self._lock = threading.Lock()
+        self.fetch_count = 0  # 实际发出的 ticker 请求次数
+
+    def get(self, symbol):
+        """获取单个交易对的 ticker"""
+        return self.get_many([symbol])[symbol]
+
+    def get_many(self, symbols):
+        """批量获取 ticker，过期的交易对合并为一次请求"""
+        symbols = list(dict.fromkeys(symbols))
+        with self._lock:
+            now = time.time()
+            stale = [s for s in symbols if s not in self._tickers or now - self._tickers[s][0] >= self.ttl]
+            if stale:
+                self._fetch(stale, now)
+            return {s: self._tickers[s][1] for s in symbols}
+
+    def invalidate(self):
+        with self._lock:
+            self._tickers.clear()
+
+    def _fetch(self, symbols, now):
+        fetched = {}
+        if len(symbols) > 1:
+            try:
+                fetched = self.exchange.fetch_tickers(symbols) or {}
+                self.fetch_count += 1
+            except Exception as e:
+                print(f"批量获取ticker失败，逐个获取: {e}")
+        for symbol in symbols:
+            ticker = fetched.get(symbol)
+            if ticker is None:
+                ticker = self.exchange.fetch_ticker(symbol)
+                self.fetch_count += 1
+            self._tickers[symbol] = (now, ticker)
+
+
+def amount_decimals(precision):
+    """数量精度 (步长，如0.01) 转换为小数位数"""
+    if not precision or precision >= 1:
+        return 0
+    return max(0, int(round(-math.log10(precision))))
+
+
+class SymbolRegistry:
+    """交易对注册表 - 从 load_markets() 一次性构建别名索引和下单参数表，O(1) 映射到标准交易对"""
+
+    def __init__(self, exchange, retry_interval=60, refresh_interval=3600):
+        self.exchange = exchange
+        self.retry_interval = retry_interval  # 加载失败后的重试间隔(秒)
+        self.refresh_interval = refresh_interval  # 后台刷新市场信息的间隔(秒)
+        self._aliases = {}  # 任意别名 -> 标准交易对 (BTC/USDT)
+        self._swap_markets = {}  # 标准交易对 -> 永续合约市场信息
+        self._spot_markets = {}  # 标准交易对 -> 现货市场信息
+        self._sizing = {}  # 标准交易对 -> 下单参数 (合约面值、精度、最小数量)
+        self._loaded = False
+        self._failed_at = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def ensure_loaded(self):
+        """首次使用时加载市场列表 (失败时退回到字符串标准化)"""
+        if self._loaded:
+            return True
+        with self._lock:
+            if self._loaded:
+                return True
+            if self._failed_at is not None and time.time() - self._failed_at < self.retry_interval:
+                return False
+            try:
+                self.build(self.exchange.load_markets())
+                return True
+            except Exception as e:
+                print(f"[SymbolRegistry] 加载市场列表失败: {e}")
+                self._failed_at = time.time()
+                return False
+
+    def build(self, markets):
+        """根据市场列表构建别名索引"""
+        aliases = {}
+        swap_markets = {}
+        spot_markets = {}
+
+        for market in markets.values():
+            base = market.get('base')
+            quote = market.get('quote')
+            if not base or not quote:
+                continue
+            canonical = f"{base}/{quote}"
+
+            if market.get('swap') and market.get('linear', True):
+                swap_markets[canonical] = market
+            elif market.get('spot'):
+                spot_markets[canonical] = market
+            else:
+                continue  # 交割合约/期权不参与映射
+
+            for alias in (
+                canonical,
+                market.get('symbol'),
+                market.get('id'),
+                f"{base}-{quote}",
+                f"{base}{quote}",
+                f"{base}-{quote}-SWAP",
+            ):
+                if alias:
+                    aliases[alias] = canonical
+                    aliases[alias.upper()] = canonical
+
+        sizing = {}
+        for canonical, market in swap_markets.items():
+            precision = (market.get('precision') or {}).get('amount') or 1
+            limits = (market.get('limits') or {}).get('amount') or {}
+            sizing[canonical] = {
+                'trade_symbol': market['symbol'],
+                'inst_id': market['id'],
+                'contract_size': market.get('contractSize') or 1,  # 每张合约的币数
+                'amount_precision': precision,  # 数量步长
+                'amount_decimals': amount_decimals(precision),  # 数量小数位数
+                'min_amount': limits.get('min') or 1,  # 最小下单张数
+            }
+
+        self._aliases = aliases
+        self._swap_markets = swap_markets
+        self._spot_markets = spot_markets
+        self._sizing = sizing
+        self._loaded = True
+
+    def refresh(self):
+        """重新加载市场信息"""
+        markets = self.exchange.load_markets(True)
+        with self._lock:
+            self.build(markets)
+
+    def start_auto_refresh(self):
+        """启动后台线程: 立即加载一次，之后按 refresh_interval 定期刷新"""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        def worker():
+            while True:
+                try:
+                    self.refresh()
+                    time.sleep(self.refresh_interval)
+                except Exception as e:
+                    print(f"[SymbolRegistry] 刷新市场信息失败: {e}")
+                    time.sleep(self.retry_interval)
+
+        self._refresh_thread = threading.Thread(target=worker, daemon=True)
+        self._refresh_thread.start()
+
+    def order_sizing(self, symbol):
+        """获取预先计算的下单参数表"""
+        self.ensure_loaded()
+        sizing = self._sizing.get(self.canonical(symbol))
+        if sizing is None:
+            raise ValueError(f"无法获取{symbol}的合约信息")
+        return sizing
+
+    def canonical(self, symbol):
+        """任意格式 (BTC/USDT:USDT、BTC-USDT-SWAP、BTCUSDT) -> 标准交易对 BTC/USDT"""
+        if not symbol:
+            return ''
+        self.ensure_loaded()
+        found = self._aliases.get(symbol) or self._aliases.get(symbol.upper())
+        return found or normalize_symbol(symbol)
+
+    def swap_market(self, symbol):
+        """获取永续合约市场信息"""
+        self.ensure_loaded()
+        return self._swap_markets.get(self.canonical(symbol))
+
+    def trade_symbol(self, symbol):
+        """下单使用的统一合约交易对 (OKX: BTC/USDT:USDT)"""
+        market = self.swap_market(symbol)
+        if market:
+            return market['symbol']
+        canonical = self.canonical(symbol)
+        quote = canonical.split('/')[-1]
+        return f"{canonical}:{quote}"
+
+    def inst_id(self, symbol):
+        """交易所原生合约ID (OKX: BTC-USDT-SWAP, Binance: BTCUSDT)"""
+        market = self.swap_market(symbol)
+        if market:
+            return market['id']
+        return f"{self.canonical(symbol).replace('/', '-')}-SWAP"
+
+
+class LeverageState:
+    """杠杆状态表 - 按 (symbol, posSide) 记录当前杠杆和保证金模式，只在杠杆变化时调用 set_leverage"""
+
+    def __init__(self, exchange, normalize=normalize_symbol, ttl=300):
+        self.exchange = exchange
+        self.normalize = normalize
+        # 记录有效期 (秒): 其他进程 (如 web_ui) 可能修改了杠杆，过期后重新设置一次；None 表示永不过期
+        self.ttl = ttl
+        self._state = {}  # (标准交易对, posSide) -> {'leverage': 10, 'margin_mode': 'isolated', 'updated': ...}
+        self._lock = threading.Lock()
+        self.set_count = 0  # 实际发出的 set_leverage 次数
+
+    def get(self, symbol, pos_side=None):
+        """获取本地记录的杠杆状态 (过期记录视为未知)"""
+        key = (self.normalize(symbol), pos_side)
+        with self._lock:
+            state = self._state.get(key)
+            if state and self.ttl is not None and time.monotonic() - state['updated'] > self.ttl:
+                del self._state[key]
+                return None
+            return state
+
+    def record(self, symbol, pos_side, leverage, margin_mode='isolated'):
+        """记录交易所当前的杠杆设置"""
+        with self._lock:
+            self._state[(self.normalize(symbol), pos_side)] = {
+                'leverage': float(leverage),
+                'margin_mode': margin_mode,
+                'updated': time.monotonic(),
+            }
+
+    def observe(self, symbol, info, margin_mode='isolated'):
+        """用持仓数据中交易所实际返回的杠杆 (OKX info['lever']) 刷新记录"""
+        if not info or not info.get('lever'):
+            return
+        try:
+            leverage = float(info['lever'])
+        except (ValueError, TypeError):
+            return
+        pos_side = info.get('posSide')
+        self.record(symbol, pos_side if pos_side in ('long', 'short') else None,
+                    leverage, info.get('mgnMode') or margin_mode)
+
+    def forget(self, symbol, pos_side=None):
+        """删除记录 (状态未知时调用，下次会重新设置)"""
+        with self._lock:
+            self._state.pop((self.normalize(symbol), pos_side), None)
+
+    def seed(self, trade_symbol, margin_mode='isolated', hedged=True):
+        """从交易所读取当前杠杆作为初始状态"""
+        params = {'mgnMode': margin_mode} if hedged else {}
+        result = self.exchange.fetch_leverage(trade_symbol, params)
+
+        if result.get('longLeverage') is not None or result.get('shortLeverage') is not None:
+            margin_mode = result.get('marginMode') or margin_mode
+            if hedged:
+                if result.get('longLeverage') is not None:
+                    self.record(trade_symbol, 'long', result['longLeverage'], margin_mode)
+                if result.get('shortLeverage') is not None:
+                    self.record(trade_symbol, 'short', result['shortLeverage'], margin_mode)
+            else:
+                self.record(trade_symbol, None, result.get('longLeverage') or result.get('shortLeverage'), margin_mode)
+            return
+
+        # 旧版ccxt直接返回OKX原始数据: {'data': [{'posSide': 'long', 'lever': '10', 'mgnMode': 'isolated'}]}
+        info = result.get('info', result)
+        for item in info.get('data', []) if isinstance(info, dict) else []:
+            pos_side = item.get('posSide')
+            if item.get('lever'):
+                self.record(trade_symbol, pos_side if pos_side in ('long', 'short') else None,
+                            item['lever'], item.get('mgnMode', margin_mode))
+
+    def ensure(self, trade_symbol, leverage, pos_side=None, margin_mode='isolated'):
+        """确保杠杆为指定值: 本地记录一致时跳过请求，返回是否实际调用了 set_leverage"""
+        current = self.get(trade_symbol, pos_side)
+        if current and current['leverage'] == float(leverage) and current['margin_mode'] == margin_mode:
+            return False
+
+        params = {'mgnMode': margin_mode, 'posSide': pos_side} if pos_side else {}
+        try:
+            if params:
+                self.exchange.set_leverage(leverage, trade_symbol, params=params)
+            else:
+                self.exchange.set_leverage(leverage, trade_symbol)
+        except Exception:
+            self.forget(trade_symbol, pos_side)
+            raise
+        finally:
+            self.set_count += 1
+
+        self.record(trade_symbol, pos_side, leverage, margin_mode)
+        return True
+
+
+class RateLimiter:
+    """令牌桶限速器 - 多个线程共享的交易所请求预算"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)  # 每秒补充的令牌数
+        self.burst = float(burst or rate)  # 令牌桶容量
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """取一个令牌成功返回 0，预算不足时返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """取一个令牌，预算不足时阻塞等待"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """acquire 的异步版本 - 与同步请求共用同一个令牌桶，等待时不阻塞事件循环"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class RateLimitedExchange:
+    """交易所代理 - 每个REST请求先从共享的 RateLimiter 取令牌，其余属性原样转发"""
+
+    REQUEST_PREFIXES = (
+        'fetch', 'create', 'cancel', 'edit', 'private', 'public',
+        'set_leverage', 'setLeverage', 'load_markets', 'loadMarkets',
+    )
+
+    def __init__(self, exchange, limiter):
+        self._exchange = exchange
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if not callable(attr) or not name.startswith(self.REQUEST_PREFIXES):
+            return attr
+
+        def limited(*args, **kwargs):
+            self._limiter.acquire()
+            return attr(*args, **kwargs)
+
+        return limited
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+共享内存行情快照 - 固定布局的内存映射文件，一个进程写入，其他进程无锁读取
+
+每个币种一个槽位: 最新价、标记价格、最近K线、多空持仓字段。
+写入方用序号 (seqlock) 标记写入过程: 写入前序号变为奇数，写完变为偶数；
+读取方读到奇数或前后序号不一致时重读，保证拿到的是完整的一次写入。
+"""
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from market_data import normalize_symbol
+
+DEFAULT_SNAPSHOT_PATH = os.getenv('MARKET_SNAPSHOT_PATH',
+                                  os.path.join(tempfile.gettempdir(), 'dsai_market_snapshot.bin'))
+
+MAGIC = b'DSMS'
+VERSION = 2
+NAME_SIZE = 32
+
+HEADER = struct.Struct('<4sIII')  # magic, version, 槽位数, 每槽K线数
+SLOT_HEADER = struct.Struct('<QdddddI4x')  # seq, 更新时间, K线更新时间, 持仓更新时间, 最新价, 标记价格, K线数
+POSITION_FIELDS = ('size', 'entry_price', 'unrealized_pnl', 'leverage', 'margin',
+                   'liquidation_price', 'margin_ratio', 'notional')
+POSITION = struct.Struct('<' + 'd' * len(POSITION_FIELDS))
+POSITION_SIDES = ('long', 'short')
+CANDLE = struct.Struct('<dddddd')
+
+NAN = float('nan')
+
+
+def _slot_size(candles):
+    return SLOT_HEADER.size + POSITION.size * len(POSITION_SIDES) + CANDLE.size * candles
+
+
+def _layout_size(slot_count, candles):
+    return HEADER.size + NAME_SIZE * slot_count + _slot_size(candles) * slot_count
+
+
+class SnapshotWriter:
+    """快照写入方 (每个快照文件只能有一个写入进程)"""
+
+    def __init__(self, symbols, path=DEFAULT_SNAPSHOT_PATH, candles=10):
+        self.path = path
+        self.candles = candles
+        self.symbols = [normalize_symbol(s) for s in symbols]
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        self._state = {s: {'last': NAN, 'mark': NAN, 'candles': [], 'candles_updated': 0.0,
+                           'positions': {}, 'positions_updated': 0.0}
+                       for s in self.symbols}
+        self._seq = [0] * len(self.symbols)
+        self._lock = threading.Lock()
+        self._mm = self._create()
+
+    def _create(self):
+        size = _layout_size(len(self.symbols), self.candles)
+        # 先写临时文件再替换，读取方不会看到写了一半的文件头
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * size)
+        with open(tmp_path, 'r+b') as f:
+            mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, len(self.symbols), self.candles)
+        for i, symbol in enumerate(self.symbols):
+            mm[HEADER.size + i * NAME_SIZE:HEADER.size + (i + 1) * NAME_SIZE] = \
+                symbol.encode('utf-8')[:NAME_SIZE].ljust(NAME_SIZE, b'\0')
+        mm.flush()
+        os.replace(tmp_path, self.path)
+        return mm
+
+    def _slot_offset(self, i):
+        return HEADER.size + NAME_SIZE * len(self.symbols) + _slot_size(self.candles) * i
+
+    def update(self, symbol, last=None, mark=None, candles=None, positions=None):
+        """
+        更新币种槽位 (只更新传入的字段)
+
+        candles: [[timestamp, open, high, low, close, volume], ...]，保留最近的几根
+        positions: {'long': {...}, 'short': {...}}，传入后替换全部持仓字段，无持仓的方向清零
+        """
+        key = normalize_symbol(symbol)
+        if key not in self._index:
+            return
+        with self._lock:
+            state = self._state[key]
+            if last is not None:
+                state['last'] = float(last)
+            if mark is not None:
+                state['mark'] = float(mark)
+            if candles is not None:
+                state['candles'] = [list(c[:6]) for c in candles[-self.candles:]]
+                state['candles_updated'] = time.time()
+            if positions is not None:
+                state['positions'] = positions
+                state['positions_updated'] = time.time()
+            self._write(self._index[key], state)
+
+    def _write(self, i, state):
+        offset = self._slot_offset(i)
+        seq = self._seq[i] + 1
+        # 序号为奇数期间读取方会重试
+        struct.pack_into('<Q', self._mm, offset, seq)
+
+        # 槽位内容先在本地拼好，再一次性拷贝到共享内存 (不含开头的序号)
+        body = bytearray(_slot_size(self.candles))
+        SLOT_HEADER.pack_into(body, 0, seq + 1, time.time(), state['candles_updated'], state['positions_updated'],
+                              state['last'], state['mark'], len(state['candles']))
+        pos_offset = SLOT_HEADER.size
+        for side in POSITION_SIDES:
+            fields = state['positions'].get(side) or {}
+            POSITION.pack_into(body, pos_offset, *(float(fields.get(name) or 0) for name in POSITION_FIELDS))
+            pos_offset += POSITION.size
+        for candle in state['candles']:
+            CANDLE.pack_into(body, pos_offset, *(float(v) for v in candle))
+            pos_offset += CANDLE.size
+
+        self._mm[offset + 8:offset + len(body)] = body[8:]
+        struct.pack_into('<Q', self._mm, offset, seq + 1)
+        self._seq[i] = seq + 1
+
+    def close(self):
+        self._mm.close()
+
+
+class SnapshotReader:
+    """快照读取方 - 无锁读取，写入方重建文件后自动重新映射"""
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, retries=100):
+        self.path = path
+        self.retries = retries
+        self._mm = None
+        self._inode = None
+        self._index = {}
+        self._candles = 0
+        self._slot_base = 0
+        self._lock = threading.Lock()
+
+    def read(self, symbol, max_age=None):
+        """读取币种快照，没有数据或超过 max_age 秒未更新时返回 None"""
+        with self._lock:
+            if not self._ensure_mapped():
+                return None
+            i = self._index.get(normalize_symbol(symbol))
+            if i is None:
+                return None
+            raw = self._read_slot(i)
+        if raw is None:
+            return None
+        snapshot = self._parse(normalize_symbol(symbol), raw)
+        if snapshot['updated'] == 0:
+            return None
+        if max_age is not None and time.time() - snapshot['updated'] > max_age:
+            return None
+        return snapshot
+
+    def last_price(self, symbol, max_age=None):
+        """最新价 (没有或已过期返回None)"""
+        snapshot = self.read(symbol, max_age)
+        if snapshot is None or math.isnan(snapshot['last']):
+            return None
+        return snapshot['last']
+
+    def _ensure_mapped(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            self._close()
+            return False
+        if self._mm is not None and inode == self._inode:
+            return True
+
+        self._close()
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                return False
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        magic, version, slot_count, candles = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or size < _layout_size(slot_count, candles):
+            mm.close()
+            return False
+
+        names = {}
+        for i in range(slot_count):
+            start = HEADER.size + i * NAME_SIZE
+            names[mm[start:start + NAME_SIZE].rstrip(b'\0').decode('utf-8')] = i
+        self._mm = mm
+        self._inode = inode
+        self._index = names
+        self._candles = candles
+        self._slot_base = HEADER.size + NAME_SIZE * slot_count
+        return True
+
+    def _read_slot(self, i):
+        size = _slot_size(self._candles)
+        offset = self._slot_base + size * i
+        for _ in range(self.retries):
+            seq_before = struct.unpack_from('<Q', self._mm, offset)[0]
+            if seq_before % 2:
+                continue
+            raw = self._mm[offset:offset + size]
+            seq_after = struct.unpack_from('<Q', self._mm, offset)[0]
+            if seq_before == seq_after:
+                return raw
+        return None
+
+    def _parse(self, symbol, raw):
+        _, updated, candles_updated, positions_updated, last, mark, count = SLOT_HEADER.unpack_from(raw, 0)
+        offset = SLOT_HEADER.size
+        positions = {}
+        for side in POSITION_SIDES:
+            values = dict(zip(POSITION_FIELDS, POSITION.unpack_from(raw, offset)))
+            offset += POSITION.size
+            if values['size'] > 0:
+                positions[side] = values
+        candles = []
+        for _ in range(min(count, self._candles)):
+            candle = list(CANDLE.unpack_from(raw, offset))
+            candle[0] = int(candle[0])
+            candles.append(candle)
+            offset += CANDLE.size
+        return {
+            'symbol': symbol,
+            'updated': updated,  # 任一字段最近一次写入的时间
+            'candles_updated': candles_updated,  # 0 表示还没有写入过K线
+            'positions_updated': positions_updated,  # 0 表示还没有写入过持仓
+            'last': last,
+            'mark': mark,
+            'candles': candles,
+            'positions': positions,
+        }
+
+    def _close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = None
+        self._inode = None
+        self._index = {}
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 行情推送 - 订阅K线和Ticker频道，实时更新K线缓存并发出K线收盘事件
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import aiohttp
+
+
+def okx_bar(timeframe):
+    """ccxt 周期格式转 OKX 频道格式: 3m -> 3m, 4h -> 4H, 1d -> 1D"""
+    if timeframe[-1] in 'hdw':
+        return timeframe[:-1] + timeframe[-1].upper()
+    return timeframe
+
+
+class OKXStreamProtocol:
+    """OKX v5 公共频道: K线在 business 端点，Ticker 在 public 端点"""
+
+    CANDLE_URL = 'wss://ws.okx.com:8443/ws/v5/business'
+    TICKER_URL = 'wss://ws.okx.com:8443/ws/v5/public'
+    ping_message = 'ping'  # OKX 30秒内无消息会断开，需要应用层心跳
+
+    def __init__(self, candle_url=None, ticker_url=None):
+        self.candle_url = candle_url or self.CANDLE_URL
+        self.ticker_url = ticker_url or self.TICKER_URL
+
+    def connections(self, instruments, timeframe):
+        """返回 [(url, [订阅消息, ...]), ...]"""
+        channel = f"candle{okx_bar(timeframe)}"
+        candle_args = [{'channel': channel, 'instId': inst_id} for inst_id in instruments]
+        ticker_args = [{'channel': 'tickers', 'instId': inst_id} for inst_id in instruments]
+        return [
+            (self.candle_url, [json.dumps({'op': 'subscribe', 'args': candle_args})]),
+            (self.ticker_url, [json.dumps({'op': 'subscribe', 'args': ticker_args})]),
+        ]
+
+    def parse(self, message):
+        """解析推送消息，返回 [('candle', inst_id, candle, closed) | ('ticker', inst_id, ticker), ...]"""
+        if message == 'pong':
+            return []
+        data = json.loads(message)
+        arg = data.get('arg') or {}
+        channel = arg.get('channel', '')
+        inst_id = arg.get('instId')
+        events = []
+        for item in data.get('data') or []:
+            if channel.startswith('candle'):
+                candle = [int(item[0])] + [float(v) for v in item[1:6]]
+                events.append(('candle', inst_id, candle, item[8] == '1'))
+            elif channel == 'tickers':
+                events.append(('ticker', inst_id, {'last': float(item['last']), 'timestamp': int(item['ts'])}))
+        return events
+
+
+class BinanceStreamProtocol:
+    """Binance U本位合约组合流: <symbol>@kline_<interval> 和 <symbol>@ticker"""
+
+    URL = 'wss://fstream.binance.com/stream'
+    ping_message = None  # 服务端 ping 由 aiohttp 自动回复
+
+    def __init__(self, url=None):
+        self.url = url or self.URL
+
+    def connections(self, instruments, timeframe):
+        streams = []
+        for inst_id in instruments:
+            streams += [f"{inst_id.lower()}@kline_{timeframe}", f"{inst_id.lower()}@ticker"]
+        return [(self.url, [json.dumps({'method': 'SUBSCRIBE', 'params': streams, 'id': 1})])]
+
+    def parse(self, message):
+        data = json.loads(message)
+        data = data.get('data', data)
+        event = data.get('e')
+        if event == 'kline':
+            k = data['k']
+            candle = [int(k['t']), float(k['o']), float(k['h']), float(k['l']), float(k['c']), float(k['v'])]
+            return [('candle', data['s'], candle, bool(k['x']))]
+        if event == '24hrTicker':
+            return [('ticker', data['s'], {'last': float(data['c']), 'timestamp': int(data['E'])})]
+        return []
+
+
+class MarketStream:
+    """
+    行情推送客户端 - 在后台线程运行 asyncio 事件循环
+
+    instruments: {交易所合约ID: 缓存中使用的symbol}
+    K线推送写入 CandleCache；K线收盘时放入 closed_events 队列并调用 on_candle_closed。
+    Ticker推送保存在 tickers 中并调用 on_ticker。
+    断线后按指数退避自动重连。
+    """
+
+    def __init__(self, cache, instruments, timeframe, protocol, on_candle_closed=None, on_ticker=None, proxy=None,
+                 heartbeat_interval=20, reconnect_delay=1, max_reconnect_delay=30):
+        self.cache = cache
+        self.instruments = dict(instruments)
+        self.timeframe = timeframe
+        self.protocol = protocol
+        self.on_candle_closed = on_candle_closed
+        self.on_ticker = on_ticker
+        self.proxy = proxy  # HTTP代理地址 (可选)
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.closed_events = queue.Queue()  # (symbol, timeframe, candle)
+        self.tickers = {}  # symbol -> {'last', 'timestamp', 'received'}
+        self.connected = threading.Event()
+        self.message_count = 0
+        self.last_message = 0  # 最近一次收到消息的时间
+        self._loop = None
+        self._thread = None
+        self._stopping = False
+        self._open_connections = 0
+
+    def start(self):
+        """启动后台线程"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='market-stream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """停止推送并等待后台线程退出"""
+        self._stopping = True
+        if self._loop and self._thread and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._cancel_all)
+            self._thread.join(timeout)
+        self.connected.clear()
+
+    def healthy(self, max_silence=60):
+        """连接正常且近期收到过消息"""
+        return self.connected.is_set() and time.time() - self.last_message < max_silence
+
+    def latest_price(self, symbol, max_age=None):
+        """推送的最新成交价 (没有或已过期返回None)"""
+        ticker = self.tickers.get(symbol)
+        if not ticker:
+            return None
+        if max_age is not None and time.time() - ticker['received'] > max_age:
+            return None
+        return ticker['last']
+
+    def wait_for_closed(self, timeout=None):
+        """阻塞等待K线收盘事件，之后收集同一时刻其他币种的收盘事件，返回去重后的symbol列表"""
+        try:
+            symbols = [self.closed_events.get(timeout=timeout)[0]]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + 0.5
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                symbols.append(self.closed_events.get(timeout=remaining)[0])
+            except queue.Empty:
+                break
+        return list(dict.fromkeys(symbols))
+
+    def _cancel_all(self):
+        for task in asyncio.all_tasks(self._loop):
+            task.cancel()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        connections = self.protocol.connections(list(self.instruments), self.timeframe)
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(self._connection(session, url, subscriptions)
+                                   for url, subscriptions in connections))
+
+    async def _connection(self, session, url, subscriptions):
+        """维持单个连接: 订阅、读取、断线重连"""
+        delay = self.reconnect_delay
+        while not self._stopping:
+            try:
+                async with session.ws_connect(url, proxy=self.proxy) as ws:
+                    for message in subscriptions:
+                        await ws.send_str(message)
+                    self._open_connections += 1
+                    self.connected.set()
+                    delay = self.reconnect_delay
+                    try:
+                        await self._read(ws)
+                    finally:
+                        self._open_connections -= 1
+                        if self._open_connections == 0:
+                            self.connected.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"行情推送连接异常 {url}: {e}")
+
+            if self._stopping:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _read(self, ws):
+        ping_message = self.protocol.ping_message
+        while True:
+            try:
+                msg = await ws.receive(timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                if ping_message:
+                    await ws.send_str(ping_message)
+                continue
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self.message_count += 1
+                self.last_message = time.time()
+                try:
+                    self._dispatch(self.protocol.parse(msg.data))
+                except Exception as e:
+                    print(f"行情推送消息处理失败: {e}")
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                return
+
+    def _dispatch(self, events):
+        for event in events:
+            symbol = self.instruments.get(event[1])
+            if symbol is None:
+                continue
+            if event[0] == 'candle':
+                _, _, candle, closed = event
+                self.cache.push_candle(symbol, self.timeframe, candle, closed)
+                if closed:
+                    self.closed_events.put((symbol, self.timeframe, candle))
+                    if self.on_candle_closed:
+                        self.on_candle_closed(symbol, self.timeframe, candle)
+            elif event[0] == 'ticker':
+                self.tickers[symbol] = dict(event[2], received=time.time())
+                if self.on_ticker:
+                    self.on_ticker(symbol, event[2])
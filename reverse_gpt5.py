@@ -59,6 +59,17 @@ else:
         'enableRateLimit': True,
     })
 
+# 行情代理进程在运行时，K线和Ticker从代理读取 (与其他策略共享，不重复请求交易所)
+from market_broker import connect_broker
+from market_data import TickerCache
+from signal_cache import SignalCache
+exchange = connect_broker(exchange)
+
+# 主策略进程写入的共享内存行情快照 (价格检查优先读本地内存)
+from market_snapshot import SnapshotReader
+snapshot_reader = SnapshotReader()
+
+
 # 反向跟单配置
 REVERSE_CONFIG = {
     'symbols': ['BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'DOGE/USDT', 'XRP/USDT', 'BNB/USDT'],
@@ -69,6 +80,8 @@ REVERSE_CONFIG = {
     'test_mode': True,  # 🧪 模拟盘模式（安全测试）
     'auto_trade': True,  # 自动交易
     'initial_balance': 10000,  # 模拟初始资金 10000 USDT
+    'signal_cache_ttl': 1800,  # 行情状态 (价格档位、1小时K线、持仓方向) 不变时复用AI信号的有效期(秒)
+    'signal_cache_price_step': 0.5,  # 价格分档间隔(%)
 }
 
 # 全局持仓记录
@@ -77,12 +90,32 @@ gpt5_last_signals = {}  # 记录 GPT-5 的最后信号
 simulated_balance = REVERSE_CONFIG['initial_balance']  # 模拟账户余额
 trade_history = []  # 交易历史记录
 
+# 本轮行情快照: 所有币种的ticker合并为一次 fetch_tickers 请求，本轮内各函数共用
+ticker_cache = TickerCache(exchange, ttl=60)
+
+# AI信号缓存: 行情状态指纹相同时不再请求大模型
+signal_cache = SignalCache(REVERSE_CONFIG['signal_cache_ttl'], REVERSE_CONFIG['signal_cache_price_step'])
+
+
+def get_ticker(symbol):
+    """本轮的ticker (过期后所有币种一起刷新)"""
+    symbols = REVERSE_CONFIG['symbols'] if symbol in REVERSE_CONFIG['symbols'] else [symbol]
+    return ticker_cache.get_many(symbols)[symbol]
+
+
+def get_current_price(symbol):
+    """当前价格 - 优先读取共享内存快照，快照过期时使用本轮ticker"""
+    price = snapshot_reader.last_price(symbol, max_age=10)
+    if price is not None:
+        return price
+    return get_ticker(symbol)['last']
+
 
 def get_gpt5_trading_signal(symbol):
     """获取 GPT-5 的交易信号"""
     try:
         # 获取市场数据
-        ticker = exchange.fetch_ticker(symbol)
+        ticker = get_ticker(symbol)
         current_price = ticker['last']
 
         # 获取最近的K线数据
@@ -90,6 +123,17 @@ def get_gpt5_trading_signal(symbol):
         df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
 
+        # 价格档位、持仓方向和当前1小时K线都没变时，复用上次的信号
+        fingerprint = signal_cache.fingerprint(
+            current_price,
+            position_side=positions.get(symbol, {}).get('side'),
+            candle_id=ohlcv[-1][0]
+        )
+        cached = signal_cache.get(symbol, fingerprint)
+        if cached:
+            print(f"   ♻️  行情状态未变化，复用缓存信号")
+            return cached
+
         # 构建给 GPT-5 的提示词
         market_summary = f"""
 当前市场数据 ({symbol}):
@@ -120,15 +164,17 @@ def get_gpt5_trading_signal(symbol):
         # 尝试解析 JSON
         try:
             signal = json.loads(result)
-            return signal
         except:
             # 如果无法解析 JSON，尝试从文本中提取
             if 'LONG' in result.upper():
-                return {"action": "LONG", "confidence": 0.7, "reason": result}
+                signal = {"action": "LONG", "confidence": 0.7, "reason": result}
             elif 'SHORT' in result.upper():
-                return {"action": "SHORT", "confidence": 0.7, "reason": result}
+                signal = {"action": "SHORT", "confidence": 0.7, "reason": result}
             else:
-                return {"action": "HOLD", "confidence": 0.5, "reason": result}
+                signal = {"action": "HOLD", "confidence": 0.5, "reason": result}
+
+        signal_cache.put(symbol, fingerprint, signal)
+        return signal
 
     except Exception as e:
         print(f"❌ 获取 GPT-5 信号失败: {e}")
@@ -157,8 +203,7 @@ def execute_reverse_trade(symbol, reverse_action):
             return
 
         # 获取当前价格
-        ticker = exchange.fetch_ticker(symbol)
-        current_price = ticker['last']
+        current_price = get_current_price(symbol)
 
         # 计算交易数量
         amount = REVERSE_CONFIG['amount_usd'] / current_price
@@ -212,8 +257,7 @@ def close_position(symbol):
             return
 
         pos = positions[symbol]
-        ticker = exchange.fetch_ticker(symbol)
-        current_price = ticker['last']
+        current_price = get_current_price(symbol)
 
         # 计算盈亏
         if pos['side'] == 'LONG':
@@ -257,8 +301,7 @@ def check_stop_loss_take_profit():
     """检查止损止盈"""
     for symbol, pos in list(positions.items()):
         try:
-            ticker = exchange.fetch_ticker(symbol)
-            current_price = ticker['last']
+            current_price = get_current_price(symbol)
 
             # 检查止损
             if pos['side'] == 'LONG' and current_price <= pos['stop_loss']:
@@ -291,6 +334,9 @@ def run_reverse_strategy():
     print(f"📊 总交易次数: {len(trade_history)}")
     print("=" * 60)
 
+    # 每轮开始时一次性刷新所有币种的ticker
+    ticker_cache.invalidate()
+
     # 检查止损止盈
     check_stop_loss_take_profit()
 
@@ -336,8 +382,7 @@ def run_reverse_strategy():
         print(f"\n持仓详情:")
         total_unrealized_pnl = 0
         for symbol, pos in positions.items():
-            ticker = exchange.fetch_ticker(symbol)
-            current_price = ticker['last']
+            current_price = get_current_price(symbol)
             if pos['side'] == 'LONG':
                 price_change = (current_price - pos['entry_price']) / pos['entry_price']
             else:
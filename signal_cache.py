@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+AI信号缓存 - 以量化后的行情状态指纹为键，行情基本没变时复用上次的AI信号，不再请求大模型
+
+指纹由价格档位、趋势状态、持仓方向和K线标识组成；指纹相同且未过期时直接返回缓存的信号。
+"""
+import copy
+import math
+import threading
+import time
+
+
+def price_bucket(price, step_pct):
+    """价格按 step_pct% 的对数间隔分档，同一档内的价格视为相同"""
+    if not price or price <= 0:
+        return None
+    return math.floor(math.log(price) / math.log1p(step_pct / 100))
+
+
+def market_fingerprint(price, step_pct, trends=(), position_side=None, candle_id=None):
+    """行情状态指纹: (价格档位, 趋势状态, 持仓方向, K线标识)"""
+    return (price_bucket(price, step_pct), tuple(trends), position_side, candle_id)
+
+
+class SignalCache:
+    """按币种缓存最近一次AI信号，指纹变化或超过 ttl 秒后失效"""
+
+    def __init__(self, ttl=600, price_step_pct=0.2):
+        self.ttl = ttl  # 缓存有效期(秒)
+        self.price_step_pct = price_step_pct  # 价格分档间隔(%)
+        self._entries = {}  # symbol -> (指纹, 信号, 写入时间)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, price, trends=(), position_side=None, candle_id=None):
+        return market_fingerprint(price, self.price_step_pct, trends, position_side, candle_id)
+
+    def get(self, symbol, fingerprint):
+        """指纹相同且未过期时返回缓存信号的副本，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry and entry[0] == fingerprint and time.time() - entry[2] < self.ttl:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, symbol, fingerprint, signal):
+        with self._lock:
+            self._entries[symbol] = (fingerprint, copy.deepcopy(signal), time.time())
+
+    def invalidate(self, symbol=None):
+        """清除指定币种 (或全部) 的缓存，例如下单后持仓变化"""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+测试AI请求调度 (模拟大模型请求，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_dispatch import AIDispatcher, AIDeadlineExceeded
+
+
+class SlowModel:
+    """模拟大模型接口 - 记录同时进行的请求数"""
+
+    def __init__(self, delays):
+        self.delays = delays  # symbol -> 响应耗时(秒)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create(self, symbol, timeout=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delays[symbol])
+            return f"{symbol}:ok"
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_concurrent_with_cap():
+    """各币种的请求并发执行，同时进行的请求数不超过上限"""
+    model = SlowModel({f"S{i}": 0.2 for i in range(6)})
+    dispatcher = AIDispatcher(max_concurrency=3, timeout=5)
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda s: dispatcher.call(model.create, s, timeout=5), model.delays))
+    elapsed = time.time() - started
+    assert results == [f"S{i}:ok" for i in range(6)]
+    assert model.max_in_flight == 3
+    assert 0.35 < elapsed < 1.0
+    assert dispatcher.stats()['completed'] == 6
+
+
+def test_late_response_dropped():
+    """超过截止时间的请求不再等待，其他币种不受影响"""
+    model = SlowModel({'FAST': 0.05, 'SLOW': 1.0})
+    dispatcher = AIDispatcher(max_concurrency=2, timeout=0.3)
+    started = time.time()
+    try:
+        dispatcher.call(model.create, 'SLOW', label='SLOW')
+        assert False, '应当超时'
+    except AIDeadlineExceeded as e:
+        assert 'SLOW' in str(e)
+    assert time.time() - started < 0.5
+    assert dispatcher.call(model.create, 'FAST') == 'FAST:ok'
+    assert dispatcher.stats()['dropped'] == 1
+
+
+def test_queued_request_counts_against_deadline():
+    """排队时间计入截止时间，排队中超时的请求被取消不再发出"""
+    model = SlowModel({'A': 0.5, 'B': 0.5})
+    calls = []
+    dispatcher = AIDispatcher(max_concurrency=1, timeout=0.2)
+
+    def create(symbol):
+        calls.append(symbol)
+        return model.create(symbol)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(dispatcher.call, create, 'A')
+        time.sleep(0.01)
+        second = pool.submit(dispatcher.call, create, 'B')
+        for future in (first, second):
+            try:
+                future.result()
+            except AIDeadlineExceeded:
+                pass
+    time.sleep(0.6)
+    assert calls == ['A']
+    assert dispatcher.stats()['dropped'] == 2
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_concurrent_with_cap,
+        test_late_response_dropped,
+        test_queued_request_counts_against_deadline,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试AI调用预筛 (行情平静时跳过，状态明显变化或超过最长间隔时放行)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ai_gate import AIGate
+
+
+def quiet_state(**changes):
+    state = {'price': 100000, 'trends': ('bullish', 'neutral'), 'position_side': None,
+             'price_change': 0.05, 'volume_ratio': 1.1}
+    state.update(changes)
+    return state
+
+
+def test_first_call_then_quiet_skipped():
+    """首次放行，分析后行情无变化时跳过"""
+    gate = AIGate(max_staleness=900, price_move_pct=0.5, bar_move_pct=0.3, volume_ratio=2.0)
+    assert gate.should_analyze('BTC/USDT', quiet_state()) == (True, '首次分析')
+    gate.mark_analyzed('BTC/USDT', quiet_state())
+
+    for price in (100100, 99800, 100300):
+        run, _ = gate.should_analyze('BTC/USDT', quiet_state(price=price))
+        assert not run
+    stats = gate.stats()
+    assert stats['analyzed'] == 1 and stats['skipped'] == 3
+    assert stats['skip_rate'] == 0.75 and stats['triggers'] == {'首次分析': 1}
+
+
+def test_material_changes_trigger_analysis():
+    """趋势、持仓、累计价格变动、单根K线波动、放量都会放行"""
+    gate = AIGate(max_staleness=900, price_move_pct=0.5, bar_move_pct=0.3, volume_ratio=2.0)
+    gate.mark_analyzed('ETH/USDT', quiet_state())
+    cases = [
+        (quiet_state(trends=('bearish', 'neutral')), '趋势变化'),
+        (quiet_state(position_side='long'), '持仓变化'),
+        (quiet_state(price=100600), '价格变动'),
+        (quiet_state(price_change=-0.4), 'K线大幅波动'),
+        (quiet_state(volume_ratio=2.5), '成交量放大'),
+    ]
+    for state, reason in cases:
+        assert gate.should_analyze('ETH/USDT', state) == (True, reason)
+    assert gate.stats()['skipped'] == 0
+
+
+def test_max_staleness():
+    """超过最长间隔时即使行情平静也重新分析"""
+    gate = AIGate(max_staleness=900)
+    gate.mark_analyzed('SOL/USDT', quiet_state())
+    assert not gate.should_analyze('SOL/USDT', quiet_state())[0]
+    state, analyzed_at = gate._last['SOL/USDT']
+    gate._last['SOL/USDT'] = (state, analyzed_at - 901)
+    assert gate.should_analyze('SOL/USDT', quiet_state()) == (True, '超过最长间隔')
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_first_call_then_quiet_skipped,
+        test_material_changes_trigger_analysis,
+        test_max_staleness,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
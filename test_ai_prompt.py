@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试AI提示词构建 (静态前缀) 和回复解析 (单币种信号和批量模式的多币种信号数组)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from types import SimpleNamespace
+
+from ai_prompt import (
+    build_system_prompt, build_user_prompt, parse_signal, parse_batch_signals, PromptCacheStats, normalize_signal
+)
+
+
+def make_context(symbol, price):
+    return {
+        'performance_text': f"- {symbol}历史交易表现：3次交易，胜率66.7%",
+        'sharpe_analysis': '数据不足，无法计算夏普指数',
+        'trend_text': '📊 实时趋势监控:\n   15分钟趋势: bullish (均线多头)',
+        'kline_text': 'K线1: 阳线 开盘:1.00 收盘:2.00 涨跌:+100.00%\n',
+        'indicator_text': '【技术指标】\n5周期均价: 1.50',
+        'signal_text': '',
+        'market_text': f"【当前行情】\n- 当前价格: ${price:,.2f}",
+    }
+
+
+def test_static_system_prompt_first():
+    """系统提示词不含任何币种数据，逐字节不变；单币种和批量模式共用前缀"""
+    single = build_system_prompt('3m')
+    assert single == build_system_prompt('3m') and single is build_system_prompt('3m')
+    assert 'BTC/USDT' not in single and '"signal": "BUY|SELL|HOLD"' in single
+    batch = build_system_prompt('3m', batch=True)
+    prefix = single[:single.index('请用以下JSON格式回复')]
+    assert batch.startswith(prefix) and len(prefix) > 0.8 * len(single)
+
+    # 本轮数据只出现在用户消息中
+    user = build_user_prompt({'BTC/USDT': make_context('BTC/USDT', 105000)})
+    assert 'BTC/USDT' in user and '$105,000.00' in user
+    user = build_user_prompt({s: make_context(s, p) for s, p in (('BTC/USDT', 105000), ('ETH/USDT', 3800))})
+    assert '2 个币种' in user and user.index('BTC/USDT') < user.index('ETH/USDT')
+
+
+def test_cached_token_stats():
+    """读取 DeepSeek 和 OpenAI 两种 usage 格式的缓存命中token"""
+    stats = PromptCacheStats()
+    deepseek = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=1200, prompt_cache_hit_tokens=1024,
+                                                     prompt_cache_miss_tokens=176))
+    openai = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=800,
+                                                   prompt_tokens_details=SimpleNamespace(cached_tokens=512)))
+    assert stats.record(deepseek) == (1200, 1024)
+    assert stats.record(openai) == (800, 512)
+    assert stats.record(SimpleNamespace(usage=None)) == (0, 0)
+    result = stats.stats()
+    assert result['requests'] == 3 and result['cached_tokens'] == 1536
+    assert result['hit_rate'] == 1536 / 2000
+
+
+def test_parse_single_signal():
+    """从回复文本中提取单个 JSON 信号"""
+    text = '分析如下:\n{"signal": "BUY", "reason": "突破", "stop_loss": 100, "take_profit": 120, "confidence": "HIGH"}\n完毕'
+    signal = parse_signal(text)
+    assert signal['signal'] == 'BUY' and signal['stop_loss'] == 100
+    assert parse_signal('没有JSON') is None
+    assert parse_signal('{"signal": BUY}') is None
+
+
+def test_parse_batch_signals():
+    """批量回复按币种拆分，忽略未请求的币种、非法信号和重复条目"""
+    text = """```json
+[
+    {"symbol": "BTC/USDT", "signal": "buy", "reason": "a", "stop_loss": 1, "take_profit": 2, "confidence": "HIGH"},
+    {"symbol": "eth/usdt", "signal": "HOLD", "reason": "b", "stop_loss": 1, "take_profit": 2, "confidence": "LOW"},
+    {"symbol": "ETH/USDT", "signal": "SELL", "reason": "重复", "confidence": "LOW"},
+    {"symbol": "SOL/USDT", "signal": "MAYBE", "reason": "c"},
+    {"symbol": "PEPE/USDT", "signal": "BUY", "reason": "未请求"},
+    "garbage"
+]
+```"""
+    signals = parse_batch_signals(text, ['BTC/USDT', 'ETH/USDT', 'SOL/USDT'])
+    assert sorted(signals) == ['BTC/USDT', 'ETH/USDT']
+    assert signals['BTC/USDT']['signal'] == 'BUY'
+    assert signals['ETH/USDT']['symbol'] == 'ETH/USDT' and signals['ETH/USDT']['reason'] == 'b'
+
+
+def test_missing_fields_defaulted():
+    """缺少信心程度、理由或止损止盈的条目补全默认值，不会在执行交易时因缺字段被丢弃"""
+    text = """[
+    {"symbol": "BTC/USDT", "signal": "SELL"},
+    {"symbol": "ETH/USDT", "signal": "BUY", "confidence": "very high", "reason": null,
+     "stop_loss": "95.5", "take_profit": "高位"}
+]"""
+    signals = parse_batch_signals(text, ['BTC/USDT', 'ETH/USDT'])
+    assert sorted(signals) == ['BTC/USDT', 'ETH/USDT']
+    btc, eth = signals['BTC/USDT'], signals['ETH/USDT']
+    assert btc['confidence'] == 'LOW' and btc['reason'] == ''
+    assert btc['stop_loss'] == 0 and btc['take_profit'] == 0
+    assert eth['confidence'] == 'LOW' and eth['reason'] == ''
+    assert eth['stop_loss'] == 95.5 and eth['take_profit'] == 0
+
+    single = parse_signal('{"signal": "hold", "confidence": "medium"}')
+    assert single['signal'] == 'HOLD' and single['confidence'] == 'MEDIUM' and single['reason'] == ''
+    assert parse_signal('{"signal": "MAYBE"}') is None
+    assert normalize_signal(['BUY']) is None
+
+
+def test_parse_batch_failure_returns_empty():
+    """整体无法解析时返回空字典，由调用方退回单独分析"""
+    symbols = ['BTC/USDT', 'ETH/USDT']
+    assert parse_batch_signals('{"signal": "BUY"}', symbols) == {}
+    assert parse_batch_signals('[{"symbol": "BTC/USDT", "signal": "BUY",]', symbols) == {}
+    assert parse_batch_signals('[]', symbols) == {}
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_static_system_prompt_first,
+        test_cached_token_stats,
+        test_parse_single_signal,
+        test_parse_batch_signals,
+        test_missing_fields_defaulted,
+        test_parse_batch_failure_returns_empty,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
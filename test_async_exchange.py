@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试异步交易所客户端 (模拟异步交易所，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import time
+
+from async_exchange import AsyncExchangeClient
+from market_data import CandleCache, PositionSnapshot, RateLimiter
+from test_market_data import FakeExchange
+
+
+class FakeAsyncExchange:
+    """模拟 ccxt 异步交易所 - 每个请求耗时 delay 秒"""
+
+    def __init__(self, config, delay=0.2):
+        self.config = config
+        self.session = config['session']
+        self.delay = delay
+        self.sync = FakeExchange()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    async def _request(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+    async def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+        await self._request()
+        return self.sync.fetch_ohlcv(symbol, timeframe, since, limit)
+
+    async def fetch_positions(self, symbols=None, params=None):
+        await self._request()
+        return [{'symbol': 'BTC/USDT:USDT', 'contracts': 2}]
+
+    async def fetch_balance(self, params=None):
+        await self._request()
+        raise ConnectionError('超时')
+
+    async def close(self):
+        self.closed = True
+
+
+def test_requests_overlap_on_shared_session():
+    """多个请求在同一事件循环中并发，共用一个 aiohttp 会话"""
+    client = AsyncExchangeClient('fake', {'apiKey': 'k'}, factory=FakeAsyncExchange)
+    try:
+        assert client.exchange.session is client.session
+        assert client.exchange.config['apiKey'] == 'k'
+
+        symbols = [f"COIN{i}/USDT:USDT" for i in range(20)]
+        started = time.time()
+        results = client.gather([client.fetch_ohlcv(s, '3m', limit=5) for s in symbols])
+        elapsed = time.time() - started
+        assert len(results) == 20 and all(len(r) == 5 for r in results)
+        assert client.exchange.max_in_flight == 20
+        assert elapsed < 1.0
+
+        # 失败的请求返回异常对象，不影响其他请求
+        positions, balance = client.gather([client.fetch_positions(), client.fetch_balance()])
+        assert positions[0]['contracts'] == 2
+        assert isinstance(balance, ConnectionError)
+    finally:
+        client.close()
+    assert client.exchange.closed and client.session.closed
+
+
+def test_async_results_fill_sync_caches():
+    """异步拉取的K线和持仓写入同步缓存，之后读取不再请求"""
+    client = AsyncExchangeClient('fake', {}, factory=lambda config: FakeAsyncExchange(config, delay=0))
+    try:
+        fake = FakeExchange(now_ms=client.exchange.sync.now_ms)
+        cache = CandleCache(fake, refresh_interval=60)
+        ohlcv = client.run(client.fetch_ohlcv('BTC/USDT:USDT', '3m', limit=11))
+        cache.merge('BTC/USDT:USDT', '3m', ohlcv)
+        closed, forming = cache.get_bars('BTC/USDT:USDT', '3m', 10)
+        assert fake.calls == []
+        assert [c[0] for c in closed] == [c[0] for c in ohlcv[:10]] and forming == ohlcv[-1]
+
+        fetches = []
+        snapshot = PositionSnapshot(lambda: fetches.append(1) or [], ttl=30)
+        snapshot.set(client.run(client.fetch_positions()))
+        assert snapshot.get('BTC/USDT')[0]['contracts'] == 2
+        assert fetches == []
+    finally:
+        client.close()
+
+
+def test_async_requests_share_rate_limit():
+    """传入 limiter 时异步请求消耗与同步请求相同的预算，解析类方法不受影响"""
+    limiter = RateLimiter(rate=20, burst=2)
+    client = AsyncExchangeClient('fake', {}, factory=lambda config: FakeAsyncExchange(config, delay=0),
+                                 limiter=limiter)
+    try:
+        limiter.acquire()
+        limiter.acquire()
+        started = time.monotonic()
+        results = client.gather([client.fetch_ohlcv('BTC/USDT:USDT', '3m', limit=3) for _ in range(2)])
+        assert all(len(r) == 3 for r in results)
+        # 同步请求已用完桶容量，两次异步请求按每秒20次补充等待
+        assert time.monotonic() - started >= 0.09
+        assert client.session is client.exchange.session
+    finally:
+        client.close()
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_requests_overlap_on_shared_session,
+        test_async_results_fill_sync_caches,
+        test_async_requests_share_rate_limit,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
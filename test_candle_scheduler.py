@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+测试K线收盘对齐调度器 (模拟时钟，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import time
+
+from candle_scheduler import CandleScheduler
+from market_data import ExchangeClock
+
+TF_3M = 180000
+
+
+class FakeClock(ExchangeClock):
+    """手动推进的交易所时钟"""
+
+    def __init__(self, now_ms):
+        super().__init__(exchange=None)
+        self.now = now_ms
+        self.sync_count = 0
+
+    def sync(self):
+        self.sync_count += 1
+        self.synced_at = time.time()
+        return 0
+
+    def now_ms(self):
+        return self.now
+
+
+def test_fires_after_close_with_stagger():
+    """收盘 delay 秒后按币种错开执行"""
+    clock = FakeClock(1_700_000_000_000 - 1_700_000_000_000 % TF_3M + 60000)
+    scheduler = CandleScheduler(clock)
+    calls = []
+    scheduler.every_close(TF_3M, lambda symbols: calls.append((clock.now, symbols)),
+                          symbols=['BTC/USDT', 'ETH/USDT', 'SOL/USDT'], delay=3, stagger=2)
+    close = clock.now - clock.now % TF_3M + TF_3M
+    assert scheduler.seconds_until_next() == (close + 3000 - clock.now) / 1000
+
+    # 收盘前不执行
+    clock.now = close + 2999
+    assert scheduler.run_pending() == 0
+
+    clock.now = close + 3000
+    scheduler.run_pending()
+    scheduler.join()
+    clock.now = close + 5000
+    scheduler.run_pending()
+    scheduler.join()
+    assert scheduler.seconds_until_next() == 2.0
+    clock.now = close + 8000
+    scheduler.run_pending()
+    scheduler.join()
+    assert calls == [(close + 3000, ['BTC/USDT']), (close + 5000, ['ETH/USDT']), (close + 8000, ['SOL/USDT'])]
+
+    # 同一根K线不重复执行，下一根收盘后再次执行
+    clock.now = close + 60000
+    assert scheduler.run_pending() == 0
+    clock.now = close + TF_3M + 3000
+    scheduler.run_pending()
+    scheduler.join()
+    assert calls[-1] == (close + TF_3M + 3000, ['BTC/USDT'])
+
+
+def test_catch_up_runs_latest_missed_slot_once():
+    """错过多根K线时只补执行最近的一次，到期的币种合并为一次调用"""
+    clock = FakeClock(0)
+    scheduler = CandleScheduler(clock)
+    calls = []
+    job = scheduler.every_close(TF_3M, lambda symbols: calls.append(symbols),
+                                symbols=['BTC/USDT', 'ETH/USDT'], delay=3, stagger=1)
+
+    clock.now = 5 * TF_3M + 10000
+    scheduler.run_pending()
+    scheduler.join()
+    assert calls == [['BTC/USDT', 'ETH/USDT']]
+    assert job.skipped == 4
+    assert job.next_close == 6 * TF_3M
+
+
+def test_job_without_symbols_and_clock_resync():
+    """不区分币种的任务；按间隔重新校准时钟，任务异常不影响调度"""
+    clock = FakeClock(0)
+    scheduler = CandleScheduler(clock, resync_interval=600)
+    runs = []
+
+    def failing():
+        runs.append(clock.now)
+        raise RuntimeError('boom')
+
+    scheduler.every_close(4 * 3600 * 1000, failing, delay=0)
+    clock.now = 4 * 3600 * 1000
+    scheduler.run_pending()
+    scheduler.run_pending()
+    scheduler.join()
+    assert runs == [4 * 3600 * 1000]
+    assert clock.sync_count == 1
+
+    clock.synced_at -= 601
+    scheduler.run_pending()
+    assert clock.sync_count == 2
+
+
+def test_slow_job_does_not_delay_stagger():
+    """任务在线程池中执行: 慢任务不推迟后面币种的执行时间，不区分币种的任务不重叠执行"""
+    clock = FakeClock(0)
+    scheduler = CandleScheduler(clock)
+    started = {}
+
+    def fetch(symbols):
+        started[symbols[0]] = time.time()
+        if symbols[0] == 'BTC/USDT':
+            time.sleep(0.5)
+
+    cycles = []
+
+    def cycle():
+        cycles.append(time.time())
+        time.sleep(0.3)
+
+    scheduler.every_close(TF_3M, fetch, symbols=['BTC/USDT', 'ETH/USDT'], delay=3, stagger=1)
+    cycle_job = scheduler.every_close(TF_3M, cycle, delay=5)
+
+    clock.now = TF_3M + 3000
+    begin = time.time()
+    assert scheduler.run_pending() == 1
+    assert time.time() - begin < 0.1
+    clock.now = TF_3M + 4000
+    scheduler.run_pending()
+
+    clock.now = TF_3M + 5000
+    scheduler.run_pending()
+    clock.now = 2 * TF_3M + 5000
+    scheduler.run_pending()
+    scheduler.join()
+    assert started['ETH/USDT'] - started['BTC/USDT'] < 0.3
+    assert len(cycles) == 1
+    assert cycle_job.skipped == 1
+    scheduler.shutdown()
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_fires_after_close_with_stagger,
+        test_catch_up_runs_latest_missed_slot_once,
+        test_job_without_symbols_and_clock_resync,
+        test_slow_job_does_not_delay_stagger,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试磁盘K线存储 (临时目录 + 模拟交易所，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+
+from candle_store import CandleStore
+from market_data import CandleCache
+from test_market_data import FakeExchange
+
+
+def candles(start, count, step=180000):
+    return [[start + i * step, 1.0 + i, 2.0 + i, 0.5 + i, 1.5 + i, 10.0 + i] for i in range(count)]
+
+
+def test_append_and_query():
+    """只追加更新的K线，按尾部和时间区间读取"""
+    store = CandleStore(tempfile.mkdtemp())
+    assert store.tail('BTC/USDT:USDT', '3m', 5) == []
+    assert store.last_timestamp('BTC/USDT:USDT', '3m') is None
+
+    data = candles(1_700_000_000_000 - 1_700_000_000_000 % 180000, 10)
+    assert store.append('BTC/USDT:USDT', '3m', data[:6]) == 6
+    # 重复的K线跳过
+    assert store.append('BTC/USDT:USDT', '3m', data[4:]) == 4
+    assert store.count('BTC/USDT:USDT', '3m') == 10
+
+    assert store.tail('BTC/USDT:USDT', '3m', 3) == data[-3:]
+    assert isinstance(store.tail('BTC/USDT:USDT', '3m', 1)[0][0], int)
+    assert store.load('BTC/USDT:USDT', '3m', since=data[2][0], until=data[5][0]) == data[2:5]
+    assert store.columns('BTC/USDT:USDT', '3m', limit=4)['close'].tolist() == [c[4] for c in data[-4:]]
+
+    # 新实例 (重启后) 读取同一目录
+    reopened = CandleStore(store.root)
+    assert reopened.last_timestamp('BTC/USDT:USDT', '3m') == data[-1][0]
+    assert reopened.append('BTC/USDT:USDT', '3m', data) == 0
+
+
+def test_interrupted_write_is_truncated():
+    """写入中断导致各列长度不一致时，只读取完整的行，下次写入前截断"""
+    store = CandleStore(tempfile.mkdtemp())
+    data = candles(0, 5)
+    store.append('ETH/USDT', '15m', data[:4])
+    with open(store._path('ETH/USDT', '15m', 'close'), 'ab') as f:
+        f.write(b'\x00' * 12)
+
+    reopened = CandleStore(store.root)
+    assert reopened.count('ETH/USDT', '15m') == 4
+    assert reopened.append('ETH/USDT', '15m', data) == 1
+    assert reopened.tail('ETH/USDT', '15m', 10) == data
+
+
+def test_cache_warm_start_from_store():
+    """重启后K线缓存从磁盘预热，只用 since 补齐缺少的K线"""
+    root = tempfile.mkdtemp()
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=0, store=CandleStore(root))
+    first = cache.get_closed_candles('BTC/USDT:USDT', '3m', 100)
+    assert len(first) == 100
+
+    # 重启: 新进程，过去了5根K线
+    fake.now_ms += 5 * 180000
+    fake.calls.clear()
+    cache = CandleCache(fake, refresh_interval=0, store=CandleStore(root))
+    assert cache.cached_closed('BTC/USDT:USDT', '3m') == first
+    closed = cache.get_closed_candles('BTC/USDT:USDT', '3m', 100)
+    assert len(fake.calls) == 1 and fake.calls[0]['since'] == first[-1][0] + 180000
+    assert closed[-1][0] == first[-1][0] + 5 * 180000
+    assert CandleStore(root).count('BTC/USDT:USDT', '3m') == 105
+
+    # 较短窗口在断档较长 (但仍在一页内) 时也增量补齐，不丢弃磁盘历史
+    fake.now_ms += 20 * 180000
+    cache.get_candles('BTC/USDT:USDT', '3m', 10)
+    assert fake.calls[-1]['since'] is not None
+    assert CandleStore(root).count('BTC/USDT:USDT', '3m') == 125
+
+
+def test_warm_start_skips_discontinuous_history():
+    """磁盘历史中间有断档时只加载最后一段连续K线"""
+    store = CandleStore(tempfile.mkdtemp())
+    store.append('SOL/USDT', '3m', candles(0, 5) + candles(10 * 180000, 3))
+    cache = CandleCache(FakeExchange(), store=store)
+    assert [c[0] for c in cache.cached_closed('SOL/USDT', '3m')] == [10 * 180000, 11 * 180000, 12 * 180000]
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_append_and_query,
+        test_interrupted_write_is_truncated,
+        test_cache_warm_start_from_store,
+        test_warm_start_skips_discontinuous_history,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+测试历史K线批量下载 (模拟交易所 + 临时目录，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+import threading
+
+from candle_store import CandleStore
+from history_downloader import HistoryDownloader
+from test_market_data import FakeExchange
+
+
+class FlakyExchange(FakeExchange):
+    """前 fail_after 次请求正常，之后全部失败 (模拟下载中断)"""
+
+    def __init__(self, fail_after=None):
+        super().__init__()
+        self.fail_after = fail_after
+        self._lock = threading.Lock()
+
+    def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+        with self._lock:
+            if self.fail_after is not None and len(self.calls) >= self.fail_after:
+                raise ConnectionError('网络中断')
+            return super().fetch_ohlcv(symbol, timeframe, since, limit, params)
+
+
+def assert_complete(store, symbol, timeframe, since, until, tf_ms):
+    """存储中的K线连续、无重复，覆盖整个区间"""
+    timestamps = store.columns(symbol, timeframe)['timestamp'].tolist()
+    first = since + (-since) % tf_ms
+    assert timestamps == list(range(first, until, tf_ms))
+
+
+def test_paginates_all_symbols_and_timeframes():
+    """按 since 分页下载多个币种和周期"""
+    fake = FlakyExchange()
+    store = CandleStore(tempfile.mkdtemp())
+    downloader = HistoryDownloader(fake, store, max_workers=4, page_limit=50)
+    until = fake.now_ms - fake.now_ms % 14400000
+    since = until - 2 * 86400000
+
+    results = downloader.download(['BTC/USDT:USDT', 'ETH/USDT:USDT'], ['15m', '4h'], since, until)
+    assert results[('BTC/USDT:USDT', '15m')] == 192
+    assert results[('ETH/USDT:USDT', '4h')] == 12
+    for symbol in ('BTC/USDT:USDT', 'ETH/USDT:USDT'):
+        assert_complete(store, symbol, '15m', since, until, 900000)
+        assert_complete(store, symbol, '4h', since, until, 14400000)
+    # 15m: 192根 / 每页50 = 4页；4h: 1页
+    assert downloader.request_count == 2 * (4 + 1)
+
+
+def test_resume_after_interruption():
+    """中断后重新运行从上次进度继续，不重复下载"""
+    root = tempfile.mkdtemp()
+    fake = FlakyExchange(fail_after=3)
+    until = fake.now_ms - fake.now_ms % 180000
+    since = until - 500 * 180000
+
+    downloader = HistoryDownloader(fake, CandleStore(root), page_limit=100, retries=1, retry_delay=0)
+    results = downloader.download(['SOL/USDT:USDT'], ['3m'], since, until)
+    assert isinstance(results[('SOL/USDT:USDT', '3m')], ConnectionError)
+    assert CandleStore(root).count('SOL/USDT:USDT', '3m') == 300
+
+    # 新进程继续下载
+    fake.fail_after = None
+    fake.calls.clear()
+    downloader = HistoryDownloader(fake, CandleStore(root), page_limit=100)
+    assert downloader.download(['SOL/USDT:USDT'], ['3m'], since, until)[('SOL/USDT:USDT', '3m')] == 200
+    assert fake.calls[0]['since'] == since + 300 * 180000
+    assert_complete(CandleStore(root), 'SOL/USDT:USDT', '3m', since, until, 180000)
+
+    # 已下载完成时不再请求
+    fake.calls.clear()
+    downloader.download(['SOL/USDT:USDT'], ['3m'], since, until)
+    assert fake.calls == []
+
+
+def test_skips_forming_candle():
+    """未收盘K线不写入存储"""
+    fake = FlakyExchange()
+    store = CandleStore(tempfile.mkdtemp())
+    since = fake.now_ms - 10 * 180000
+    HistoryDownloader(fake, store).download(['BTC/USDT:USDT'], ['3m'], since)
+    last_ts = store.last_timestamp('BTC/USDT:USDT', '3m')
+    assert last_ts + 180000 <= fake.now_ms < last_ts + 2 * 180000
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_paginates_all_symbols_and_timeframes,
+        test_resume_after_interruption,
+        test_skips_forming_candle,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+测试增量指标引擎 (与 pandas 逐根重算的结果对比)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import math
+import random
+
+import pandas as pd
+
+from indicators import IndicatorEngine, WilderRSI, batch_indicators
+
+
+def make_candles(count, start_ts=1_700_000_000_000, step=900000, seed=7):
+    """生成随机游走K线"""
+    rng = random.Random(seed)
+    candles = []
+    price = 100.0
+    for i in range(count):
+        price = max(1.0, price + rng.uniform(-2, 2))
+        candles.append([start_ts + i * step, price, price + 1, price - 1, price, rng.uniform(5, 50)])
+    return candles
+
+
+def assert_close(actual, expected, name):
+    if pd.isna(expected):
+        assert math.isnan(actual), f"{name}: 期望NaN, 实际{actual}"
+    else:
+        assert abs(actual - expected) < 1e-9 * max(1.0, abs(expected)), f"{name}: {actual} != {expected}"
+
+
+def test_matches_pandas_rolling_and_ewm():
+    """SMA/EMA/MACD/布林带/成交量均线与 pandas 结果一致"""
+    candles = make_candles(80)
+    df = pd.DataFrame(candles, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    close = df['close']
+    macd = close.ewm(span=12).mean() - close.ewm(span=26).mean()
+    signal = macd.ewm(span=9).mean()
+    bb_middle = close.rolling(window=20).mean()
+    bb_std = close.rolling(window=20).std()
+    expected = {
+        'sma_5': close.rolling(window=5).mean(),
+        'sma_10': close.rolling(window=10).mean(),
+        'sma_20': close.rolling(window=20).mean(),
+        'ema_20': close.ewm(span=20).mean(),
+        'ema_50': close.ewm(span=50).mean(),
+        'macd': macd,
+        'signal': signal,
+        'histogram': macd - signal,
+        'bb_upper': bb_middle + bb_std * 2,
+        'bb_lower': bb_middle - bb_std * 2,
+        'volume_sma_10': df['volume'].rolling(window=10).mean(),
+    }
+
+    engine = IndicatorEngine()
+    for i in range(len(candles)):
+        latest = engine.update('BTC/USDT:USDT', '15m', candles[:i + 1])
+        for name, series in expected.items():
+            assert_close(latest[name], series.iloc[i], f"{name}[{i}]")
+
+
+def test_wilder_rsi():
+    """RSI 使用 Wilder 平滑"""
+    closes = [c[4] for c in make_candles(40)]
+    rsi = WilderRSI(14)
+    values = [rsi.update(close) for close in closes]
+    assert all(math.isnan(v) for v in values[:14])
+
+    changes = [b - a for a, b in zip(closes, closes[1:])]
+    avg_gain = sum(max(c, 0) for c in changes[:14]) / 14
+    avg_loss = sum(max(-c, 0) for c in changes[:14]) / 14
+    for i, change in enumerate(changes[14:], start=15):
+        avg_gain = (avg_gain * 13 + max(change, 0)) / 14
+        avg_loss = (avg_loss * 13 + max(-change, 0)) / 14
+        assert_close(values[i], 100 - 100 / (1 + avg_gain / avg_loss), f"rsi[{i}]")
+
+
+def test_incremental_only_processes_new_candles():
+    """滑动窗口重复传入时只处理新K线，结果与一次性计算相同"""
+    candles = make_candles(60)
+    streaming = IndicatorEngine()
+    for end in range(30, 61):
+        latest = streaming.update('ETH/USDT:USDT', '4h', candles[end - 30:end])
+
+    replay = IndicatorEngine().update('ETH/USDT:USDT', '4h', candles)
+    for name in ('sma_20', 'ema_50', 'macd', 'rsi', 'bb_upper'):
+        assert_close(latest[name], replay[name], name)
+    assert latest['prev']['timestamp'] == candles[-2][0]
+
+
+def test_gap_rewarms_state():
+    """K线断档时丢弃旧状态重新预热"""
+    candles = make_candles(100)
+    engine = IndicatorEngine()
+    engine.update('SOL/USDT:USDT', '15m', candles[:30])
+    latest = engine.update('SOL/USDT:USDT', '15m', candles[60:100])
+
+    fresh = IndicatorEngine().update('SOL/USDT:USDT', '15m', candles[60:100])
+    assert_close(latest['ema_20'], fresh['ema_20'], 'ema_20')
+    assert latest['timestamp'] == candles[-1][0]
+
+
+def test_batch_matches_streaming_engine():
+    """批量向量化计算与逐币种增量计算结果一致"""
+    candles_by_symbol = {f'S{i}/USDT': make_candles(60, seed=i) for i in range(5)}
+    batch = batch_indicators(candles_by_symbol)
+    assert set(batch) == set(candles_by_symbol)
+
+    for symbol, candles in candles_by_symbol.items():
+        expected = IndicatorEngine().update(symbol, '15m', candles)
+        for name, value in expected.items():
+            if name == 'prev':
+                for prev_name, prev_value in value.items():
+                    assert_close(batch[symbol]['prev'][prev_name], prev_value, f"{symbol} prev.{prev_name}")
+            else:
+                assert_close(batch[symbol][name], value, f"{symbol} {name}")
+
+
+def test_batch_mixed_lengths():
+    """K线数量不同的币种各自按全部K线计算，短序列不影响其他币种"""
+    candles_by_symbol = {
+        'A/USDT': make_candles(100),
+        'B/USDT': make_candles(12, seed=3),
+        'C/USDT': make_candles(60, seed=5),
+        'D/USDT': make_candles(100, seed=7),
+        'E/USDT': [],
+    }
+    batch = batch_indicators(candles_by_symbol)
+    assert set(batch) == {'A/USDT', 'B/USDT', 'C/USDT', 'D/USDT'}
+
+    for symbol in batch:
+        expected = IndicatorEngine().update(symbol, '15m', candles_by_symbol[symbol])
+        for name, value in expected.items():
+            if name == 'prev':
+                for prev_name, prev_value in value.items():
+                    assert_close(batch[symbol]['prev'][prev_name], prev_value, f"{symbol} prev.{prev_name}")
+            else:
+                assert_close(batch[symbol][name], value, f"{symbol} {name}")
+    assert not math.isnan(batch['A/USDT']['sma_20']) and not math.isnan(batch['A/USDT']['rsi'])
+    assert math.isnan(batch['B/USDT']['sma_20'])
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_matches_pandas_rolling_and_ewm,
+        test_wilder_rsi,
+        test_incremental_only_processes_new_candles,
+        test_gap_rewarms_state,
+        test_batch_matches_streaming_engine,
+        test_batch_mixed_lengths,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
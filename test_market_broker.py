@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+测试行情代理进程 (本地 Unix socket + 模拟交易所，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from market_broker import (
+    MarketBroker, BrokerServer, BrokerClient, BrokeredExchange, connect_broker, broker_running
+)
+from test_market_data import FakeExchange, SlowExchange
+
+
+class FakeTickerExchange(FakeExchange):
+    """在模拟K线基础上增加 ticker / 持仓接口"""
+
+    def __init__(self):
+        super().__init__()
+        self.ticker_calls = 0
+        self.position_calls = 0
+
+    def fetch_ticker(self, symbol, params=None):
+        self.ticker_calls += 1
+        return {'symbol': symbol, 'last': 100.0, 'high': 110.0, 'low': 90.0, 'quoteVolume': 1000.0}
+
+    def fetch_tickers(self, symbols=None, params=None):
+        self.ticker_calls += 1
+        return {symbol: {'symbol': symbol, 'last': 100.0} for symbol in symbols}
+
+    def fetch_positions(self, symbols=None, params=None):
+        self.position_calls += 1
+        return [{'symbol': 'BTC/USDT:USDT', 'contracts': 1}]
+
+
+def start_server(exchange):
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    server = BrokerServer(MarketBroker(exchange), path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, path
+
+
+def test_strategies_share_one_exchange_request():
+    """两个策略进程读取同一行情，交易所只收到一次请求"""
+    fake = FakeTickerExchange()
+    server, path = start_server(fake)
+    try:
+        strategy_a = connect_broker(fake, path)
+        strategy_b = connect_broker(fake, path)
+        assert isinstance(strategy_a, BrokeredExchange)
+
+        assert strategy_a.fetch_ticker('BTC/USDT')['last'] == 100.0
+        assert strategy_b.fetch_ticker('BTC/USDT')['high'] == 110.0
+        assert fake.ticker_calls == 1
+
+        candles_a = strategy_a.fetch_ohlcv('BTC/USDT', '3m', limit=10)
+        candles_b = strategy_b.fetch_ohlcv('BTC/USDT', '3m', limit=10)
+        assert candles_a == candles_b and len(candles_a) == 10
+        assert len(fake.calls) == 1
+
+        # 未代理的方法直接转发
+        assert strategy_a.milliseconds() == fake.now_ms
+        strategy_a.fetch_positions()
+        assert fake.position_calls == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_positions_opt_in_with_ttl():
+    """持仓按需代理，TTL内共享"""
+    fake = FakeTickerExchange()
+    server, path = start_server(fake)
+    try:
+        exchange = connect_broker(fake, path, methods=('fetch_positions',))
+        assert exchange.fetch_positions()[0]['contracts'] == 1
+        assert exchange.fetch_positions()[0]['contracts'] == 1
+        assert fake.position_calls == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fallback_when_broker_missing():
+    """代理未运行或中途退出时直连交易所"""
+    fake = FakeTickerExchange()
+    missing = os.path.join(tempfile.mkdtemp(), 'missing.sock')
+    assert connect_broker(fake, missing) is fake
+    assert not broker_running(missing)
+
+    server, path = start_server(fake)
+    exchange = connect_broker(fake, path)
+    assert broker_running(path)
+    server.shutdown()
+    server.server_close()
+
+    exchange.fetch_ticker('ETH/USDT')
+    assert fake.ticker_calls == 1
+
+
+def test_lazy_connect_after_broker_starts():
+    """导入时代理未运行: 先直连交易所，代理启动后的请求改走代理"""
+    fake = FakeTickerExchange()
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    exchange = connect_broker(fake, path, lazy=True)
+    assert isinstance(exchange, BrokeredExchange)
+
+    exchange.fetch_ticker('BTC/USDT')
+    assert fake.ticker_calls == 1 and not exchange.connected
+
+    server = BrokerServer(MarketBroker(fake), path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # 重试间隔内不再尝试连接
+        exchange.fetch_ticker('BTC/USDT')
+        assert fake.ticker_calls == 2 and not exchange.connected
+
+        exchange._retry_at = 0
+        exchange.fetch_ticker('BTC/USDT')
+        exchange.fetch_ticker('BTC/USDT')
+        assert exchange.connected
+        assert fake.ticker_calls == 3  # 代理的 Ticker 缓存共享
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_threads_use_separate_connections():
+    """各线程使用自己的连接，不同币种的请求在代理中并发处理，不互相排队"""
+    slow = SlowExchange(delay=0.3)
+    server, path = start_server(slow)
+    client = BrokerClient(path)
+    try:
+        symbols = [f"COIN{i}/USDT:USDT" for i in range(4)]
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda s: client.call('fetch_ohlcv', s, '3m', limit=5), symbols))
+        assert all(len(r) == 5 for r in results)
+        assert time.time() - started < 0.9
+        assert slow.max_in_flight == 4
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_broker_errors_are_reported():
+    """交易所异常返回给调用方"""
+    server, path = start_server(FakeTickerExchange())
+    try:
+        client = BrokerClient(path)
+        try:
+            client.call('create_order', 'BTC/USDT')
+            assert False, '应当抛出异常'
+        except RuntimeError as e:
+            assert '不支持的方法' in str(e)
+        assert client.call('ping') == 'pong'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_strategies_share_one_exchange_request,
+        test_positions_opt_in_with_ttl,
+        test_fallback_when_broker_missing,
+        test_lazy_connect_after_broker_starts,
+        test_threads_use_separate_connections,
+        test_broker_errors_are_reported,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
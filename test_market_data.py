@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+测试行情数据层 (使用本地模拟交易所，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import threading
+import time
+
+from market_data import (
+    CandleCache, BarAggregator, ExchangeClock, PositionSnapshot, SymbolRegistry, LeverageState, TickerCache,
+    RateLimiter, RateLimitedExchange, aggregate_candles, find_gaps, normalize_symbol
+)
+
+TIMEFRAMES = {'3m': 180, '15m': 900, '4h': 14400}
+
+
+class FakeExchange:
+    """模拟交易所 - 按当前时间生成K线"""
+
+    def __init__(self, now_ms=1_700_000_000_000):
+        self.now_ms = now_ms
+        self.calls = []
+
+    def parse_timeframe(self, timeframe):
+        return TIMEFRAMES[timeframe]
+
+    def milliseconds(self):
+        return self.now_ms
+
+    def candle(self, ts):
+        price = 100 + (ts // 180000) % 50
+        return [ts, price, price + 1, price - 1, price + 0.5, 10.0]
+
+    def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+        self.calls.append({'symbol': symbol, 'timeframe': timeframe, 'since': since, 'limit': limit})
+        tf_ms = TIMEFRAMES[timeframe] * 1000
+        forming_ts = self.now_ms - self.now_ms % tf_ms
+        if since is None:
+            start = forming_ts - (limit - 1) * tf_ms
+        else:
+            start = since - since % tf_ms
+        candles = [self.candle(ts) for ts in range(start, forming_ts + 1, tf_ms)]
+        return candles[:limit] if limit else candles
+
+
+def test_candle_cache_incremental():
+    """第二次请求只用 since 拉取新K线"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=0)
+
+    first = cache.get_candles('BTC/USDT:USDT', '3m', 10)
+    assert len(first) == 10
+    assert fake.calls[-1]['since'] is None
+
+    # 过去两根K线
+    fake.now_ms += 2 * 180000
+    second = cache.get_candles('BTC/USDT:USDT', '3m', 10)
+    assert len(second) == 10
+    assert fake.calls[-1]['since'] == first[-2][0] + 180000
+    assert second[-1][0] == first[-1][0] + 2 * 180000
+    assert [c[0] for c in second] == sorted({c[0] for c in second})
+
+
+def test_candle_cache_shared_between_limits():
+    """较小窗口直接复用已有缓存，刷新间隔内不重复请求"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+
+    cache.get_candles('ETH/USDT:USDT', '3m', 10)
+    last3 = cache.get_candles('ETH/USDT:USDT', '3m', 3)
+    assert len(last3) == 3
+    assert len(fake.calls) == 1
+
+    # 需要更大的窗口时重新拉取
+    cache.get_candles('ETH/USDT:USDT', '3m', 20)
+    assert len(fake.calls) == 2
+    assert fake.calls[-1]['limit'] == 20
+
+
+def test_candle_cache_long_gap_backfills():
+    """断档超过一页时拉取最新窗口，中间的缺口分页补齐，不丢弃已有K线"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=0, page_limit=50)
+
+    first = cache.get_closed_candles('SOL/USDT:USDT', '15m', 20)
+    fake.now_ms += 100 * 900000
+    fake.calls.clear()
+    candles = cache.get_candles('SOL/USDT:USDT', '15m', 20)
+    assert fake.calls[0]['since'] is None
+    assert [call['since'] for call in fake.calls[1:]] == [first[-1][0] + 900000, first[-1][0] + 51 * 900000]
+    assert cache.backfill_count == 2
+    assert len(candles) == 20
+    assert candles[-1][0] == fake.now_ms - fake.now_ms % 900000
+
+    closed = cache.cached_closed('SOL/USDT:USDT', '15m')
+    assert closed[0] == first[0] and find_gaps(closed, 900000) == []
+
+    # 断档超过缓存容量时重新拉取完整窗口
+    small = CandleCache(fake, refresh_interval=0, max_candles=30)
+    small.get_candles('SOL/USDT:USDT', '15m', 20)
+    fake.now_ms += 40 * 900000
+    fake.calls.clear()
+    small.get_candles('SOL/USDT:USDT', '15m', 20)
+    assert [call['since'] for call in fake.calls] == [None]
+
+
+def test_closed_candles_cached_until_next_close():
+    """已收盘K线在下一根K线收盘前不重复请求"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=0)
+
+    first_ts = cache.last_closed_timestamp('BTC/USDT:USDT', '15m')
+    fake.now_ms += 60000
+    assert cache.last_closed_timestamp('BTC/USDT:USDT', '15m') == first_ts
+    assert len(fake.calls) == 1
+
+    fake.now_ms += 900000
+    assert cache.last_closed_timestamp('BTC/USDT:USDT', '15m') == first_ts + 900000
+    assert len(fake.calls) == 2
+
+
+def test_push_candle_gap_backfilled():
+    """推送的收盘K线与缓存不连续时记录缺口，读取前补齐漏掉的K线"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+    closed = cache.get_closed_candles('BTC/USDT:USDT', '3m', 5)
+
+    next_ts = closed[-1][0] + 180000
+    cache.push_candle('BTC/USDT:USDT', '3m', fake.candle(next_ts), closed=True)
+    assert cache.cached_closed('BTC/USDT:USDT', '3m')[-1][0] == next_ts
+
+    fake.now_ms += 4 * 180000
+    cache.push_candle('BTC/USDT:USDT', '3m', fake.candle(next_ts + 3 * 180000), closed=True)
+    fake.calls.clear()
+    candles = cache.get_closed_candles('BTC/USDT:USDT', '3m', 7)
+    assert [call['since'] for call in fake.calls] == [next_ts + 180000]
+    assert [c[0] for c in candles[-4:]] == [next_ts + i * 180000 for i in range(4)]
+    assert candles[-2] == fake.candle(next_ts + 2 * 180000)
+
+
+def test_backfill_in_background_and_exchange_holes():
+    """后台线程补齐缺口；交易所本身缺失的K线记为空洞，不再重复请求"""
+    class HoleyExchange(FakeExchange):
+        def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+            candles = super().fetch_ohlcv(symbol, timeframe, since, limit, params)
+            return [c for c in candles if c[0] != self.hole]
+
+    fake = HoleyExchange()
+    fake.hole = None
+    cache = CandleCache(fake, refresh_interval=60, background_backfill=True)
+    closed = cache.get_closed_candles('ETH/USDT:USDT', '3m', 5)
+    last_ts = closed[-1][0]
+
+    fake.now_ms += 4 * 180000
+    fake.hole = last_ts + 2 * 180000
+    cache.push_candle('ETH/USDT:USDT', '3m', fake.candle(last_ts + 3 * 180000), closed=True)
+    deadline = time.time() + 5
+    while ('ETH/USDT:USDT', '3m') in cache._gaps and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.backfill_count == 1
+    timestamps = [c[0] for c in cache.cached_closed('ETH/USDT:USDT', '3m')[-3:]]
+    assert timestamps == [last_ts, last_ts + 180000, last_ts + 3 * 180000]
+    assert find_gaps(cache.cached_closed('ETH/USDT:USDT', '3m'), 180000) == [(fake.hole, fake.hole + 180000)]
+
+    # 空洞不再请求
+    cache.get_closed_candles('ETH/USDT:USDT', '3m', 5)
+    assert cache.backfill_count == 1
+
+
+def test_get_bars_separates_forming_candle():
+    """已收盘K线与未收盘K线分开返回，K线刚收盘时忽略刷新间隔立即拉取"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+    closed, forming = cache.get_bars('BTC/USDT:USDT', '3m', 5)
+    assert len(closed) == 5
+    assert forming[0] == fake.now_ms - fake.now_ms % 180000
+    assert closed[-1][0] == forming[0] - 180000
+
+    # 当前K线收盘: 不再作为未收盘K线返回，并立即拉取最终K线
+    fake.now_ms += 180000
+    closed, forming = cache.get_bars('BTC/USDT:USDT', '3m', 5)
+    assert len(fake.calls) == 2
+    assert closed[-1][0] == forming[0] - 180000 == fake.now_ms - fake.now_ms % 180000 - 180000
+
+
+def test_exchange_clock_offset():
+    """按交易所时间判断K线收盘"""
+    class ServerTimeExchange(FakeExchange):
+        def fetch_time(self, params=None):
+            return int(time.time() * 1000) + 5000
+
+    fake = ServerTimeExchange()
+    clock = ExchangeClock(fake)
+    offset = clock.sync()
+    assert 4900 < offset < 5100
+    assert abs(clock.now_ms() - (time.time() * 1000 + 5000)) < 100
+
+    next_close = clock.next_close(180000)
+    assert next_close % 180000 == 0 and 0 < next_close - clock.now_ms() <= 180000
+
+    # 缓存使用时钟判断收盘
+    cache = CandleCache(fake, clock=clock)
+    assert abs(cache.now_ms() - clock.now_ms()) < 5
+
+
+def test_aggregate_candles_alignment():
+    """按周期整点对齐合并，开高低收量正确"""
+    base = [[900000 * 10 + i * 180000, 10 + i, 20 + i, 5 - i, 11 + i, 1.0] for i in range(7)]
+    bars = aggregate_candles(base, 900000)
+    assert [b[0] for b in bars] == [900000 * 10, 900000 * 11]
+    assert bars[0] == [900000 * 10, 10, 24, 1, 15, 5.0]
+    # 第二个桶只有两根基础K线 (未完成)
+    assert bars[1] == [900000 * 11, 15, 26, -1, 17, 2.0]
+
+
+def test_bar_aggregator_derives_from_base():
+    """预热后高周期K线由基础周期合成，不再请求高周期"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=0)
+    bars = BarAggregator(cache, '3m')
+
+    seeded = bars.get_closed_candles('BTC/USDT:USDT', '15m', 20)
+    assert len(seeded) == 20
+
+    fake.now_ms += 3 * 900000
+    fake.calls.clear()
+    candles = bars.get_closed_candles('BTC/USDT:USDT', '15m', 20)
+    assert {call['timeframe'] for call in fake.calls} == {'3m'}
+    assert candles[-1][0] == seeded[-1][0] + 3 * 900000
+    assert bars.derived_count == 3
+
+    # 合成结果与基础K线一致
+    start = candles[-1][0]
+    base = [fake.candle(ts) for ts in range(start, start + 900000, 180000)]
+    assert candles[-1] == [start, base[0][1], max(c[2] for c in base), min(c[3] for c in base),
+                           base[-1][4], sum(c[5] for c in base)]
+
+    # 未收盘的高周期K线由基础K线合成
+    forming = bars.get_candles('BTC/USDT:USDT', '15m', 5)
+    assert forming[-1][0] == start + 900000
+
+
+def test_bar_aggregator_holds_back_incomplete_bucket():
+    """桶内缺少基础K线时不合成 (也不合成之后的桶)，该高周期K线改由交易所加载"""
+    class HoleyBaseExchange(FakeExchange):
+        hole = None
+
+        def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+            candles = super().fetch_ohlcv(symbol, timeframe, since, limit, params)
+            return [c for c in candles if timeframe != '3m' or c[0] != self.hole]
+
+    fake = HoleyBaseExchange()
+    cache = CandleCache(fake, refresh_interval=0)
+    bars = BarAggregator(cache, '3m')
+    seeded = bars.get_closed_candles('BTC/USDT:USDT', '15m', 20)
+    cache.get_closed_candles('BTC/USDT:USDT', '3m', 10)
+
+    fake.now_ms += 3 * 900000
+    fake.hole = seeded[-1][0] + 2 * 900000 + 2 * 180000  # 第二根新15m K线内缺一根3m
+    candles = bars.get_closed_candles('BTC/USDT:USDT', '15m', 20)
+    assert bars.derived_count == 1
+    assert candles[-1][0] == seeded[-1][0] + 3 * 900000
+    # 缺K线的桶来自交易所，而不是由4根3m K线合成的残缺K线
+    assert candles[-2] == fake.candle(seeded[-1][0] + 2 * 900000)
+    assert find_gaps(candles, 900000) == []
+
+
+def test_normalize_symbol():
+    """各种交易对格式标准化为统一格式"""
+    assert normalize_symbol('BTC/USDT:USDT') == 'BTC/USDT'
+    assert normalize_symbol('BTC-USDT-SWAP') == 'BTC/USDT'
+    assert normalize_symbol('BTCUSDT') == 'BTC/USDT'
+    assert normalize_symbol('bnb/usdt') == 'BNB/USDT'
+    assert normalize_symbol('BNB/USDC:USDC') != normalize_symbol('BNB/USDT')
+
+
+def test_position_snapshot_shared_and_invalidated():
+    """同一快照服务所有币种，失效后重新拉取"""
+    fetches = []
+
+    def fetch_positions():
+        fetches.append(1)
+        return [
+            {'symbol': 'BTC/USDT:USDT', 'contracts': 1, 'info': {'posSide': 'long'}},
+            {'symbol': 'BTC/USDT:USDT', 'contracts': 2, 'info': {'posSide': 'short'}},
+            {'symbol': 'ETH/USDT:USDT', 'contracts': 3, 'info': {'posSide': 'long'}},
+        ]
+
+    snapshot = PositionSnapshot(fetch_positions, ttl=60)
+    assert len(snapshot.get('BTC/USDT')) == 2
+    assert len(snapshot.get('ETH/USDT')) == 1
+    assert snapshot.get('SOL/USDT') == []
+    assert len(fetches) == 1
+
+    snapshot.invalidate()
+    snapshot.get('BTC/USDT')
+    assert len(fetches) == 2
+
+
+def test_ticker_cache_batches_and_expires():
+    """多个币种合并为一次 fetch_tickers，TTL内不重复请求"""
+    class FakeTickers:
+        def __init__(self):
+            self.calls = []
+
+        def fetch_tickers(self, symbols):
+            self.calls.append(('fetch_tickers', tuple(symbols)))
+            return {s: {'symbol': s, 'last': 1.0} for s in symbols}
+
+        def fetch_ticker(self, symbol):
+            self.calls.append(('fetch_ticker', symbol))
+            return {'symbol': symbol, 'last': 2.0}
+
+    fake = FakeTickers()
+    cache = TickerCache(fake, ttl=60)
+    tickers = cache.get_many(['BTC/USDT', 'ETH/USDT'])
+    assert set(tickers) == {'BTC/USDT', 'ETH/USDT'}
+    assert cache.get('BTC/USDT')['last'] == 1.0
+    assert fake.calls == [('fetch_tickers', ('BTC/USDT', 'ETH/USDT'))]
+
+    # 单个新币种直接 fetch_ticker
+    assert cache.get('SOL/USDT')['last'] == 2.0
+    cache.invalidate()
+    cache.get_many(['BTC/USDT', 'ETH/USDT'])
+    assert len(fake.calls) == 3
+
+
+def make_markets():
+    """模拟 load_markets() 返回的市场列表"""
+    markets = {}
+    for base in ('BTC', 'SOL', 'BNB'):
+        markets[f'{base}/USDT'] = {'symbol': f'{base}/USDT', 'id': f'{base}-USDT', 'base': base,
+                                   'quote': 'USDT', 'spot': True, 'swap': False}
+        markets[f'{base}/USDT:USDT'] = {'symbol': f'{base}/USDT:USDT', 'id': f'{base}-USDT-SWAP', 'base': base,
+                                        'quote': 'USDT', 'spot': False, 'swap': True, 'linear': True,
+                                        'contractSize': 0.01, 'precision': {'amount': 0.01},
+                                        'limits': {'amount': {'min': 0.01}}}
+    markets['BNB/USDC:USDC'] = {'symbol': 'BNB/USDC:USDC', 'id': 'BNB-USDC-SWAP', 'base': 'BNB',
+                                'quote': 'USDC', 'spot': False, 'swap': True, 'linear': True}
+    return markets
+
+
+class FakeMarketsExchange:
+    """只提供 load_markets() 的模拟交易所"""
+
+    def __init__(self):
+        self.load_count = 0
+
+    def load_markets(self, reload=False):
+        self.load_count += 1
+        return make_markets()
+
+
+def test_symbol_registry_aliases():
+    """所有别名映射到同一标准交易对，不同计价币不会误匹配"""
+    fake = FakeMarketsExchange()
+    registry = SymbolRegistry(fake)
+
+    for alias in ('BNB/USDT', 'BNB/USDT:USDT', 'BNB-USDT-SWAP', 'BNB-USDT', 'BNBUSDT', 'bnb/usdt'):
+        assert registry.canonical(alias) == 'BNB/USDT', alias
+    assert registry.canonical('BNB/USDC:USDC') == 'BNB/USDC'
+    assert registry.trade_symbol('SOL/USDT') == 'SOL/USDT:USDT'
+    assert registry.inst_id('SOL/USDT') == 'SOL-USDT-SWAP'
+    assert fake.load_count == 1
+
+
+def test_symbol_registry_order_sizing():
+    """下单参数表预先计算好，读取时不再请求交易所"""
+    fake = FakeMarketsExchange()
+    registry = SymbolRegistry(fake)
+
+    sizing = registry.order_sizing('SOL/USDT:USDT')
+    assert sizing['contract_size'] == 0.01
+    assert sizing['amount_decimals'] == 2
+    assert sizing['min_amount'] == 0.01
+    assert sizing['inst_id'] == 'SOL-USDT-SWAP'
+    registry.order_sizing('BTC-USDT-SWAP')
+    assert fake.load_count == 1
+
+
+class FakeLeverageExchange:
+    """记录 set_leverage 调用的模拟交易所"""
+
+    def __init__(self):
+        self.set_calls = []
+
+    def fetch_leverage(self, symbol, params=None):
+        return {'symbol': symbol, 'marginMode': 'isolated', 'longLeverage': 10, 'shortLeverage': 5}
+
+    def set_leverage(self, leverage, symbol, params=None):
+        self.set_calls.append((symbol, leverage, (params or {}).get('posSide')))
+
+
+def test_leverage_state_skips_unchanged():
+    """杠杆未变化时不再调用 set_leverage"""
+    fake = FakeLeverageExchange()
+    state = LeverageState(fake)
+    state.seed('BTC/USDT:USDT')
+
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='long') is False
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='short') is True
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='short') is False
+    assert state.ensure('BTC/USDT', 3, pos_side='long') is True
+    assert fake.set_calls == [('BTC/USDT:USDT', 10, 'short'), ('BTC/USDT', 3, 'long')]
+
+
+def test_leverage_state_refreshes_from_other_process():
+    """其他进程修改杠杆后，持仓数据或记录过期会让本地状态重新同步"""
+    fake = FakeLeverageExchange()
+    state = LeverageState(fake, ttl=0.05)
+    state.seed('BTC/USDT:USDT')
+
+    # 持仓返回的实际杠杆与记录不同 (如 web_ui 改成了20倍)，需要重新设置
+    state.observe('BTC/USDT:USDT', {'lever': '20', 'posSide': 'long', 'mgnMode': 'isolated'})
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='long') is True
+
+    # 记录过期后视为未知，重新设置一次
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='long') is False
+    time.sleep(0.06)
+    assert state.ensure('BTC/USDT:USDT', 10, pos_side='long') is True
+    assert fake.set_calls == [('BTC/USDT:USDT', 10, 'long'), ('BTC/USDT:USDT', 10, 'long')]
+
+
+def test_rate_limited_exchange_budget():
+    """请求类方法消耗共享预算，其他属性原样转发"""
+    fake = FakeExchange()
+    limited = RateLimitedExchange(fake, RateLimiter(rate=20, burst=2))
+
+    start = time.monotonic()
+    for _ in range(4):
+        limited.fetch_ohlcv('BTC/USDT:USDT', '3m', limit=3)
+    elapsed = time.monotonic() - start
+
+    # 桶容量2，剩余2次按每秒20次补充，至少等待约0.1秒
+    assert elapsed >= 0.09
+    assert len(fake.calls) == 4
+    assert limited.parse_timeframe('3m') == 180
+    assert limited.now_ms == fake.now_ms
+
+
+def test_rate_limiter_async_shares_budget():
+    """异步请求与同步请求从同一个令牌桶取令牌，等待时不阻塞事件循环"""
+    limiter = RateLimiter(rate=20, burst=2)
+    limiter.acquire()
+    limiter.acquire()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        start = time.monotonic()
+        await limiter.acquire_async()
+        await limiter.acquire_async()
+        elapsed = time.monotonic() - start
+        task.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    # 同步请求已用完桶容量，两次异步请求至少等待约0.1秒，期间事件循环照常运行
+    assert elapsed >= 0.09
+    assert ticks >= 5
+
+
+def test_candle_cache_is_current():
+    """缓存包含最新收盘K线且刚刷新过时，预取可以跳过"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+    assert not cache.is_current('BTC/USDT:USDT', '3m', 10)
+    cache.get_bars('BTC/USDT:USDT', '3m', 10)
+    assert cache.is_current('BTC/USDT:USDT', '3m', 10)
+    assert not cache.is_current('BTC/USDT:USDT', '3m', 50)
+
+    fake.now_ms += 180000
+    assert not cache.is_current('BTC/USDT:USDT', '3m', 10)
+
+
+class SlowExchange(FakeExchange):
+    """每次请求耗时 delay 秒，记录同时进行的请求数"""
+
+    def __init__(self, delay=0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def fetch_ohlcv(self, symbol, timeframe='3m', since=None, limit=None, params=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return super().fetch_ohlcv(symbol, timeframe, since, limit, params)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_candle_cache_symbols_fetch_concurrently():
+    """不同币种的请求并发进行，同一币种的请求只发一次"""
+    fake = SlowExchange(delay=0.2)
+    cache = CandleCache(fake, refresh_interval=60)
+    symbols = [f"COIN{i}/USDT:USDT" for i in range(5)] + ['COIN0/USDT:USDT']
+    threads = [threading.Thread(target=cache.get_bars, args=(symbol, '3m', 5)) for symbol in symbols]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - started < 0.6
+    assert fake.max_in_flight == 5
+    assert len(fake.calls) == 5
+
+
+def test_background_backfill_blocks_only_same_series():
+    """后台分页补齐期间，同一K线序列的读取等待补齐完成 (不会拿到带缺口的K线)，其他币种不受影响"""
+    fake = SlowExchange(delay=0)
+    cache = CandleCache(fake, refresh_interval=60, background_backfill=True, page_limit=2)
+    closed = cache.get_closed_candles('BTC/USDT:USDT', '3m', 5)
+    cache.get_closed_candles('ETH/USDT:USDT', '3m', 5)
+    last_ts = closed[-1][0]
+
+    fake.delay = 0.3
+    fake.now_ms += 8 * 180000
+    cache.push_candle('BTC/USDT:USDT', '3m', fake.candle(last_ts + 8 * 180000), closed=True)
+    time.sleep(0.05)  # 后台线程开始请求第一页
+
+    started = time.time()
+    cache.push_candle('ETH/USDT:USDT', '3m', fake.candle(last_ts + 180000), closed=True)
+    assert cache.cached_closed('ETH/USDT:USDT', '3m')[-1][0] == last_ts + 180000
+    assert time.time() - started < 0.1
+
+    for candles in (cache.get_closed_candles('BTC/USDT:USDT', '3m', 12), cache.cached_closed('BTC/USDT:USDT', '3m')):
+        assert find_gaps(candles, 180000) == []
+        assert candles[-1][0] == last_ts + 8 * 180000
+    assert ('BTC/USDT:USDT', '3m') not in cache._gaps
+    assert cache.backfill_count >= 4
+
+
+def test_cached_closed_never_returns_gaps():
+    """缺口尚未补齐时，不发请求的读取只返回最后一个缺口之后的连续K线"""
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+    closed = cache.get_closed_candles('BTC/USDT:USDT', '3m', 5)
+    last_ts = closed[-1][0]
+    cache.push_candle('BTC/USDT:USDT', '3m', fake.candle(last_ts + 4 * 180000), closed=True)
+    cache.push_candle('BTC/USDT:USDT', '3m', fake.candle(last_ts + 5 * 180000), closed=True)
+
+    calls = len(fake.calls)
+    assert [c[0] for c in cache.cached_closed('BTC/USDT:USDT', '3m')] == [last_ts + 4 * 180000, last_ts + 5 * 180000]
+    assert len(fake.calls) == calls
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_candle_cache_incremental,
+        test_candle_cache_shared_between_limits,
+        test_candle_cache_long_gap_backfills,
+        test_closed_candles_cached_until_next_close,
+        test_push_candle_gap_backfilled,
+        test_backfill_in_background_and_exchange_holes,
+        test_get_bars_separates_forming_candle,
+        test_candle_cache_symbols_fetch_concurrently,
+        test_background_backfill_blocks_only_same_series,
+        test_cached_closed_never_returns_gaps,
+        test_exchange_clock_offset,
+        test_aggregate_candles_alignment,
+        test_bar_aggregator_derives_from_base,
+        test_bar_aggregator_holds_back_incomplete_bucket,
+        test_normalize_symbol,
+        test_position_snapshot_shared_and_invalidated,
+        test_ticker_cache_batches_and_expires,
+        test_symbol_registry_aliases,
+        test_symbol_registry_order_sizing,
+        test_leverage_state_skips_unchanged,
+        test_leverage_state_refreshes_from_other_process,
+        test_rate_limited_exchange_budget,
+        test_rate_limiter_async_shares_budget,
+        test_candle_cache_is_current,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
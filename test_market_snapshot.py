@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试共享内存行情快照 (写入进程 + 读取进程，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import multiprocessing
+import tempfile
+import time
+
+from market_snapshot import SnapshotWriter, SnapshotReader
+
+SYMBOLS = ['BTC/USDT', 'ETH/USDT']
+
+
+def snapshot_path():
+    return os.path.join(tempfile.mkdtemp(), 'snapshot.bin')
+
+
+def test_roundtrip():
+    """价格、K线、持仓写入后可读出，symbol 各种格式都能匹配"""
+    path = snapshot_path()
+    writer = SnapshotWriter(SYMBOLS, path, candles=3)
+    reader = SnapshotReader(path)
+    assert reader.read('BTC/USDT') is None
+
+    candles = [[1000 * i, 1, 2, 0.5, 1.5 + i, 10] for i in range(5)]
+    writer.update('BTC/USDT:USDT', last=101.5, candles=candles)
+    writer.update('BTC/USDT', mark=101.7, positions={'long': {'size': 2, 'entry_price': 95, 'unrealized_pnl': 13}})
+
+    snapshot = reader.read('BTC-USDT-SWAP')
+    assert snapshot['last'] == 101.5 and snapshot['mark'] == 101.7
+    assert [c[0] for c in snapshot['candles']] == [2000, 3000, 4000]
+    assert snapshot['candles'][-1][4] == 5.5
+    assert snapshot['positions'] == {'long': {'size': 2.0, 'entry_price': 95.0, 'unrealized_pnl': 13.0,
+                                              'leverage': 0.0, 'margin': 0.0, 'liquidation_price': 0.0,
+                                              'margin_ratio': 0.0, 'notional': 0.0}}
+    assert snapshot['positions_updated'] > 0
+    assert reader.last_price('BTC/USDT') == 101.5
+
+    # 只更新价格时K线时间不变，读取方可以单独判断K线是否过期
+    candles_updated = snapshot['candles_updated']
+    assert candles_updated > 0
+    time.sleep(0.01)
+    writer.update('BTC/USDT', last=102)
+    snapshot = reader.read('BTC/USDT')
+    assert snapshot['candles_updated'] == candles_updated and snapshot['updated'] > candles_updated
+
+    # 平仓后持仓清空，其他字段保留
+    writer.update('BTC/USDT', positions={})
+    snapshot = reader.read('BTC/USDT')
+    assert snapshot['positions'] == {} and snapshot['last'] == 102
+
+    assert reader.read('ETH/USDT') is None
+    assert reader.read('SOL/USDT') is None
+    writer.close()
+
+
+def test_max_age_and_writer_restart():
+    """过期快照不返回；写入方重建文件后读取方重新映射"""
+    path = snapshot_path()
+    writer = SnapshotWriter(SYMBOLS, path)
+    reader = SnapshotReader(path)
+    writer.update('ETH/USDT', last=3000)
+    time.sleep(0.05)
+    assert reader.read('ETH/USDT', max_age=0.01) is None
+    assert reader.last_price('ETH/USDT', max_age=10) == 3000
+
+    writer.close()
+    writer = SnapshotWriter(SYMBOLS + ['SOL/USDT'], path)
+    writer.update('SOL/USDT', last=150)
+    assert reader.last_price('SOL/USDT') == 150
+    assert reader.read('ETH/USDT') is None
+    writer.close()
+
+
+def _write_continuously(path, seconds):
+    writer = SnapshotWriter(SYMBOLS, path, candles=10)
+    deadline = time.time() + seconds
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        writer.update('BTC/USDT', last=i, mark=i, candles=[[j, i, i, i, i, i] for j in range(10)],
+                      positions={'long': {'size': i, 'entry_price': i}})
+
+
+def test_no_torn_reads_across_processes():
+    """另一个进程持续写入时，读到的每个快照字段都来自同一次写入"""
+    path = snapshot_path()
+    SnapshotWriter(SYMBOLS, path).close()
+    writer = multiprocessing.Process(target=_write_continuously, args=(path, 1.0))
+    writer.start()
+    reader = SnapshotReader(path)
+    reads = 0
+    try:
+        while writer.is_alive():
+            snapshot = reader.read('BTC/USDT')
+            if snapshot is None:
+                continue
+            value = snapshot['last']
+            assert snapshot['mark'] == value
+            assert all(c[4] == value for c in snapshot['candles'])
+            assert snapshot['positions']['long']['size'] == value
+            reads += 1
+    finally:
+        writer.join()
+    assert reads > 0
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_roundtrip,
+        test_max_age_and_writer_restart,
+        test_no_torn_reads_across_processes,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+测试 WebSocket 行情推送 (本地模拟 OKX 推送服务器，不访问网络)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import json
+import threading
+import time
+
+from aiohttp import web
+
+from market_data import CandleCache
+from market_stream import MarketStream, OKXStreamProtocol, BinanceStreamProtocol, okx_bar
+from test_market_data import FakeExchange
+
+
+class FakeOKXServer:
+    """本地模拟 OKX 推送服务器 - /business (K线) 和 /public (Ticker)"""
+
+    def __init__(self):
+        self.subscriptions = []
+        self.clients = {'/business': [], '/public': []}
+        self.connect_count = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def url(self, path):
+        return f"ws://127.0.0.1:{self.port}{path}"
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get('/business', self._handler)
+        app.router.add_get('/public', self._handler)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connect_count += 1
+        self.clients[request.path].append(ws)
+        try:
+            async for msg in ws:
+                if msg.data == 'ping':
+                    await ws.send_str('pong')
+                else:
+                    self.subscriptions.append((request.path, json.loads(msg.data)))
+        finally:
+            self.clients[request.path].remove(ws)
+        return ws
+
+    def push(self, path, message):
+        """向所有连接推送消息"""
+        async def send():
+            for ws in list(self.clients[path]):
+                await ws.send_str(json.dumps(message))
+        asyncio.run_coroutine_threadsafe(send(), self.loop).result(5)
+
+    def disconnect_all(self):
+        async def close():
+            for clients in self.clients.values():
+                for ws in list(clients):
+                    await ws.close()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def okx_candle(ts, close, confirm):
+    return [str(ts), '100', '110', '90', str(close), '12', '0', '0', '1' if confirm else '0']
+
+
+def start_stream(server, cache, **kwargs):
+    protocol = OKXStreamProtocol(candle_url=server.url('/business'), ticker_url=server.url('/public'))
+    stream = MarketStream(cache, {'BTC-USDT-SWAP': 'BTC/USDT:USDT'}, '3m', protocol, reconnect_delay=0.05, **kwargs)
+    stream.start()
+    assert wait_until(lambda: len(server.clients['/business']) == 1 and len(server.clients['/public']) == 1)
+    return stream
+
+
+def test_subscribe_and_candle_close_event():
+    """订阅K线/Ticker，收盘K线写入缓存并发出事件"""
+    server = FakeOKXServer().start()
+    fake = FakeExchange()
+    cache = CandleCache(fake, refresh_interval=60)
+    closed = []
+    stream = start_stream(server, cache, on_candle_closed=lambda *event: closed.append(event))
+    try:
+        assert wait_until(lambda: len(server.subscriptions) == 2)
+        channels = {path: msg['args'][0]['channel'] for path, msg in server.subscriptions}
+        assert channels == {'/business': 'candle3m', '/public': 'tickers'}
+
+        # 预先加载缓存
+        base = cache.get_candles('BTC/USDT:USDT', '3m', 5)
+        calls = len(fake.calls)
+        forming_ts = base[-1][0]
+        arg = {'channel': 'candle3m', 'instId': 'BTC-USDT-SWAP'}
+
+        server.push('/business', {'arg': arg, 'data': [okx_candle(forming_ts, 101.5, False)]})
+        assert wait_until(lambda: cache.get_candles('BTC/USDT:USDT', '3m', 5)[-1][4] == 101.5)
+        assert closed == []
+
+        server.push('/business', {'arg': arg, 'data': [okx_candle(forming_ts, 102.5, True)]})
+        assert stream.wait_for_closed(timeout=5) == ['BTC/USDT:USDT']
+        assert closed[0][:2] == ('BTC/USDT:USDT', '3m')
+        assert cache.cached_closed('BTC/USDT:USDT', '3m')[-1][:5] == [forming_ts, 100.0, 110.0, 90.0, 102.5]
+        # 推送期间不再轮询交易所
+        assert len(fake.calls) == calls
+
+        server.push('/public', {'arg': {'channel': 'tickers', 'instId': 'BTC-USDT-SWAP'},
+                                'data': [{'instId': 'BTC-USDT-SWAP', 'last': '103.2', 'ts': '1700000000000'}]})
+        assert wait_until(lambda: stream.latest_price('BTC/USDT:USDT') == 103.2)
+        assert stream.healthy()
+    finally:
+        stream.stop()
+
+
+def test_reconnect_resubscribes():
+    """服务端断开后自动重连并重新订阅"""
+    server = FakeOKXServer().start()
+    stream = start_stream(server, CandleCache(FakeExchange()))
+    try:
+        assert wait_until(lambda: len(server.subscriptions) == 2)
+        server.disconnect_all()
+        assert wait_until(lambda: len(server.subscriptions) == 4)
+        assert server.connect_count == 4
+    finally:
+        stream.stop()
+
+
+def test_binance_protocol_parse():
+    """Binance 组合流消息解析"""
+    protocol = BinanceStreamProtocol()
+    (url, [subscribe]), = protocol.connections(['BTCUSDT'], '3m')
+    assert json.loads(subscribe)['params'] == ['btcusdt@kline_3m', 'btcusdt@ticker']
+
+    kline = {'stream': 'btcusdt@kline_3m', 'data': {'e': 'kline', 's': 'BTCUSDT', 'k': {
+        't': 1700000000000, 'o': '1', 'h': '2', 'l': '0.5', 'c': '1.5', 'v': '10', 'x': True}}}
+    assert protocol.parse(json.dumps(kline)) == [('candle', 'BTCUSDT', [1700000000000, 1.0, 2.0, 0.5, 1.5, 10.0], True)]
+    assert okx_bar('4h') == '4H' and okx_bar('15m') == '15m'
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_subscribe_and_candle_close_event,
+        test_reconnect_resubscribes,
+        test_binance_protocol_parse,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
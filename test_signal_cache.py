@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试AI信号缓存 (行情状态指纹、过期和失效)
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from signal_cache import SignalCache, price_bucket
+
+SIGNAL = {'signal': 'BUY', 'reason': '突破', 'stop_loss': 99000, 'take_profit': 110000, 'confidence': 'HIGH'}
+
+
+def test_price_bucket():
+    """价格按百分比分档，小幅波动落在同一档"""
+    assert price_bucket(100000, 0.2) == price_bucket(100050, 0.2)
+    assert price_bucket(100000, 0.2) != price_bucket(100500, 0.2)
+    assert price_bucket(0.18, 0.2) == price_bucket(0.18005, 0.2)
+    assert price_bucket(0, 0.2) is None
+
+
+def test_fingerprint_hit_and_miss():
+    """指纹相同时复用缓存信号，价格档位、趋势、持仓或K线变化时失效"""
+    cache = SignalCache(ttl=600, price_step_pct=0.2)
+    base = dict(trends=('bullish', 'bullish'), position_side=None, candle_id=1000)
+    fingerprint = cache.fingerprint(100000, **base)
+    assert cache.get('BTC/USDT', fingerprint) is None
+    cache.put('BTC/USDT', fingerprint, SIGNAL)
+
+    cached = cache.get('BTC/USDT', cache.fingerprint(100050, **base))
+    assert cached == SIGNAL
+    cached['timestamp'] = 'x'  # 调用方修改副本不影响缓存
+    assert 'timestamp' not in cache.get('BTC/USDT', fingerprint)
+
+    for changed in (dict(base, trends=('bullish', 'bearish')), dict(base, position_side='long'),
+                    dict(base, candle_id=2000)):
+        assert cache.get('BTC/USDT', cache.fingerprint(100000, **changed)) is None
+    assert cache.get('BTC/USDT', cache.fingerprint(101000, **base)) is None
+    assert cache.get('ETH/USDT', fingerprint) is None
+    assert cache.stats()['hits'] == 2
+
+
+def test_ttl_and_invalidate():
+    """超过有效期或手动失效后重新请求"""
+    cache = SignalCache(ttl=600)
+    fingerprint = cache.fingerprint(3800, candle_id=1)
+    cache.put('ETH/USDT', fingerprint, SIGNAL)
+    cache._entries['ETH/USDT'] = cache._entries['ETH/USDT'][:2] + (cache._entries['ETH/USDT'][2] - 601,)
+    assert cache.get('ETH/USDT', fingerprint) is None
+
+    cache.put('ETH/USDT', fingerprint, SIGNAL)
+    cache.invalidate('ETH/USDT')
+    assert cache.get('ETH/USDT', fingerprint) is None
+    cache.put('ETH/USDT', fingerprint, SIGNAL)
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+
+
+def main():
+    """运行所有测试"""
+    tests = [
+        test_price_bucket,
+        test_fingerprint_hit_and_miss,
+        test_ttl_and_invalidate,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n全部通过: {len(tests)} 项")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from datetime import datetime
 from dotenv import load_dotenv
 import threading
 import time
+import math
 from collections import deque
 import subprocess
 import signal
@@ -15,10 +16,14 @@ from functools import wraps
 
 load_dotenv()
 from deepseek import (
-    TRADE_CONFIG, get_current_position, get_ohlcv,
+    TRADE_CONFIG, get_current_position, get_ohlcv, build_price_data,
     price_history, signal_history, positions, exchange,
-    analyze_with_ai, execute_trade, EXCHANGE_TYPE
+    analyze_symbol, analyze_symbols_batch, execute_trade, EXCHANGE_TYPE, position_snapshot,
+    get_trade_symbol, symbol_registry, leverage_state, run_symbol_pipelines,
+    analyze_trends_batch, start_market_stream
 )
+from market_broker import broker_running
+from market_snapshot import SnapshotReader
 
 # 导入混合策略
 try:
@@ -75,12 +80,21 @@ def check_login():
 # 自动交易线程控制
 auto_trade_thread = None
 auto_trade_running = False
+market_stream = None  # WebSocket行情推送 (自动交易启动时创建)
+
+# 策略进程写入的共享内存行情快照
+snapshot_reader = SnapshotReader()
+SNAPSHOT_CYCLE_SECONDS = ccxt.Exchange.parse_timeframe(TRADE_CONFIG['timeframe'])  # 策略进程的K线/交易周期
+SNAPSHOT_PRICE_MAX_AGE = 10  # 最新价快照的最大允许延迟(秒)，行情推送每次ticker都会写入
+SNAPSHOT_CANDLE_MAX_AGE = SNAPSHOT_CYCLE_SECONDS + 30  # K线快照的最大允许延迟(秒)，每根K线收盘后写入一次
+SNAPSHOT_POSITION_MAX_AGE = SNAPSHOT_CYCLE_SECONDS + 60  # 持仓快照的最大允许延迟(秒)，每轮交易循环写入一次
 
 # 交易操作日志（最多保存100条）
 trade_logs = deque(maxlen=100)
 
 # 策略进程管理
 strategy_processes = {}
+market_broker_process = None  # 行情代理进程 (各策略共享交易所行情连接)
 
 # 可用策略列表
 AVAILABLE_STRATEGIES = {
@@ -118,6 +132,31 @@ AVAILABLE_STRATEGIES = {
     }
 }
 
+def ensure_market_broker():
+    """启动行情代理进程，策略进程启动时自动接入 (已在运行则跳过；Windows 下各策略直连交易所)"""
+    global market_broker_process
+    if platform.system() == 'Windows' or broker_running():
+        return
+    if market_broker_process is not None and market_broker_process.poll() is None:
+        return
+    try:
+        # 代理进程长期运行，输出不接管道，避免缓冲区写满阻塞
+        market_broker_process = subprocess.Popen(
+            ['python3', 'market_broker.py'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=os.setsid
+        )
+        # 等待 socket 就绪，之后启动的策略进程即可连接
+        for _ in range(50):
+            if broker_running():
+                print(f"📡 行情代理已启动 (PID: {market_broker_process.pid})")
+                return
+            time.sleep(0.1)
+        print("⚠️  行情代理未就绪，策略将直连交易所")
+    except Exception as e:
+        print(f"❌ 启动行情代理失败: {e}")
+
 # ==================== 登录相关路由 ====================
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -230,6 +269,36 @@ def get_spot_balance_api():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def snapshot_positions(symbol):
+    """从共享内存快照读取持仓，快照不可用、过期或本进程之后下过单时返回 None"""
+    snapshot = snapshot_reader.read(symbol)
+    if snapshot is None or not snapshot['positions_updated']:
+        return None
+    updated = snapshot['positions_updated']
+    if time.time() - updated > SNAPSHOT_POSITION_MAX_AGE or updated < position_snapshot.invalidated_at:
+        return None
+    return [
+        dict(fields, symbol=symbol, side=side,
+             position_amt=fields['size'] if side == 'long' else -fields['size'], raw_symbol=symbol)
+        for side, fields in snapshot['positions'].items()
+    ]
+
+
+def snapshot_market_data(symbol):
+    """用共享内存快照组装与 get_ohlcv 相同的行情数据 (同一个 build_price_data)，快照不可用时返回 None"""
+    snapshot = snapshot_reader.read(symbol)
+    if snapshot is None or len(snapshot['candles']) < 2:
+        return None
+    # K线和最新价分别判断是否过期 (ticker写入不代表K线是新的)
+    now = time.time()
+    if now - snapshot['candles_updated'] > SNAPSHOT_CANDLE_MAX_AGE:
+        return None
+    price = snapshot['last']
+    if math.isnan(price) or now - snapshot['updated'] > SNAPSHOT_PRICE_MAX_AGE:
+        price = None
+    return build_price_data(symbol, snapshot['candles'], price)
+
+
 @app.route('/api/status')
 def get_status():
     """获取整体状态"""
@@ -253,7 +322,10 @@ def get_status():
         try:
             for symbol in TRADE_CONFIG['symbols']:
                 try:
-                    pos = get_current_position(symbol)
+                    # 优先读取共享内存快照，不可用时查询交易所
+                    pos = snapshot_positions(symbol)
+                    if pos is None:
+                        pos = get_current_position(symbol)
                     if pos:
                         # 处理单个持仓或多个持仓
                         if isinstance(pos, list):
@@ -293,78 +365,118 @@ def get_status():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)})
 
-def auto_trade_worker():
-    """自动交易后台任务"""
-    global auto_trade_running
+def auto_trade_symbol(symbol):
+    """自动交易 - 单个币种的处理流程 (本地预筛后才请求AI，与 trading_bot 一致)"""
+    if not TRADE_CONFIG.get('auto_trade', False):
+        return
 
-    print("🤖 自动交易线程已启动")
+    try:
+        print(f"\n📊 分析 {symbol}...")
 
-    while auto_trade_running and TRADE_CONFIG.get('auto_trade', False):
-        try:
-            print(f"\n{'='*60}")
-            print(f"🔄 开始新一轮自动交易分析 - {datetime.now().strftime('%H:%M:%S')}")
-            print(f"{'='*60}")
+        # 获取市场数据
+        price_data = get_ohlcv(symbol)
+        if not price_data:
+            print(f"  ⚠️  无法获取{symbol}市场数据")
+            return
 
-            for symbol in TRADE_CONFIG['symbols']:
-                if not TRADE_CONFIG.get('auto_trade', False):
-                    break
+        # 本地预筛 + AI分析
+        signal_data = analyze_symbol(price_data)
+        if not signal_data:
+            print(f"  ⏸️  {symbol} 本轮无交易信号 (AI预筛跳过或分析失败)")
+            return
 
-                try:
-                    print(f"\n📊 分析 {symbol}...")
+        execute_auto_trade(symbol, signal_data, price_data)
 
-                    # 获取市场数据
-                    price_data = get_ohlcv(symbol)
-                    if not price_data:
-                        print(f"  ⚠️  无法获取{symbol}市场数据")
-                        continue
+    except Exception as e:
+        print(f"  ❌ {symbol} 处理失败: {e}")
 
-                    # AI分析
-                    signal_data = analyze_with_ai(price_data)
-                    if not signal_data:
-                        print(f"  ⚠️  {symbol} AI分析失败")
-                        continue
+def execute_auto_trade(symbol, signal_data, price_data):
+    """自动交易 - 记录信号并执行交易"""
+    try:
+        print(f"  📈 {symbol} 信号: {signal_data['signal']}")
+        print(f"  💪 {symbol} 信心: {signal_data['confidence']}")
+        print(f"  📝 {symbol} 理由: {signal_data['reason']}")
 
-                    print(f"  📈 信号: {signal_data['signal']}")
-                    print(f"  💪 信心: {signal_data['confidence']}")
-                    print(f"  📝 理由: {signal_data['reason']}")
+        # 预筛跳过的 HOLD 信号 (未请求AI) 记为跳过
+        if signal_data.get('gated'):
+            log_message = f"AI预筛跳过: {signal_data['reason']}"
+        else:
+            log_message = f"AI信号: {signal_data['signal']} (信心: {signal_data['confidence']})"
+        add_trade_log(
+            'analysis',
+            symbol,
+            'auto_trade',
+            log_message,
+            success=True,
+            details={
+                'signal': signal_data['signal'],
+                'confidence': signal_data['confidence'],
+                'reason': signal_data.get('reason', '')
+            }
+        )
+
+        # 执行交易（使用合约交易逻辑）
+        trade_events = execute_trade(signal_data, price_data) or []
+        for event in trade_events:
+            event_symbol = event.get('symbol', symbol)
+            add_trade_log(
+                event.get('type', 'trade'),
+                event_symbol,
+                event.get('action', 'auto_trade'),
+                event.get('message', ''),
+                success=event.get('success', True),
+                details=event.get('details')
+            )
+            if event.get('message'):
+                print(f"  📋 {event['message']}")
 
-                    add_trade_log(
-                        'analysis',
-                        symbol,
-                        'auto_trade',
-                        f"AI信号: {signal_data['signal']} (信心: {signal_data['confidence']})",
-                        success=True,
-                        details={
-                            'signal': signal_data['signal'],
-                            'confidence': signal_data['confidence'],
-                            'reason': signal_data.get('reason', '')
-                        }
-                    )
+    except Exception as e:
+        print(f"  ❌ {symbol} 处理失败: {e}")
 
-                    # 执行交易（使用合约交易逻辑）
-                    trade_events = execute_trade(signal_data, price_data) or []
-                    for event in trade_events:
-                        event_symbol = event.get('symbol', symbol)
-                        add_trade_log(
-                            event.get('type', 'trade'),
-                            event_symbol,
-                            event.get('action', 'auto_trade'),
-                            event.get('message', ''),
-                            success=event.get('success', True),
-                            details=event.get('details')
-                        )
-                        if event.get('message'):
-                            print(f"  📋 {event['message']}")
+def auto_trade_cycle():
+    """自动交易 - 一轮分析 (批量模式下各币种合并为一次AI请求)"""
+    if not TRADE_CONFIG['ai_batch_prompt']:
+        run_symbol_pipelines(auto_trade_symbol)
+        return
 
-                except Exception as e:
-                    print(f"  ❌ {symbol} 处理失败: {e}")
+    price_data = {symbol: data for symbol, data in run_symbol_pipelines(get_ohlcv).items() if data}
+    signals = analyze_symbols_batch(price_data)
+    if TRADE_CONFIG.get('auto_trade', False) and signals:
+        run_symbol_pipelines(lambda symbol: execute_auto_trade(symbol, signals[symbol], price_data[symbol]),
+                             list(signals))
 
-                # 避免请求过快
-                time.sleep(2)
+def auto_trade_worker():
+    """自动交易后台任务"""
+    global auto_trade_running, market_stream
 
-            # 等待下一轮(3分钟)
-            print(f"\n⏰ 等待下一轮分析 (3分钟)...")
-            time.sleep(3 * 60)
+    print("🤖 自动交易线程已启动")
+
+    # 行情推送: K线收盘后立即开始下一轮
+    if TRADE_CONFIG['market_stream'] and market_stream is None:
+        market_stream = start_market_stream()
+
+    while auto_trade_running and TRADE_CONFIG.get('auto_trade', False):
+        try:
+            print(f"\n{'='*60}")
+            print(f"🔄 开始新一轮自动交易分析 - {datetime.now().strftime('%H:%M:%S')}")
+            print(f"{'='*60}")
+
+            # 各币种并发处理 (请求频率由共享的交易所请求预算控制)
+            position_snapshot.invalidate()
+            if TRADE_CONFIG['batch_indicators']:
+                analyze_trends_batch()
+            auto_trade_cycle()
+
+            # 等待下一轮: 行情推送正常时等到K线收盘，否则等待3分钟
+            if market_stream and market_stream.healthy():
+                print(f"\n⏰ 等待K线收盘...")
+                deadline = time.time() + 3 * 60
+                while auto_trade_running and time.time() < deadline:
+                    if market_stream.wait_for_closed(timeout=1):
+                        break
+            else:
+                print(f"\n⏰ 等待下一轮分析 (3分钟)...")
+                time.sleep(3 * 60)
 
         except Exception as e:
             print(f"❌ 自动交易循环错误: {e}")
@@ -417,7 +529,7 @@ def toggle_auto_trade():
 def get_market_data(symbol):
     """获取市场数据"""
     try:
-        price_data = get_ohlcv(symbol)
+        price_data = snapshot_market_data(symbol) or get_ohlcv(symbol)
         return jsonify({
             'success': True,
             'data': price_data
@@ -660,8 +772,8 @@ def manual_analysis():
         if not price_data:
             return jsonify({'success': False, 'error': f'获取{symbol}市场数据失败'})
 
-        # 执行AI分析
-        signal_data = analyze_with_ai(price_data)
+        # 手动分析是用户明确请求，不经过本地预筛 (行情指纹相同时仍复用缓存信号)
+        signal_data = analyze_symbol(price_data, force=True)
         if not signal_data:
             add_trade_log('analysis', symbol, 'analyze', f'AI分析失败', success=False)
             return jsonify({'success': False, 'error': f'AI分析{symbol}失败'})
@@ -678,7 +790,8 @@ def manual_analysis():
         # 如果启用自动执行，则根据信号执行交易
         trade_executed = False
         trade_message = ''
-        if auto_execute and signal_data['signal'] in ['BUY', 'SELL']:
+        # 没有经过本轮AI分析的信号 (预筛跳过) 不自动下单
+        if auto_execute and signal_data['signal'] in ['BUY', 'SELL'] and not signal_data.get('gated'):
             try:
                 trade_events = execute_trade(signal_data, price_data) or []
                 for event in trade_events:
@@ -717,9 +830,7 @@ def get_recent_orders(symbol):
     """获取最近的订单"""
     try:
         # OKX合约需要使用 BTC/USDT:USDT 格式
-        trade_symbol = symbol
-        if EXCHANGE_TYPE == 'okx' and ':' not in symbol:
-            trade_symbol = f"{symbol}:USDT"
+        trade_symbol = get_trade_symbol(symbol)
 
         # OKX需要分别获取开仓和已平仓订单
         open_orders = exchange.fetch_open_orders(trade_symbol)
@@ -964,9 +1075,7 @@ def manual_execute():
         original_symbol = symbol
 
         # OKX合约需要使用 BTC/USDT:USDT 格式
-        trade_symbol = symbol
-        if EXCHANGE_TYPE == 'okx' and ':' not in symbol:
-            trade_symbol = f"{symbol}:USDT"
+        trade_symbol = get_trade_symbol(symbol)
 
         if action == 'close':
             # 使用原始symbol查询持仓
@@ -995,8 +1104,7 @@ def manual_execute():
                             side = 'sell' if position['side'] == 'long' else 'buy'
 
                             # 转换交易对格式：BNB/USDT -> BNB-USDT-SWAP
-                            base_symbol = original_symbol.replace('/USDT', '')
-                            okx_inst_id = f'{base_symbol}-USDT-SWAP'
+                            okx_inst_id = symbol_registry.inst_id(original_symbol)
 
                             # 使用OKX原生API平仓
                             result = exchange.private_post_trade_order({
@@ -1022,8 +1130,10 @@ def manual_execute():
                                         success=True,
                                         details={'dry_run': False, 'size': position['size'], 'side': position['side'], 'pnl': position.get('unrealized_pnl', 0)})
 
+                    position_snapshot.invalidate()
                     return jsonify({'success': True, 'message': '平仓成功', 'dry_run': False})
                 except Exception as e:
+                    position_snapshot.invalidate()
                     add_trade_log('trade', original_symbol, 'close', f'平仓失败: {str(e)}', success=False)
                     return jsonify({'success': False, 'error': f'平仓失败: {str(e)}'})
             add_trade_log('trade', original_symbol, 'close', '无持仓，无法平仓', success=False)
@@ -1035,10 +1145,8 @@ def manual_execute():
 
             # 计算合约张数（OKX）
             if EXCHANGE_TYPE == 'okx':
-                # 加载市场信息获取合约面值
-                exchange.load_markets()
-                market = exchange.market(trade_symbol)
-                contract_size = market.get('contractSize', 1)  # 每张合约的币数
+                # 读取预先缓存的合约面值 (不在下单路径上请求市场信息)
+                contract_size = symbol_registry.order_sizing(trade_symbol)['contract_size']  # 每张合约的币数
 
                 # 使用杠杆计算购买力
                 buying_power = amount * leverage  # 保证金 × 杠杆 = 购买力
@@ -1069,8 +1177,8 @@ def manual_execute():
                 if EXCHANGE_TYPE == 'okx':
                     # 设置杠杆（使用用户选择的倍数）
                     try:
-                        exchange.set_leverage(leverage, trade_symbol, params={'mgnMode': 'isolated', 'posSide': 'long'})
-                        print(f"✅ 设置杠杆: {leverage}x")
+                        if leverage_state.ensure(trade_symbol, leverage, pos_side='long'):
+                            print(f"✅ 设置杠杆: {leverage}x")
                     except Exception as e:
                         print(f"设置杠杆警告: {e}")
                         pass  # 如果已经设置过杠杆会报错，忽略
@@ -1090,10 +1198,11 @@ def manual_execute():
                 else:
                     # Binance先设置杠杆
                     try:
-                        exchange.set_leverage(leverage, trade_symbol)
+                        leverage_state.ensure(trade_symbol, leverage)
                     except Exception as e:
                         print(f"设置杠杆警告: {e}")
                     order = exchange.create_limit_order(trade_symbol, 'buy', amount_contracts, limit_price)
+                position_snapshot.invalidate()
                 add_trade_log('trade', original_symbol, 'buy',
                             f'开多成功: {amount_contracts:.4f}张 @ ${limit_price:.2f}',
                             success=True,
@@ -1109,10 +1218,8 @@ def manual_execute():
 
             # 计算合约张数（OKX）
             if EXCHANGE_TYPE == 'okx':
-                # 加载市场信息获取合约面值
-                exchange.load_markets()
-                market = exchange.market(trade_symbol)
-                contract_size = market.get('contractSize', 1)  # 每张合约的币数
+                # 读取预先缓存的合约面值 (不在下单路径上请求市场信息)
+                contract_size = symbol_registry.order_sizing(trade_symbol)['contract_size']  # 每张合约的币数
 
                 # 使用杠杆计算购买力
                 buying_power = amount * leverage  # 保证金 × 杠杆 = 购买力
@@ -1134,8 +1241,8 @@ def manual_execute():
                 if EXCHANGE_TYPE == 'okx':
                     # 设置杠杆（使用用户选择的倍数）
                     try:
-                        exchange.set_leverage(leverage, trade_symbol, params={'mgnMode': 'isolated', 'posSide': 'short'})
-                        print(f"✅ 设置杠杆: {leverage}x")
+                        if leverage_state.ensure(trade_symbol, leverage, pos_side='short'):
+                            print(f"✅ 设置杠杆: {leverage}x")
                     except Exception as e:
                         print(f"设置杠杆警告: {e}")
                         pass  # 如果已经设置过杠杆会报错，忽略
@@ -1155,10 +1262,11 @@ def manual_execute():
                 else:
                     # Binance先设置杠杆
                     try:
-                        exchange.set_leverage(leverage, trade_symbol)
+                        leverage_state.ensure(trade_symbol, leverage)
                     except Exception as e:
                         print(f"设置杠杆警告: {e}")
                     order = exchange.create_limit_order(trade_symbol, 'sell', amount_contracts, limit_price)
+                position_snapshot.invalidate()
                 add_trade_log('trade', original_symbol, 'sell',
                             f'开空成功: {amount_contracts:.4f}张 @ ${limit_price:.2f}',
                             success=True,
@@ -1221,6 +1329,9 @@ def start_strategy(strategy_id):
         if not os.path.exists(script_path):
             return jsonify({'success': False, 'error': f'策略文件不存在: {script_path}'})
 
+        # 策略进程共享行情代理
+        ensure_market_broker()
+
         # 跨平台进程启动
         is_windows = platform.system() == 'Windows'
         python_cmd = 'python' if is_windows else 'python3'
@@ -1343,6 +1454,9 @@ if __name__ == '__main__':
     # 只监控存在的文件
     extra_files = [f for f in extra_files if os.path.exists(f)]
 
+    # 启动行情代理，之后启动的策略进程共享同一个交易所行情连接
+    ensure_market_broker()
+
     # 自动启动标记为 auto_start 的策略
     print("🔍 检查自动启动策略...")
     for strategy_id, strategy_info in AVAILABLE_STRATEGIES.items():
@@ -1379,6 +1493,9 @@ if __name__ == '__main__':
             else:
                 print(f"⚠️  策略文件不存在: {script_path}")
 
+    # 预加载市场信息并在后台定期刷新
+    symbol_registry.start_auto_refresh()
+
     print("🚀 启动AI交易机器人Web界面...")
     print("📡 访问地址: http://localhost:8888")
     print("🔄 热重载已启用 - 修改代码将自动重启")